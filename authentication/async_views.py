@@ -0,0 +1,204 @@
+"""
+Async варианты OTP эндпоинтов для ASGI (uvicorn)
+
+Подключаются вместо views.* при OTP_ASYNC_VIEWS=True (см. authentication/urls.py).
+Ожидание Telegram Gateway и GreenSMS не занимает поток: один воркер uvicorn
+держит одновременно сотни вызовов провайдеров, ограниченных пулом
+PROVIDER_ASYNC_POOL_SIZE.
+
+Контракт запросов и ответов тот же, что у views.*: те же сериализаторы,
+троттлинг (MultiKeyRateThrottle) и тексты ошибок. Эндпоинты анонимные, поэтому
+аутентификация DRF не выполняется.
+"""
+import math
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+
+from .dispatch import STATUS_QUEUED
+from .otp_service import get_otp_service
+from .serializers import CodeVerificationSerializer, PhoneVerificationSerializer
+from .throttling import AnonAuthThrottle, OTPSendThrottle, OTPVerifyThrottle
+
+User = get_user_model()
+
+
+def _response(data, status_code, headers=None):
+    return JsonResponse(data, status=status_code, headers=headers, json_dumps_params={'ensure_ascii': False})
+
+
+def _drf_request(request):
+    """Request DRF для сериализаторов и троттлинга (без аутентификации)"""
+    return Request(request, parsers=[JSONParser(), FormParser(), MultiPartParser()], authenticators=())
+
+
+async def _throttle(drf_request, throttle_classes):
+    """Проверяет лимиты как DRF; возвращает ответ 429 или None"""
+    def check():
+        return [
+            throttle.wait()
+            for throttle in (throttle_class() for throttle_class in throttle_classes)
+            if not throttle.allow_request(drf_request, None)
+        ]
+
+    waits = await sync_to_async(check, thread_sensitive=False)()
+    if not waits:
+        return None
+
+    wait = max(waits)
+    return _response(
+        {'detail': str(Throttled(wait).detail)},
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(math.ceil(wait))}
+    )
+
+
+@csrf_exempt
+@require_POST
+async def send_verification_code(request):
+    """Отправка кода подтверждения через Telegram или SMS"""
+    drf_request = _drf_request(request)
+    throttled = await _throttle(drf_request, [OTPSendThrottle])
+    if throttled:
+        return throttled
+
+    serializer = PhoneVerificationSerializer(data=drf_request.data)
+
+    if not serializer.is_valid():
+        return _response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    phone = serializer.validated_data['phone']
+    is_reset = serializer.validated_data.get('is_reset', False)
+    prefer_telegram = drf_request.data.get('prefer_telegram', True)
+
+    # Проверяем, зарегистрирован ли номер
+    user_exists = await User.objects.filter(phone=phone).aexists()
+
+    if user_exists and not is_reset:
+        return _response({
+            'error': 'Номер уже зарегистрирован. Используйте is_reset=true для восстановления пароля'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    if not user_exists and is_reset:
+        return _response({
+            'error': 'Пользователь с таким номером не найден'
+        }, status.HTTP_404_NOT_FOUND)
+
+    otp_service = get_otp_service()
+
+    if settings.OTP_DISPATCH_MODE == 'queue':
+        result = await sync_to_async(otp_service.enqueue_verification_code)(phone, prefer_telegram=prefer_telegram)
+        if not result['success']:
+            return _response({
+                'error': result['message']
+            }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return _response({
+            'message': result['message'],
+            'phone': phone,
+            'dispatch_id': result['dispatch_id'],
+            'status': STATUS_QUEUED,
+            'is_reset': is_reset
+        }, status.HTTP_202_ACCEPTED)
+
+    result = await otp_service.asend_verification_code(phone, prefer_telegram=prefer_telegram)
+
+    if not result['success']:
+        return _response({
+            'error': result['message']
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return _response({
+        'message': result['message'],
+        'phone': phone,
+        'method': result['method'],
+        'telegram_available': result['telegram_available'],
+        'fallback_required': result.get('fallback_required', False),
+        'is_reset': is_reset
+    }, status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+async def verify_code(request):
+    """Проверка кода подтверждения"""
+    drf_request = _drf_request(request)
+    throttled = await _throttle(drf_request, [OTPVerifyThrottle])
+    if throttled:
+        return throttled
+
+    serializer = CodeVerificationSerializer(data=drf_request.data)
+
+    if not serializer.is_valid():
+        return _response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    phone = serializer.validated_data['phone']
+    is_valid = await get_otp_service().averify_code(phone, serializer.validated_data['code'])
+
+    if not is_valid:
+        return _response({
+            'error': 'Неверный или истекший код'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    return _response({
+        'message': 'Код подтвержден успешно',
+        'phone': phone,
+        'verified': True
+    }, status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+async def send_sms_fallback(request):
+    """Отправка SMS кода как резервный вариант"""
+    drf_request = _drf_request(request)
+    throttled = await _throttle(drf_request, [OTPSendThrottle])
+    if throttled:
+        return throttled
+
+    serializer = PhoneVerificationSerializer(data=drf_request.data)
+
+    if not serializer.is_valid():
+        return _response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    phone = serializer.validated_data['phone']
+    result = await get_otp_service().asend_sms_fallback(phone)
+
+    if not result['success']:
+        return _response({
+            'error': result['message']
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return _response({
+        'message': result['message'],
+        'phone': phone
+    }, status.HTTP_200_OK)
+
+
+@require_GET
+async def check_telegram_availability(request):
+    """Проверка доступности Telegram для номера"""
+    throttled = await _throttle(_drf_request(request), [AnonAuthThrottle])
+    if throttled:
+        return throttled
+
+    phone = request.GET.get('phone')
+
+    if not phone:
+        return _response({
+            'error': 'Номер телефона обязателен'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    telegram_available = await get_otp_service().acheck_telegram_availability(phone)
+
+    return _response({
+        'telegram_available': telegram_available,
+        'phone': phone
+    }, status.HTTP_200_OK)
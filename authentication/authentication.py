@@ -0,0 +1,81 @@
+"""
+Аутентификация DRF по токенам AuthToken
+"""
+import uuid
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .cache_utils import TokenCache
+from .tokens import SignedAccessToken
+
+
+class AuthTokenAuthentication(BaseAuthentication):
+    """
+    Аутентификация по заголовку `Authorization: Bearer <uuid>`
+
+    Токен ищется через TokenCache, поэтому БД запрашивается только при промахе кэша.
+    Подписанные access токены проверяются внутри процесса без обращения к БД и
+    принимаются только при SIGNED_ACCESS_TOKENS_ENABLED.
+    Для совместимости также принимается префикс `Token`.
+    """
+
+    keywords = ('bearer', 'token')
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower().decode() not in self.keywords:
+            return None
+
+        if len(auth) != 2:
+            raise AuthenticationFailed('Неверный заголовок авторизации')
+
+        try:
+            credentials = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Неверный формат токена')
+
+        if SignedAccessToken.is_signed_token(credentials):
+            return self.authenticate_access_token(credentials)
+
+        try:
+            token = uuid.UUID(credentials)
+        except ValueError:
+            raise AuthenticationFailed('Неверный формат токена')
+
+        return self.authenticate_credentials(token)
+
+    def authenticate_credentials(self, token):
+        """Проверяет токен и возвращает пару (пользователь, токен)"""
+        user = TokenCache.get_user(token)
+
+        if user is None:
+            raise AuthenticationFailed('Недействительный или просроченный токен')
+
+        if not user.is_active:
+            raise AuthenticationFailed('Аккаунт деактивирован')
+
+        return (user, token)
+
+    def authenticate_access_token(self, access_token):
+        """Проверяет подписанный access токен и возвращает пару (пользователь, payload)"""
+        # После отключения подписанных токенов ранее выданные не должны действовать
+        # до конца своего срока
+        if not settings.SIGNED_ACCESS_TOKENS_ENABLED:
+            raise AuthenticationFailed('Недействительный или просроченный токен')
+
+        payload = SignedAccessToken.verify(access_token)
+
+        if payload is None:
+            raise AuthenticationFailed('Недействительный или просроченный токен')
+
+        user = TokenCache.get_cached_user(payload['uid'])
+
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('Недействительный или просроченный токен')
+
+        return (user, payload)
+
+    def authenticate_header(self, request):
+        return 'Bearer'
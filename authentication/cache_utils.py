@@ -3,9 +3,14 @@
 """
 from django.core.cache import cache
 from django.conf import settings
+from collections import OrderedDict
 import json
 import hashlib
-from typing import Any, Optional, Dict
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django_redis import get_redis_connection
 
 
 class CacheManager:
@@ -56,8 +61,153 @@ class CacheManager:
         return cache.get(key)
 
 
+class RateLimitResult(NamedTuple):
+    """Результат проверки лимита"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_at: float  # Unix-время, когда окно полностью освободится
+    retry_after: float  # Через сколько секунд повторить запрос (0, если разрешен)
+
+
+def run_lua_script(source: str, keys: List[str], args: List[Any], client=None):
+    """
+    Выполняет Lua скрипт в Redis через EVALSHA
+    
+    client может быть pipeline - тогда скрипт выполнится при pipe.execute().
+    """
+    if client is None:
+        client = get_redis_connection('default')
+    
+    script = _lua_scripts.get(source)
+    if script is None:
+        script = _lua_scripts[source] = client.register_script(source)
+    
+    return script(keys=keys, args=args, client=client)
+
+
+_lua_scripts = {}
+
+
 class RateLimiter:
-    """Ограничитель скорости запросов"""
+    """
+    Ограничитель скорости запросов (GCRA)
+    
+    Скользящее окно: limit запросов за window секунд, с равномерным
+    восстановлением квоты. Проверка и списание - один Lua скрипт, время
+    берется с сервера Redis (TIME), поэтому воркеры с разными часами
+    считают одинаково.
+    """
+    
+    # KEYS[i] - ключ i-го лимита; ARGV[3i-2], ARGV[3i-1], ARGV[3i] - limit, window (с), стоимость
+    # Квота списывается со всех ключей, только если разрешают все.
+    # Возвращает по каждому ключу {allowed, remaining, reset_after (мкс), retry_after (мкс)}
+    GCRA_SCRIPT = """
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+    
+    local results = {}
+    local updates = {}
+    local all_allowed = true
+    
+    for i, key in ipairs(KEYS) do
+        local limit = tonumber(ARGV[i * 3 - 2])
+        local period = tonumber(ARGV[i * 3 - 1]) * 1000000
+        local cost = tonumber(ARGV[i * 3])
+        local interval = math.floor(period / limit)
+        
+        local tat = tonumber(redis.call('GET', key))
+        if not tat or tat < now then
+            tat = now
+        end
+        
+        local new_tat = tat + cost * interval
+        local allow_at = new_tat - period
+        if now < allow_at then
+            all_allowed = false
+            results[i] = {0, 0, tat - now, allow_at - now}
+        else
+            local remaining = math.floor((now - allow_at) / interval)
+            if remaining > limit - cost then
+                remaining = limit - cost
+            end
+            results[i] = {1, remaining, new_tat - now, 0}
+            updates[i] = {new_tat, tat, math.min(remaining + cost, limit)}
+        end
+    end
+    
+    for i, update in pairs(updates) do
+        if all_allowed then
+            if update[1] > update[2] then
+                redis.call('SET', KEYS[i], string.format('%d', update[1]), 'PX', math.ceil((update[1] - now) / 1000))
+            end
+        else
+            -- Запрос отклонен другим лимитом: квота этого ключа не расходуется
+            results[i] = {1, update[3], update[2] - now, 0}
+        end
+    end
+    
+    return results
+    """
+    
+    @staticmethod
+    def _key(identifier: str) -> str:
+        return cache.make_key(f"rate_limit_{identifier}")
+    
+    @staticmethod
+    def _result(raw, limit: int, now: float) -> RateLimitResult:
+        allowed, remaining, reset_after, retry_after = raw
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=int(remaining),
+            reset_at=now + int(reset_after) / 1000000,
+            retry_after=int(retry_after) / 1000000
+        )
+    
+    @staticmethod
+    def hit_many(checks: List[Tuple[str, int, int]], cost: int = 1) -> List[RateLimitResult]:
+        """
+        Проверяет несколько лимитов одним вызовом Redis
+        
+        Квота списывается со всех лимитов, только если запрос разрешают все
+        (например, лимит по IP не расходуется, если превышен лимит по телефону).
+        
+        Args:
+            checks: Список (identifier, limit, window)
+            cost: Стоимость запроса; 0 - только узнать состояние
+        
+        Returns:
+            RateLimitResult для каждого лимита в порядке checks
+        """
+        keys = []
+        args = []
+        for identifier, limit, window in checks:
+            keys.append(RateLimiter._key(identifier))
+            args.extend([limit, window, cost])
+        
+        raw = run_lua_script(RateLimiter.GCRA_SCRIPT, keys=keys, args=args)
+        now = time.time()
+        return [
+            RateLimiter._result(item, limit, now)
+            for item, (_, limit, _) in zip(raw, checks)
+        ]
+    
+    @staticmethod
+    def hit(identifier: str, limit: int = 100, window: int = 3600, cost: int = 1) -> RateLimitResult:
+        """
+        Проверяет лимит и, если запрос разрешен, списывает cost из квоты
+        
+        Args:
+            identifier: Идентификатор (IP, user_id, etc.)
+            limit: Максимальное количество запросов
+            window: Окно времени в секундах
+            cost: Стоимость запроса; 0 - только узнать состояние
+        
+        Returns:
+            RateLimitResult с allowed, remaining, reset_at и retry_after
+        """
+        return RateLimiter.hit_many([(identifier, limit, window)], cost=cost)[0]
     
     @staticmethod
     def check_rate_limit(identifier: str, limit: int = 100, window: int = 3600) -> bool:
@@ -72,22 +222,16 @@ class RateLimiter:
         Returns:
             True если лимит не превышен, False если превышен
         """
-        key = f"rate_limit_{identifier}"
-        current = cache.get(key, 0)
-        
-        if current >= limit:
-            return False
-        
-        # Увеличиваем счетчик
-        cache.set(key, current + 1, window)
-        return True
+        return RateLimiter.hit(identifier, limit, window).allowed
     
     @staticmethod
-    def get_remaining_requests(identifier: str, limit: int = 100) -> int:
-        """Получает количество оставшихся запросов"""
-        key = f"rate_limit_{identifier}"
-        current = cache.get(key, 0)
-        return max(0, limit - current)
+    def get_remaining_requests(identifier: str, limit: int = 100, window: int = 3600) -> int:
+        """
+        Получает количество оставшихся запросов, не расходуя квоту
+        
+        После hit() отдельный вызов не нужен - remaining уже есть в результате.
+        """
+        return RateLimiter.hit(identifier, limit, window, cost=0).remaining
 
 
 class SessionManager:
@@ -149,12 +293,458 @@ class SMSVerificationCache:
         key = f"sms_attempts_{phone}"
         return cache.get(key, 0)
     
+    # KEYS[1] - счетчик; ARGV[1] - лимит, ARGV[2] - время жизни счетчика (с)
+    INCREMENT_ATTEMPTS_SCRIPT = """
+    local attempts = tonumber(redis.call('GET', KEYS[1])) or 0
+    if attempts >= tonumber(ARGV[1]) then
+        return 0
+    end
+    if redis.call('INCR', KEYS[1]) == 1 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 1
+    """
+    
+    @staticmethod
+    def increment_attempts(phone: str, max_attempts: int = 5, timeout: int = 3600) -> bool:
+        """
+        Увеличивает количество попыток
+        
+        Проверка и увеличение выполняются атомарно в Redis, окно отсчитывается
+        от первой попытки.
+        """
+        key = cache.make_key(f"sms_attempts_{phone}")
+        allowed = run_lua_script(
+            SMSVerificationCache.INCREMENT_ATTEMPTS_SCRIPT,
+            keys=[key],
+            args=[max_attempts, timeout]
+        )
+        return allowed == 1
+
+
+class LocalLRUCache:
+    """Потокобезопасный LRU кэш в памяти процесса с ограничением по времени жизни"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Получает значение, если оно есть и не устарело"""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return None
+        
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            
+            value, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: Any, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые старые записи"""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def delete(self, key: Any) -> None:
+        """Удаляет значение"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        """Очищает кэш"""
+        with self._lock:
+            self._data.clear()
+
+
+class TokenCache:
+    """
+    Read-through кэш токенов аутентификации
+    
+    Порядок поиска: LRU в памяти процесса -> Redis -> БД.
+    Локальный уровень живет несколько секунд, поэтому отзыв токена
+    в другом воркере применяется не позже AUTH_TOKEN_LOCAL_CACHE_TTL.
+    """
+    
+    _local_tokens = LocalLRUCache(
+        maxsize=settings.AUTH_TOKEN_LOCAL_CACHE_SIZE,
+        ttl=settings.AUTH_TOKEN_LOCAL_CACHE_TTL
+    )
+    _local_users = LocalLRUCache(
+        maxsize=settings.AUTH_TOKEN_LOCAL_CACHE_SIZE,
+        ttl=settings.AUTH_TOKEN_LOCAL_CACHE_TTL
+    )
+    
+    @staticmethod
+    def get_token_cache_key(token) -> str:
+        """Генерирует ключ кэша для токена"""
+        return f"auth_token_{token}"
+    
+    @staticmethod
+    def get_user_cache_key(user_id: int) -> str:
+        """Генерирует ключ кэша для пользователя токена"""
+        return f"auth_user_{user_id}"
+    
+    @staticmethod
+    def get_user(token) -> Optional[Any]:
+        """
+        Возвращает пользователя по токену или None, если токен недействителен
+        
+        Args:
+            token: UUID токена
+        """
+        entry = TokenCache._get_token_entry(token)
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        
+        if entry.get('epoch', 0) != TokenEpoch.get_epoch(entry['user_id']):
+            return None
+        
+        return TokenCache.get_cached_user(entry['user_id'])
+    
     @staticmethod
-    def increment_attempts(phone: str, max_attempts: int = 5) -> bool:
-        """Увеличивает количество попыток"""
-        attempts = SMSVerificationCache.get_attempts(phone)
-        if attempts >= max_attempts:
-            return False
+    def _get_token_entry(token) -> Optional[Dict]:
+        """Получает запись о токене: user_id, время истечения и эпоху"""
+        key = str(token)
+        entry = TokenCache._local_tokens.get(key)
+        if entry is not None:
+            return entry
+        
+        entry = cache.get(TokenCache.get_token_cache_key(key))
+        if entry is None:
+            entry = TokenCache._load_token(key)
+            if entry is None:
+                return None
         
-        SMSVerificationCache.store_attempts(phone, attempts + 1)
-        return True
+        TokenCache._local_tokens.set(key, entry)
+        return entry
+    
+    @staticmethod
+    def _load_token(token: str) -> Optional[Dict]:
+        """Загружает токен и пользователя из БД одним запросом"""
+        from .models import AuthToken
+        
+        try:
+            auth_token = AuthToken.objects.select_related('user').get(token=token, is_active=True)
+        except AuthToken.DoesNotExist:
+            return None
+        
+        if auth_token.is_expired():
+            return None
+        
+        entry = {
+            'user_id': auth_token.user_id,
+            'expires_at': auth_token.expires_at.timestamp(),
+            'epoch': auth_token.epoch
+        }
+        timeout = min(settings.AUTH_TOKEN_CACHE_TIMEOUT, int(entry['expires_at'] - time.time()))
+        if timeout > 0:
+            cache.set(TokenCache.get_token_cache_key(token), entry, timeout)
+        TokenCache.cache_user(auth_token.user)
+        
+        return entry
+    
+    @staticmethod
+    def get_cached_user(user_id: int) -> Optional[Any]:
+        """Получает пользователя из кэша, при промахе - из БД"""
+        user = TokenCache._local_users.get(user_id)
+        if user is not None:
+            return user
+        
+        user = cache.get(TokenCache.get_user_cache_key(user_id))
+        if user is None:
+            from django.contrib.auth import get_user_model
+            
+            try:
+                user = get_user_model().objects.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(TokenCache.get_user_cache_key(user_id), user, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        
+        TokenCache._local_users.set(user_id, user)
+        return user
+    
+    @staticmethod
+    def cache_user(user) -> None:
+        """Кладет пользователя в кэш"""
+        cache.set(TokenCache.get_user_cache_key(user.pk), user, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        TokenCache._local_users.set(user.pk, user)
+    
+    @staticmethod
+    def invalidate_tokens(tokens) -> None:
+        """Удаляет токены из кэша"""
+        keys = [str(token) for token in tokens]
+        if not keys:
+            return
+        
+        cache.delete_many([TokenCache.get_token_cache_key(key) for key in keys])
+        for key in keys:
+            TokenCache._local_tokens.delete(key)
+    
+    @staticmethod
+    def invalidate_user(user_id: int) -> None:
+        """Удаляет пользователя из кэша"""
+        cache.delete(TokenCache.get_user_cache_key(user_id))
+        TokenCache._local_users.delete(user_id)
+
+
+class TokenEpoch:
+    """
+    Эпоха токенов пользователя
+    
+    Хранится в поле User.token_epoch и зеркалируется в Redis. Каждый токен
+    (AuthToken и подписанный access токен) запоминает эпоху при выпуске,
+    поэтому одно увеличение эпохи отзывает все токены пользователя.
+    
+    Зеркало в Redis только растет (STORE_SCRIPT): значение, прочитанное из БД
+    до увеличения эпохи и записанное после него, не откатывает отзыв. Срок
+    жизни зеркала ограничен AUTH_TOKEN_CACHE_TIMEOUT на случай, если запись
+    после увеличения эпохи не дошла до Redis.
+    """
+    
+    # KEYS[1] - ключ эпохи, ARGV[1] - эпоха, ARGV[2] - срок жизни (с)
+    # Возвращает эпоху, которая осталась в Redis
+    STORE_SCRIPT = """
+    local current = tonumber(redis.call('GET', KEYS[1]))
+    local epoch = tonumber(ARGV[1])
+    if current and current >= epoch then
+        return current
+    end
+    redis.call('SET', KEYS[1], epoch, 'EX', ARGV[2])
+    return epoch
+    """
+    
+    _local_epochs = LocalLRUCache(
+        maxsize=settings.AUTH_TOKEN_LOCAL_CACHE_SIZE,
+        ttl=settings.AUTH_TOKEN_LOCAL_CACHE_TTL
+    )
+    
+    @staticmethod
+    def get_epoch_cache_key(user_id: int) -> str:
+        """Генерирует ключ эпохи пользователя"""
+        return f"token_epoch_{user_id}"
+    
+    @staticmethod
+    def _store(user_id: int, epoch: int) -> int:
+        """Записывает эпоху в Redis, если она больше текущей, и возвращает итоговую"""
+        return int(run_lua_script(
+            TokenEpoch.STORE_SCRIPT,
+            keys=[cache.make_key(TokenEpoch.get_epoch_cache_key(user_id))],
+            args=[epoch, settings.AUTH_TOKEN_CACHE_TIMEOUT]
+        ))
+    
+    @staticmethod
+    def get_epoch(user_id: int) -> Optional[int]:
+        """Получает текущую эпоху пользователя (None, если пользователя нет)"""
+        epoch = TokenEpoch._local_epochs.get(user_id)
+        if epoch is not None:
+            return epoch
+        
+        epoch = cache.get(TokenEpoch.get_epoch_cache_key(user_id))
+        if epoch is None:
+            from django.contrib.auth import get_user_model
+            
+            epoch = get_user_model().objects.filter(pk=user_id).values_list('token_epoch', flat=True).first()
+            if epoch is None:
+                return None
+            epoch = TokenEpoch._store(user_id, epoch)
+        
+        TokenEpoch._local_epochs.set(user_id, epoch)
+        return epoch
+    
+    @staticmethod
+    def bump_epoch(user_id: int) -> None:
+        """Увеличивает эпоху пользователя, отзывая все его токены"""
+        from django.contrib.auth import get_user_model
+        from django.db import transaction
+        from django.db.models import F
+        
+        User = get_user_model()
+        with transaction.atomic():
+            User.objects.filter(pk=user_id).update(token_epoch=F('token_epoch') + 1)
+            epoch = User.objects.filter(pk=user_id).values_list('token_epoch', flat=True).first()
+        
+        def publish():
+            # Новая эпоха записывается в Redis, а не сбрасывается: чтение из
+            # БД, начатое до увеличения, не может вернуть в кэш старое значение
+            if epoch is not None:
+                TokenEpoch._store(user_id, epoch)
+            TokenEpoch._local_epochs.delete(user_id)
+            TokenCache.invalidate_user(user_id)
+        
+        # Внутри внешней транзакции - после ее фиксации
+        transaction.on_commit(publish)
+
+
+class LoginGuard:
+    """
+    Защита входа от перебора паролей до вызова authenticate()
+    
+    Неудачные попытки считаются по телефону и по IP. После
+    LOGIN_FAILURES_BEFORE_LOCKOUT (LOGIN_IP_FAILURES_BEFORE_LOCKOUT для IP)
+    неудач ключ блокируется на LOGIN_LOCKOUT_BASE * 2^n секунд, но не больше
+    LOGIN_LOCKOUT_MAX. Заблокированные попытки и попытки входа в несуществующий
+    или неактивный аккаунт отклоняются без хэширования пароля.
+    """
+    
+    # Пары KEYS[2i-1] - счетчик неудач, KEYS[2i] - ключ блокировки
+    # ARGV[1] - база задержки (мс), ARGV[2] - максимум (мс), ARGV[3] - окно счетчика (с),
+    # ARGV[3 + i] - число неудач без блокировки для пары i
+    RECORD_FAILURE_SCRIPT = """
+    for i = 1, #KEYS / 2 do
+        local failures = redis.call('INCR', KEYS[i * 2 - 1])
+        if failures == 1 then
+            redis.call('EXPIRE', KEYS[i * 2 - 1], ARGV[3])
+        end
+        local over = failures - tonumber(ARGV[3 + i])
+        if over > 0 then
+            local backoff = math.min(tonumber(ARGV[1]) * 2 ^ (over - 1), tonumber(ARGV[2]))
+            redis.call('SET', KEYS[i * 2], 1, 'PX', math.floor(backoff))
+        end
+    end
+    return 1
+    """
+    
+    ACCOUNT_ACTIVE = 'active'
+    ACCOUNT_INACTIVE = 'inactive'
+    ACCOUNT_MISSING = 'missing'
+    
+    @staticmethod
+    def _keys(kind: str, value: str) -> Tuple[str, str]:
+        return (
+            cache.make_key(f"login_failures_{kind}_{value}"),
+            cache.make_key(f"login_lock_{kind}_{value}"),
+        )
+    
+    @staticmethod
+    def get_lockout(phone: str, ip: str) -> float:
+        """
+        Возвращает, сколько секунд еще действует блокировка (0 - входить можно)
+        
+        Оба ключа проверяются одним pipeline.
+        """
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.pttl(LoginGuard._keys('phone', phone)[1])
+        pipe.pttl(LoginGuard._keys('ip', ip)[1])
+        return max(max(ttl, 0) for ttl in pipe.execute()) / 1000
+    
+    @staticmethod
+    def record_failure(phone: str, ip: str) -> None:
+        """Учитывает неудачную попытку входа"""
+        run_lua_script(
+            LoginGuard.RECORD_FAILURE_SCRIPT,
+            keys=[*LoginGuard._keys('phone', phone), *LoginGuard._keys('ip', ip)],
+            args=[
+                settings.LOGIN_LOCKOUT_BASE * 1000,
+                settings.LOGIN_LOCKOUT_MAX * 1000,
+                settings.LOGIN_FAILURE_WINDOW,
+                settings.LOGIN_FAILURES_BEFORE_LOCKOUT,
+                settings.LOGIN_IP_FAILURES_BEFORE_LOCKOUT,
+            ]
+        )
+    
+    @staticmethod
+    def reset(phone: str) -> None:
+        """Сбрасывает счетчик телефона после успешного входа"""
+        cache.delete_many([f"login_failures_phone_{phone}", f"login_lock_phone_{phone}"])
+    
+    @staticmethod
+    def get_account_state(phone: str) -> str:
+        """Кэшированное состояние аккаунта: active, inactive или missing"""
+        key = f"login_account_{phone}"
+        state = cache.get(key)
+        
+        if state is None:
+            from django.contrib.auth import get_user_model
+            
+            is_active = get_user_model().objects.filter(phone=phone).values_list('is_active', flat=True).first()
+            if is_active is None:
+                state = LoginGuard.ACCOUNT_MISSING
+            else:
+                state = LoginGuard.ACCOUNT_ACTIVE if is_active else LoginGuard.ACCOUNT_INACTIVE
+            cache.set(key, state, settings.LOGIN_ACCOUNT_CACHE_TIMEOUT)
+        
+        return state
+    
+    @staticmethod
+    def invalidate_account(phone: str) -> None:
+        """Сбрасывает кэшированное состояние аккаунта"""
+        cache.delete(f"login_account_{phone}")
+    
+    @staticmethod
+    def invalidate_accounts(phones) -> None:
+        """Сбрасывает кэшированное состояние аккаунтов одним запросом (массовое создание)"""
+        keys = [f"login_account_{phone}" for phone in phones]
+        if keys:
+            cache.delete_many(keys)
+
+
+class TelegramSendAbilityCache:
+    """
+    Кэш результатов checkSendAbility Telegram Gateway по номеру телефона
+    
+    Хранит результат (с request_id, который делает следующую отправку
+    бесплатной) или False, если Telegram для номера недоступен.
+    """
+    
+    @staticmethod
+    def _key(phone: str) -> str:
+        from .validators import normalize_phone_number
+        from django.core.exceptions import ValidationError
+        
+        try:
+            phone = normalize_phone_number(phone)
+        except ValidationError:
+            pass
+        return f"tg_send_ability_{phone}"
+    
+    @staticmethod
+    def get(phone: str) -> Optional[Any]:
+        """Результат checkSendAbility, False (недоступен) или None (нет в кэше)"""
+        return cache.get(TelegramSendAbilityCache._key(phone))
+    
+    @staticmethod
+    def set_available(phone: str, result: Dict) -> None:
+        cache.set(TelegramSendAbilityCache._key(phone), result, settings.TELEGRAM_SEND_ABILITY_TTL)
+    
+    @staticmethod
+    def set_unavailable(phone: str) -> None:
+        cache.set(TelegramSendAbilityCache._key(phone), False, settings.TELEGRAM_SEND_ABILITY_NEGATIVE_TTL)
+    
+    @staticmethod
+    async def aget(phone: str) -> Optional[Any]:
+        return await cache.aget(TelegramSendAbilityCache._key(phone))
+    
+    @staticmethod
+    async def aset_available(phone: str, result: Dict) -> None:
+        await cache.aset(TelegramSendAbilityCache._key(phone), result, settings.TELEGRAM_SEND_ABILITY_TTL)
+    
+    @staticmethod
+    async def aset_unavailable(phone: str) -> None:
+        await cache.aset(TelegramSendAbilityCache._key(phone), False, settings.TELEGRAM_SEND_ABILITY_NEGATIVE_TTL)
+    
+    @staticmethod
+    def consume_request_id(phone: str) -> None:
+        """Убирает использованный request_id, сохраняя признак доступности"""
+        key = TelegramSendAbilityCache._key(phone)
+        result = cache.get(key)
+        if result:
+            cache.set(key, {**result, 'request_id': None}, cache.ttl(key) or settings.TELEGRAM_SEND_ABILITY_TTL)
+    
+    @staticmethod
+    async def aconsume_request_id(phone: str) -> None:
+        await sync_to_async(TelegramSendAbilityCache.consume_request_id, thread_sensitive=False)(phone)
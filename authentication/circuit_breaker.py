@@ -0,0 +1,219 @@
+"""
+Автоматические выключатели (circuit breaker) провайдеров отправки OTP
+
+Состояние и статистика хранятся в Redis и общие для всех воркеров:
+- статистика - счетчики вызовов, ошибок и суммарной задержки в корзинах по
+  CIRCUIT_BREAKER_BUCKET секунд за последние CIRCUIT_BREAKER_WINDOW секунд;
+- ошибка - исключение, 5xx или вызов дольше CIRCUIT_BREAKER_SLOW_CALL секунд;
+- при доле ошибок от CIRCUIT_BREAKER_ERROR_RATE (и не меньше
+  CIRCUIT_BREAKER_MIN_CALLS вызовов) выключатель размыкается на
+  CIRCUIT_BREAKER_OPEN_SECONDS: вызовы провайдера сразу отклоняются;
+- затем пропускается один пробный вызов: успех замыкает выключатель и
+  сбрасывает статистику, ошибка размыкает снова.
+
+При недоступности Redis вызовы разрешаются - выключатель не должен
+останавливать отправку кодов.
+"""
+import time
+from typing import Dict, List
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from .cache_utils import run_lua_script
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Выключатель провайдера name ('telegram', 'sms')"""
+
+    # KEYS[1] - состояние; ARGV[1] - время на пробный вызов (мс)
+    # Возвращает 1, если вызов разрешен
+    ALLOW_SCRIPT = """
+    local state = redis.call('HGET', KEYS[1], 'state')
+    if not state then
+        return 1
+    end
+
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+    if now < tonumber(redis.call('HGET', KEYS[1], 'until')) then
+        return 0
+    end
+
+    -- Время размыкания истекло или пробный вызов не вернулся: пропускаем один пробный
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'until', now + tonumber(ARGV[1]))
+    return 1
+    """
+
+    # KEYS[1] - состояние, KEYS[2..] - корзины окна (KEYS[2] - текущая)
+    # ARGV: ошибка (0/1), задержка (с), TTL корзины (с), минимум вызовов,
+    #       доля ошибок для размыкания, время размыкания (мс)
+    # Возвращает состояние после записи
+    RECORD_SCRIPT = """
+    local failed = tonumber(ARGV[1]) == 1
+
+    redis.call('HINCRBY', KEYS[2], 'calls', 1)
+    redis.call('HINCRBYFLOAT', KEYS[2], 'latency', ARGV[2])
+    if failed then
+        redis.call('HINCRBY', KEYS[2], 'errors', 1)
+    end
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+
+    local function open()
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+        redis.call('HSET', KEYS[1], 'state', 'open', 'until', now + tonumber(ARGV[6]))
+        return 'open'
+    end
+
+    local state = redis.call('HGET', KEYS[1], 'state')
+    if state == 'half_open' then
+        -- Результат пробного вызова
+        if failed then
+            return open()
+        end
+        redis.call('DEL', unpack(KEYS))
+        return 'closed'
+    end
+
+    if not failed or state == 'open' then
+        return state or 'closed'
+    end
+
+    local calls, errors = 0, 0
+    for i = 2, #KEYS do
+        local bucket = redis.call('HMGET', KEYS[i], 'calls', 'errors')
+        calls = calls + (tonumber(bucket[1]) or 0)
+        errors = errors + (tonumber(bucket[2]) or 0)
+    end
+
+    if calls >= tonumber(ARGV[4]) and errors / calls >= tonumber(ARGV[5]) then
+        return open()
+    end
+    return 'closed'
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @staticmethod
+    def _state_key(name) -> str:
+        return cache.make_key(f"circuit_{name}")
+
+    @staticmethod
+    def _bucket_keys(name) -> List[str]:
+        """Ключи корзин окна, начиная с текущей"""
+        size = settings.CIRCUIT_BREAKER_BUCKET
+        current = int(time.time()) // size
+        count = max(1, settings.CIRCUIT_BREAKER_WINDOW // size)
+        return [cache.make_key(f"circuit_{name}_{current - i}") for i in range(count)]
+
+    def allow(self) -> bool:
+        """Разрешен ли вызов провайдера сейчас"""
+        try:
+            probe_ms = int(settings.PROVIDER_HTTP_CONNECT_TIMEOUT * 1000 + settings.PROVIDER_HTTP_READ_TIMEOUT * 1000)
+            return bool(run_lua_script(self.ALLOW_SCRIPT, [self._state_key(self.name)], [probe_ms]))
+        except Exception as e:
+            print(f"Ошибка circuit breaker {self.name}: {e}")
+            return True
+
+    def record(self, success: bool, latency: float) -> None:
+        """Записывает результат вызова (latency - секунды)"""
+        failed = not success or latency >= settings.CIRCUIT_BREAKER_SLOW_CALL
+        try:
+            run_lua_script(
+                self.RECORD_SCRIPT,
+                [self._state_key(self.name)] + self._bucket_keys(self.name),
+                [
+                    int(failed),
+                    latency,
+                    settings.CIRCUIT_BREAKER_WINDOW + settings.CIRCUIT_BREAKER_BUCKET,
+                    settings.CIRCUIT_BREAKER_MIN_CALLS,
+                    settings.CIRCUIT_BREAKER_ERROR_RATE,
+                    settings.CIRCUIT_BREAKER_OPEN_SECONDS * 1000,
+                ]
+            )
+        except Exception as e:
+            print(f"Ошибка circuit breaker {self.name}: {e}")
+
+    async def aallow(self) -> bool:
+        return await sync_to_async(self.allow, thread_sensitive=False)()
+
+    async def arecord(self, success: bool, latency: float) -> None:
+        await sync_to_async(self.record, thread_sensitive=False)(success, latency)
+
+    @staticmethod
+    def snapshot(names) -> Dict[str, Dict]:
+        """
+        Состояние и статистика окна провайдеров одним запросом к Redis
+
+        Returns:
+            {name: {'state', 'available', 'calls', 'errors', 'error_rate', 'latency'}},
+            latency - средняя задержка в секундах
+        """
+        names = list(names)
+        try:
+            pipe = get_redis_connection('default').pipeline(transaction=False)
+            for name in names:
+                pipe.hmget(CircuitBreaker._state_key(name), 'state', 'until')
+                for key in CircuitBreaker._bucket_keys(name):
+                    pipe.hmget(key, 'calls', 'errors', 'latency')
+            replies = iter(pipe.execute())
+        except Exception as e:
+            print(f"Ошибка circuit breaker: {e}")
+            replies = None
+
+        now_ms = time.time() * 1000
+        result = {}
+        for name in names:
+            state, until = (None, None)
+            buckets = []
+            if replies is not None:
+                state, until = next(replies)
+                buckets = [next(replies) for _ in CircuitBreaker._bucket_keys(name)]
+
+            calls = sum(int(bucket[0] or 0) for bucket in buckets)
+            errors = sum(int(bucket[1] or 0) for bucket in buckets)
+            latency = sum(float(bucket[2] or 0) for bucket in buckets)
+            state = state.decode() if isinstance(state, bytes) else (state or STATE_CLOSED)
+
+            result[name] = {
+                'state': state,
+                # Разомкнутый выключатель с истекшим временем пропустит пробный вызов
+                'available': state == STATE_CLOSED or now_ms >= float(until or 0),
+                'calls': calls,
+                'errors': errors,
+                'error_rate': errors / calls if calls else 0.0,
+                'latency': latency / calls if calls else 0.0,
+            }
+        return result
+
+    @staticmethod
+    def is_degraded(stats: Dict) -> bool:
+        """Провайдер доступен, но заметно хуже нормы"""
+        # Ожидается пробный вызов: статистика окна относится ко времени сбоя,
+        # иначе пробный вызов не дойдет до провайдера, пока здоров второй канал
+        if stats['state'] != STATE_CLOSED:
+            return False
+        if stats['calls'] < settings.CIRCUIT_BREAKER_MIN_CALLS:
+            return False
+        return (
+            stats['error_rate'] >= settings.CIRCUIT_BREAKER_DEGRADED_ERROR_RATE
+            or stats['latency'] >= settings.CIRCUIT_BREAKER_DEGRADED_LATENCY
+        )
+
+
+_breakers = {}
+
+
+def get_circuit_breaker(name) -> CircuitBreaker:
+    """Возвращает выключатель провайдера name"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
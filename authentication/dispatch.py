@@ -0,0 +1,224 @@
+"""
+Асинхронная отправка OTP кодов через Redis Stream (OTP_DISPATCH_MODE = 'queue')
+
+View выпускает код (запись SMSVerification или хэш в Redis), ставит задачу
+отправки в поток и сразу отвечает 202 с dispatch_id. Воркеры
+(manage.py run_otp_dispatcher) читают поток группой потребителей, вызывают
+Telegram Gateway / GreenSMS с переходом Telegram -> SMS и записывают статус
+в Redis, откуда его читает эндпоинт статуса.
+
+Неудачная задача не подтверждается (XACK) и забирается повторно через
+XAUTOCLAIM после OTP_DISPATCH_RETRY_DELAY секунд, так же как задачи упавшего
+воркера. После OTP_DISPATCH_MAX_ATTEMPTS попыток задача получает статус failed.
+Пока задача отправляется, воркер продлевает ее XCLAIM ... JUSTID, поэтому
+отправка дольше OTP_DISPATCH_RETRY_DELAY (таймауты Telegram и затем SMS) не
+забирается другим воркером и код не уходит дважды.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from .otp_store import get_otp_store
+
+STREAM_KEY = 'otp_dispatch_stream'
+GROUP_NAME = 'otp_dispatchers'
+
+STATUS_QUEUED = 'queued'
+STATUS_RETRYING = 'retrying'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class OTPDispatchQueue:
+    """Постановка задач отправки и статусы"""
+
+    @staticmethod
+    def stream_key() -> str:
+        return cache.make_key(STREAM_KEY)
+
+    @staticmethod
+    def status_key(dispatch_id: str) -> str:
+        return cache.make_key(f"otp_dispatch_{dispatch_id}")
+
+    @staticmethod
+    def enqueue(phone: str, code: str, prefer_telegram: bool = True) -> str:
+        """
+        Ставит задачу отправки кода в поток
+
+        Returns:
+            dispatch_id для запроса статуса
+        """
+        dispatch_id = uuid.uuid4().hex
+        status_key = OTPDispatchQueue.status_key(dispatch_id)
+
+        pipe = get_redis_connection('default').pipeline(transaction=True)
+        pipe.hset(status_key, mapping={'status': STATUS_QUEUED, 'method': '', 'attempts': 0})
+        pipe.expire(status_key, settings.OTP_DISPATCH_STATUS_TTL)
+        pipe.xadd(
+            OTPDispatchQueue.stream_key(),
+            {
+                'dispatch_id': dispatch_id,
+                'phone': phone,
+                'code': code,
+                'prefer_telegram': int(bool(prefer_telegram)),
+            },
+            maxlen=settings.OTP_DISPATCH_STREAM_MAXLEN,
+            approximate=True
+        )
+        pipe.execute()
+
+        return dispatch_id
+
+    @staticmethod
+    def get_status(dispatch_id: str) -> Optional[Dict]:
+        """Статус задачи или None, если задача неизвестна или устарела"""
+        data = get_redis_connection('default').hgetall(OTPDispatchQueue.status_key(dispatch_id))
+        if not data:
+            return None
+
+        status = {_decode(key): _decode(value) for key, value in data.items()}
+        status['attempts'] = int(status.get('attempts', 0))
+        return status
+
+    @staticmethod
+    def set_status(dispatch_id: str, **fields) -> None:
+        status_key = OTPDispatchQueue.status_key(dispatch_id)
+        pipe = get_redis_connection('default').pipeline(transaction=True)
+        pipe.hset(status_key, mapping={key: value for key, value in fields.items() if value is not None})
+        pipe.expire(status_key, settings.OTP_DISPATCH_STATUS_TTL)
+        pipe.execute()
+
+    @staticmethod
+    def increment_attempts(dispatch_id: str) -> int:
+        return get_redis_connection('default').hincrby(OTPDispatchQueue.status_key(dispatch_id), 'attempts', 1)
+
+
+class OTPDispatchWorker:
+    """Потребитель потока задач отправки"""
+
+    def __init__(self, otp_service, consumer: Optional[str] = None):
+        self.otp_service = otp_service
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.client = get_redis_connection('default')
+        self.stream = OTPDispatchQueue.stream_key()
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        self._heartbeat_thread = None
+
+    def ensure_group(self) -> None:
+        """Создает группу потребителей, если ее еще нет"""
+        try:
+            self.client.xgroup_create(self.stream, GROUP_NAME, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def fetch(self, count: int, block_ms: int):
+        """
+        Забирает задачи: сначала зависшие и ожидающие повтора, затем новые
+
+        Returns:
+            list[(message_id, fields)]
+        """
+        claimed = self.client.xautoclaim(
+            self.stream, GROUP_NAME, self.consumer,
+            min_idle_time=settings.OTP_DISPATCH_RETRY_DELAY * 1000,
+            start_id='0-0',
+            count=count
+        )
+        messages = [message for message in claimed[1] if message[1]]
+        if messages:
+            return messages
+
+        response = self.client.xreadgroup(
+            GROUP_NAME, self.consumer, {self.stream: '>'}, count=count, block=block_ms
+        )
+        return response[0][1] if response else []
+
+    def process(self, message_id, fields) -> str:
+        """Отправляет код одной задачи и записывает статус"""
+        fields = {_decode(key): _decode(value) for key, value in fields.items()}
+        dispatch_id = fields['dispatch_id']
+        phone = fields['phone']
+        code = fields['code']
+
+        attempts = OTPDispatchQueue.increment_attempts(dispatch_id)
+
+        self._track(message_id)
+        try:
+            method, request_id = self.otp_service.deliver_code(
+                phone, code, prefer_telegram=fields['prefer_telegram'] == '1'
+            )
+        except Exception as e:
+            print(f"Ошибка отправки OTP {dispatch_id}: {e}")
+            method, request_id = None, None
+        finally:
+            self._untrack(message_id)
+
+        if method is not None:
+            if request_id:
+                get_otp_store().set_request_id(phone, code, request_id)
+            OTPDispatchQueue.set_status(dispatch_id, status=STATUS_SENT, method=method, request_id=request_id)
+            self.ack(message_id)
+            return STATUS_SENT
+
+        if attempts >= settings.OTP_DISPATCH_MAX_ATTEMPTS:
+            OTPDispatchQueue.set_status(dispatch_id, status=STATUS_FAILED)
+            self.ack(message_id)
+            return STATUS_FAILED
+
+        # Без XACK: задача вернется через XAUTOCLAIM после OTP_DISPATCH_RETRY_DELAY
+        OTPDispatchQueue.set_status(dispatch_id, status=STATUS_RETRYING)
+        return STATUS_RETRYING
+
+    def ack(self, message_id) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.xack(self.stream, GROUP_NAME, message_id)
+        pipe.xdel(self.stream, message_id)
+        pipe.execute()
+
+    def _track(self, message_id) -> None:
+        with self._in_flight_lock:
+            self._in_flight.add(message_id)
+            if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+                self._heartbeat_thread = threading.Thread(
+                    target=self._heartbeat, name='otp-dispatch-heartbeat', daemon=True
+                )
+                self._heartbeat_thread.start()
+
+    def _untrack(self, message_id) -> None:
+        with self._in_flight_lock:
+            self._in_flight.discard(message_id)
+
+    def _heartbeat(self) -> None:
+        """
+        Сбрасывает время простоя отправляемых задач
+
+        XCLAIM с min_idle_time=0 этим же потребителем обнуляет простой без
+        увеличения счетчика доставок (JUSTID), поэтому XAUTOCLAIM других
+        воркеров не забирает задачу, пока идет отправка.
+        """
+        interval = settings.OTP_DISPATCH_RETRY_DELAY / 3
+        while True:
+            time.sleep(interval)
+            with self._in_flight_lock:
+                message_ids = list(self._in_flight)
+                if not message_ids:
+                    # Поток завершается; следующий _track запустит новый
+                    self._heartbeat_thread = None
+                    return
+            try:
+                self.client.xclaim(self.stream, GROUP_NAME, self.consumer, 0, message_ids, justid=True)
+            except Exception as e:
+                print(f"Ошибка продления задач отправки OTP: {e}")
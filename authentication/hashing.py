@@ -0,0 +1,142 @@
+"""
+Хэширование паролей вне потока обработки запроса
+
+PASSWORD_HASHING_MODE:
+    'inline' - в текущем потоке (поведение Django по умолчанию)
+    'thread' - в пуле потоков; hashlib.pbkdf2_hmac, argon2 и bcrypt отпускают GIL
+    'process' - в пуле процессов, для хэшеров, которые GIL не отпускают
+
+Очередь ограничена: одновременно принимается не больше
+PASSWORD_HASHING_WORKERS + PASSWORD_HASHING_QUEUE_SIZE задач, сверх этого
+сразу поднимается HashingOverloaded (503 с Retry-After), чтобы вход и смена
+пароля не занимали воркеры, нужные быстрым эндпоинтам.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingOverloaded(APIException):
+    """Очередь хэширования заполнена"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис перегружен. Попробуйте позже'
+    default_code = 'hashing_overloaded'
+    wait = 1  # Retry-After, секунды
+
+
+def _init_process_worker():
+    """Инициализация процесса пула при старте через spawn"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+class HashingExecutor:
+    """Пул хэширования с ограниченной очередью"""
+
+    def __init__(self, mode='inline', workers=2, queue_size=16, timeout=10):
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Пул создается лениво и заново после fork (gunicorn --preload)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    if self.mode == 'process':
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            initializer=_init_process_worker
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers,
+                            thread_name_prefix='password-hashing'
+                        )
+                    self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def run(self, fn, *args):
+        """Выполняет fn(*args) в пуле и ждет результат"""
+        if self.mode == 'inline':
+            return fn(*args)
+
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingOverloaded()
+
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingOverloaded()
+
+
+_executor = None
+
+
+def get_hashing_executor():
+    """Возвращает пул хэширования согласно настройкам"""
+    global _executor
+    if _executor is None:
+        _executor = HashingExecutor(
+            mode=settings.PASSWORD_HASHING_MODE,
+            workers=settings.PASSWORD_HASHING_WORKERS,
+            queue_size=settings.PASSWORD_HASHING_QUEUE_SIZE,
+            timeout=settings.PASSWORD_HASHING_TIMEOUT
+        )
+    return _executor
+
+
+def make_password(password):
+    """django.contrib.auth.hashers.make_password в пуле хэширования"""
+    return get_hashing_executor().run(hashers.make_password, password)
+
+
+def create_process_pool(workers):
+    """
+    Отдельный пул процессов для массового хэширования вне запросов (импорт
+    пользователей). Очередь не ограничена, закрывается вызывающим кодом.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_process_worker)
+
+
+def create_thread_pool(workers):
+    """
+    Отдельный пул потоков для массового хэширования внутри запроса: воркер
+    gunicorn не форкается, а PBKDF2 и argon2 отпускают GIL.
+    """
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-hashing')
+
+
+def check_password(password, encoded, setter=None):
+    """
+    django.contrib.auth.hashers.check_password в пуле хэширования
+
+    Проверка выполняется в пуле, а setter (перехэширование при смене хэшера
+    или числа итераций) - в вызывающем потоке, потому что сохраняет модель.
+    """
+    is_correct, must_update = get_hashing_executor().run(hashers.verify_password, password, encoded)
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
@@ -0,0 +1,81 @@
+"""
+HTTP сессии для клиентов провайдеров (Telegram Gateway, GreenSMS)
+
+Одна requests.Session на провайдера и процесс: соединения keep-alive
+переиспользуются между запросами, поэтому TCP и TLS рукопожатие выполняется
+один раз на соединение пула, а не на каждый OTP.
+
+Пул urllib3 потокобезопасен; PROVIDER_HTTP_POOL_SIZE - сколько соединений
+с провайдером держится открытыми (имеет смысл не меньше числа потоков воркера
+или --workers у run_otp_dispatcher). Сокеты не переживают fork: после fork
+(gunicorn --preload) дочерний процесс создает свои сессии.
+
+Async views (ASGI) используют httpx.AsyncClient - один на провайдера и цикл
+событий, с пулом до PROVIDER_ASYNC_POOL_SIZE соединений.
+"""
+import asyncio
+import os
+import threading
+import weakref
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_sessions = {}
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Сбрасывает сессии родителя в дочернем процессе"""
+    global _lock
+    _sessions.clear()
+    _async_clients.clear()
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session(name):
+    """Возвращает сессию провайдера name текущего процесса"""
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.PROVIDER_HTTP_POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[name] = session
+    return session
+
+
+def get_timeout():
+    """(connect, read) таймауты запросов к провайдерам"""
+    return settings.PROVIDER_HTTP_CONNECT_TIMEOUT, settings.PROVIDER_HTTP_READ_TIMEOUT
+
+
+def get_async_client(name):
+    """Возвращает httpx.AsyncClient провайдера name для текущего цикла событий"""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_ASYNC_POOL_SIZE,
+                max_keepalive_connections=settings.PROVIDER_ASYNC_POOL_SIZE
+            ),
+            timeout=httpx.Timeout(
+                settings.PROVIDER_HTTP_READ_TIMEOUT,
+                connect=settings.PROVIDER_HTTP_CONNECT_TIMEOUT
+            )
+        )
+    return client
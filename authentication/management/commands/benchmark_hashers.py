@@ -0,0 +1,90 @@
+"""
+Бенчмарк хэшеров паролей из PASSWORD_HASHERS при текущих параметрах сложности
+
+Для каждого хэшера измеряются проверки пароля (стоимость одного входа) в
+--concurrency параллельных потоках или процессах: хэшей в секунду и задержки
+p50/p95/p99. По результату можно оценить пропускную способность входа
+и выбрать PASSWORD_HASHING_WORKERS.
+
+Пример:
+    python manage.py benchmark_hashers --requests 200 --concurrency 4 --mode thread
+"""
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.contrib.auth.hashers import get_hasher, get_hashers
+from django.core.management.base import BaseCommand
+
+from authentication.hashing import _init_process_worker
+
+PASSWORD = 'benchmark-password-1'
+
+
+def _timed_verify(algorithm, encoded):
+    """Проверяет пароль и возвращает время в секундах"""
+    hasher = get_hasher(algorithm)
+    started = time.perf_counter()
+    hasher.verify(PASSWORD, encoded)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Измеряет хэши в секунду и задержки для каждого хэшера из PASSWORD_HASHERS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Проверок пароля на хэшер')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Параллельных потоков или процессов')
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread',
+                            help='Пул потоков или процессов')
+
+    def handle(self, *args, **options):
+        requests = options['requests']
+        concurrency = options['concurrency']
+
+        if options['mode'] == 'process':
+            pool = ProcessPoolExecutor(max_workers=concurrency, initializer=_init_process_worker)
+        else:
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+
+        self.stdout.write(f"Проверок: {requests}, параллельно: {concurrency} ({options['mode']})")
+
+        with pool:
+            for hasher in get_hashers():
+                try:
+                    encoded = hasher.encode(PASSWORD, hasher.salt())
+                except ValueError as e:
+                    # Не установлена библиотека хэшера (argon2-cffi, bcrypt)
+                    self.stdout.write(self.style.WARNING(f"{hasher.algorithm}: пропущен ({e})"))
+                    continue
+
+                # Прогрев (в пуле процессов - импорт и инициализация)
+                list(pool.map(_timed_verify, [hasher.algorithm] * concurrency, [encoded] * concurrency))
+
+                started = time.perf_counter()
+                timings = sorted(pool.map(
+                    _timed_verify, [hasher.algorithm] * requests, [encoded] * requests
+                ))
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write(
+                    f"{hasher.algorithm:<24} {self._work_factor(hasher, encoded):<28} "
+                    f"{requests / elapsed:8.1f} хэш/с  "
+                    f"p50 {self._percentile(timings, 50):7.1f} мс  "
+                    f"p95 {self._percentile(timings, 95):7.1f} мс  "
+                    f"p99 {self._percentile(timings, 99):7.1f} мс"
+                )
+
+    @staticmethod
+    def _percentile(timings, percent):
+        if len(timings) == 1:
+            return timings[0] * 1000
+        return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1] * 1000
+
+    @staticmethod
+    def _work_factor(hasher, encoded):
+        """Параметры сложности из safe_summary (iterations, work factor, memory cost...)"""
+        summary = hasher.safe_summary(encoded)
+        skip = {'algorithm', 'salt', 'hash', 'checksum'}
+        return ', '.join(f"{key}={value}" for key, value in summary.items() if key not in skip)
@@ -0,0 +1,137 @@
+"""
+Бенчмарк планов запросов OTP на больших объемах (только PostgreSQL)
+
+Таблица-копия authentication_smsverification со всеми индексами создается как
+временная и заполняется через generate_series, рабочие данные не затрагиваются.
+Для каждого объема выводятся время выполнения и число прочитанных страниц:
+при индексном поиске оно почти не растет при увеличении таблицы в 10 раз (O(log n)).
+
+Пример:
+    python manage.py benchmark_otp_lookup --sizes 100000,1000000,10000000,30000000
+"""
+import json
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from authentication.models import SMSVerification
+
+BENCH_TABLE = 'otp_lookup_bench'
+
+PHONE_SQL = "'+7900' || lpad((g %% {phones})::text, 7, '0')"
+CODE_SQL = "lpad((g %% 1000000)::text, 6, '0')"
+
+QUERIES = {
+    'verify': (
+        f"SELECT id FROM {BENCH_TABLE} "
+        "WHERE phone = %s AND code = %s AND NOT is_used AND expires_at > now()"
+    ),
+    'deactivate': (
+        f"UPDATE {BENCH_TABLE} SET is_used = true "
+        "WHERE phone = %s AND NOT is_used"
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = 'Измеряет планы и время запросов поиска OTP на таблице в десятки миллионов строк'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000,10000000',
+                            help='Объемы таблицы через запятую')
+        parser.add_argument('--phones', type=int, default=100000,
+                            help='Число различных номеров (у каждого один действующий код)')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Число замеров каждого запроса на каждом объеме')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Бенчмарк поддерживает только PostgreSQL')
+
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        phones = options['phones']
+        if sizes[0] < phones:
+            raise CommandError('Минимальный объем должен быть не меньше --phones')
+
+        with connection.cursor() as cursor:
+            self._create_table(cursor)
+
+            filled = 0
+            for size in sizes:
+                started = time.monotonic()
+                self._fill(cursor, filled, size, phones)
+                filled = size
+                self.stdout.write(f"\nСтрок: {size:,} (заполнение {time.monotonic() - started:.1f} с)")
+
+                for name, sql in QUERIES.items():
+                    self._report(cursor, name, sql, size, phones, options['repeat'])
+
+            cursor.execute(f"DROP TABLE {BENCH_TABLE}")
+
+    def _create_table(self, cursor):
+        source = SMSVerification._meta.db_table
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {BENCH_TABLE} (LIKE {source} INCLUDING DEFAULTS INCLUDING INDEXES)"
+        )
+
+    def _fill(self, cursor, start, size, phones):
+        """Дозаполняет таблицу до size строк; действующими остаются последние коды каждого номера"""
+        cursor.execute(
+            f"""
+            INSERT INTO {BENCH_TABLE} (id, phone, code, is_used, created_at, expires_at)
+            SELECT g, {PHONE_SQL.format(phones=phones)}, {CODE_SQL}, g <= %s,
+                   now() - make_interval(secs => %s - g),
+                   now() - make_interval(secs => %s - g) + interval '5 minutes'
+            FROM generate_series(%s, %s) AS g
+            """,
+            [size - phones, size, size, start + 1, size]
+        )
+        cursor.execute(
+            f"UPDATE {BENCH_TABLE} SET is_used = true WHERE NOT is_used AND id <= %s",
+            [size - phones]
+        )
+        cursor.execute(f"ANALYZE {BENCH_TABLE}")
+
+    def _report(self, cursor, name, sql, size, phones, repeat):
+        timings = []
+        blocks = []
+        index_names = set()
+
+        for _ in range(repeat):
+            g = random.randint(size - phones + 1, size)
+            phone = f"+7900{g % phones:07d}"
+            params = [phone, f"{g % 1000000:06d}"] if name == 'verify' else [phone]
+
+            # UPDATE при EXPLAIN ANALYZE выполняется, поэтому откатываем его
+            with transaction.atomic():
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+                transaction.set_rollback(True)
+
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plan = plan[0]
+            timings.append(plan['Execution Time'])
+            root = plan['Plan']
+            # Временная таблица читается через локальные буферы
+            blocks.append(sum(
+                root.get(f"{kind} {access} Blocks", 0)
+                for kind in ('Shared', 'Local') for access in ('Hit', 'Read')
+            ))
+            index_names.update(self._index_names(root))
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"  {name:<10} median {statistics.median(timings):.3f} мс, p95 {p95:.3f} мс, "
+            f"страниц {statistics.mean(blocks):.1f}, индексы: {', '.join(sorted(index_names)) or 'нет (Seq Scan)'}"
+        )
+
+    def _index_names(self, node):
+        if 'Index Name' in node:
+            yield node['Index Name']
+        for child in node.get('Plans', []):
+            yield from self._index_names(child)
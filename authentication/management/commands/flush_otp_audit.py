@@ -0,0 +1,46 @@
+"""
+Перенос очереди аудита OTP из Redis в SMSVerification (OTP_STORAGE = 'redis')
+
+Примеры:
+    python manage.py flush_otp_audit
+    python manage.py flush_otp_audit --batch-size 1000 --loop --interval 5
+"""
+import time
+from django.core.management.base import BaseCommand
+
+from authentication.otp_store import OTPAuditWriter
+
+
+class Command(BaseCommand):
+    help = 'Записывает накопленные в Redis события выпуска и использования OTP кодов в БД пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Событий в одной пачке (OTP_AUDIT_BATCH_SIZE)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать непрерывно')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Пауза при пустой очереди в режиме --loop, секунды')
+
+    def handle(self, *args, **options):
+        while True:
+            issued = consumed = 0
+            while True:
+                result = OTPAuditWriter.flush(batch_size=options['batch_size'])
+                issued += result['issued']
+                consumed += result['consumed']
+                # Очередь разбирает другой процесс - не ждем его
+                locked = result['locked']
+                if locked or not result['pending']:
+                    break
+
+            if locked and not options['loop']:
+                self.stdout.write('Очередь аудита обрабатывает другой процесс')
+            elif issued or consumed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Записано кодов {issued}, использований {consumed}"
+                ))
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,54 @@
+"""
+Очистка устаревших кодов верификации и токенов
+
+Примеры:
+    python manage.py purge_auth_data
+    python manage.py purge_auth_data --retention-days 7 --batch-size 500 --sleep 0.2
+    python manage.py purge_auth_data --loop --interval 300
+"""
+import time
+from django.core.management.base import BaseCommand
+
+from authentication.retention import purge_expired_records
+
+
+class Command(BaseCommand):
+    help = 'Удаляет истекшие SMSVerification и неактивные/просроченные AuthToken пакетами по диапазонам id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help='Сколько дней хранить истекшие записи (AUTH_PURGE_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Ширина диапазона id в одном DELETE (AUTH_PURGE_BATCH_SIZE)')
+        parser.add_argument('--sleep', type=float, default=None,
+                            help='Пауза между пакетами в секундах (AUTH_PURGE_SLEEP)')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Максимум непустых пакетов на таблицу за проход')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать непрерывно, повторяя очистку')
+        parser.add_argument('--interval', type=int, default=300,
+                            help='Пауза между проходами в режиме --loop, секунды')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            results = purge_expired_records(
+                retention_days=options['retention_days'],
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                max_batches=options['max_batches'],
+                stdout=self.stdout if options['verbosity'] > 1 else None,
+            )
+            elapsed = time.monotonic() - started
+
+            for result in results:
+                reclaimed = 'н/д (только PostgreSQL)' if result.bytes is None else f"~{result.bytes} байт"
+                self.stdout.write(self.style.SUCCESS(
+                    f"{result.table}: удалено строк {result.rows}, "
+                    f"освобождено {reclaimed}, пакетов {result.batches}"
+                ))
+            self.stdout.write(f"Время: {elapsed:.2f} с")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+"""
+Воркер отправки OTP кодов из очереди Redis Stream (OTP_DISPATCH_MODE = 'queue')
+
+Можно запускать несколько экземпляров: задачи распределяются группой
+потребителей, задачи упавшего воркера забирают остальные.
+
+Пример:
+    python manage.py run_otp_dispatcher --workers 8
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+
+from authentication.dispatch import OTPDispatchWorker
+from authentication.otp_service import get_otp_service
+
+
+class Command(BaseCommand):
+    help = 'Отправляет поставленные в очередь OTP коды через Telegram Gateway и GreenSMS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Параллельных отправок (потоков)')
+        parser.add_argument('--block', type=int, default=5000,
+                            help='Ожидание новых задач, мс')
+        parser.add_argument('--consumer', default=None,
+                            help='Имя потребителя в группе (по умолчанию host-pid)')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать доступные задачи и выйти')
+
+    def handle(self, *args, **options):
+        worker = OTPDispatchWorker(get_otp_service(), consumer=options['consumer'])
+        worker.ensure_group()
+        self.stdout.write(f"Потребитель {worker.consumer}, потоков {options['workers']}")
+
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='otp-dispatch') as pool:
+            while True:
+                messages = worker.fetch(count=options['workers'], block_ms=options['block'])
+
+                results = pool.map(lambda message: worker.process(*message), messages)
+                for (message_id, _), result in zip(messages, results):
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"{message_id}: {result}")
+
+                if options['once'] and not messages:
+                    break
@@ -0,0 +1,433 @@
+"""
+Локальные заглушки Telegram Gateway и GreenSMS для нагрузочных замеров
+
+Заглушки отвечают как настоящие API, поэтому через них проходит рабочий код
+клиентов: сессии и пулы http_client, таймауты, circuit breaker, кэш
+checkSendAbility, хеджирование. Для каждого ответа задаются задержка
+(распределение) и доли 5xx, 429 и зависаний дольше таймаута клиента.
+
+Подключение приложения к заглушкам (.env):
+    TELEGRAM_GATEWAY_DEBUG=False
+    TELEGRAM_GATEWAY_TOKEN=stub
+    TELEGRAM_GATEWAY_URL=http://127.0.0.1:8081
+    GREEN_SMS_DEBUG=False
+    GREEN_SMS_URL=http://127.0.0.1:8082
+
+Распределения задержки (миллисекунды):
+    fixed:200            - всегда 200 мс
+    uniform:50,400       - равномерно от 50 до 400 мс
+    normal:200,50        - нормальное, среднее 200, отклонение 50
+    lognormal:200,0.5    - логнормальное, медиана 200, sigma 0.5 (длинный хвост)
+    exp:200              - экспоненциальное со средним 200
+
+Примеры:
+    python manage.py run_provider_stubs
+    python manage.py run_provider_stubs --latency lognormal:150,0.6 --error-rate 0.02
+    python manage.py run_provider_stubs --telegram-latency fixed:3000 --telegram-timeout-rate 0.1
+"""
+import json
+import math
+import random
+import secrets
+import signal
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+TELEGRAM_METHODS = (
+    'checkSendAbility',
+    'sendVerificationMessage',
+    'checkVerificationStatus',
+    'revokeVerificationMessage',
+)
+
+# Исходы запроса
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = '5xx'
+OUTCOME_RATE_LIMITED = '429'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_REJECTED = '4xx'
+
+
+def parse_latency(spec):
+    """Разбирает описание распределения задержки; возвращает функцию -> секунды"""
+    name, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(',')] if args else []
+    except ValueError:
+        raise CommandError(f"Неверные параметры задержки: {spec}")
+
+    samplers = {
+        'fixed': (1, lambda ms: ms),
+        'uniform': (2, lambda low, high: random.uniform(low, high)),
+        'normal': (2, lambda mean, sd: random.gauss(mean, sd)),
+        'lognormal': (2, lambda median, sigma: random.lognormvariate(math.log(median), sigma)),
+        'exp': (1, lambda mean: random.expovariate(1 / mean)),
+    }
+    if name not in samplers:
+        raise CommandError(f"Неизвестное распределение задержки: {name} (доступны {', '.join(samplers)})")
+
+    arity, sampler = samplers[name]
+    if len(values) != arity:
+        raise CommandError(f"Распределение {name} принимает {arity} параметр(а): {spec}")
+    if name in ('lognormal', 'exp') and values[0] <= 0:
+        raise CommandError(f"Параметр распределения {name} должен быть больше 0: {spec}")
+
+    return lambda: max(0.0, sampler(*values)) / 1000
+
+
+class StubProfile:
+    """Поведение заглушки одного провайдера: задержка и доли сбоев"""
+
+    def __init__(self, latency, error_rate, rate_limit_rate, timeout_rate, hang_seconds, retry_after):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+
+    def outcome(self):
+        roll = random.random()
+        for outcome, rate in (
+            (OUTCOME_TIMEOUT, self.timeout_rate),
+            (OUTCOME_RATE_LIMITED, self.rate_limit_rate),
+            (OUTCOME_ERROR, self.error_rate),
+        ):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return OUTCOME_OK
+
+
+class StubStats:
+    """Потокобезопасные счетчики ответов: (провайдер, метод, исход) -> число"""
+
+    def __init__(self):
+        self.counter = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, provider, method, outcome):
+        with self.lock:
+            self.counter[(provider, method, outcome)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counter)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Общая часть заглушек: разбор запроса, задержка, сбои, JSON ответ"""
+
+    protocol_version = 'HTTP/1.1'
+    provider = None
+    profile = None
+    stats = None
+
+    def log_message(self, format, *args):
+        # Журнал каждого запроса искажает замер; итоги печатает команда
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def read_params(self):
+        """Параметры из строки запроса и тела (JSON или form)"""
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if body:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    params.update(data)
+            else:
+                params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+        return url.path.strip('/'), params
+
+    def send_json(self, status_code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        path, params = self.read_params()
+        outcome = self.profile.outcome()
+
+        if outcome == OUTCOME_TIMEOUT:
+            # Отвечаем после таймаута клиента и закрываем соединение
+            self.stats.add(self.provider, path, outcome)
+            time.sleep(self.profile.hang_seconds)
+            self.close_connection = True
+            return
+
+        time.sleep(self.profile.latency())
+
+        if outcome == OUTCOME_RATE_LIMITED:
+            status_code, data = self.rate_limited()
+            headers = {'Retry-After': str(self.profile.retry_after)}
+        elif outcome == OUTCOME_ERROR:
+            status_code, data = self.server_error()
+            headers = None
+        else:
+            status_code, data = self.dispatch(path, params)
+            headers = None
+            if status_code >= 400:
+                outcome = OUTCOME_REJECTED
+
+        self.stats.add(self.provider, path, outcome)
+        self.send_json(status_code, data, headers)
+
+    def dispatch(self, path, params):
+        raise NotImplementedError
+
+    def rate_limited(self):
+        raise NotImplementedError
+
+    def server_error(self):
+        raise NotImplementedError
+
+
+class TelegramGatewayStubHandler(StubHandler):
+    """Telegram Gateway API: POST /<method>, Bearer токен, ответы {'ok', 'result'|'error'}"""
+
+    provider = 'telegram'
+    unavailable_rate = 0.0
+    # request_id -> {'phone_number', 'code', 'revoked'}; общий для потоков сервера
+    requests = None
+    lock = None
+
+    def rate_limited(self):
+        return 429, {'ok': False, 'error': f'FLOOD_WAIT_{self.profile.retry_after}'}
+
+    def server_error(self):
+        return 500, {'ok': False, 'error': 'INTERNAL_SERVER_ERROR'}
+
+    def request_status(self, request_id, record, verification_status=None):
+        now = int(time.time())
+        result = {
+            'request_id': request_id,
+            'phone_number': record['phone_number'],
+            'request_cost': 0.01,
+            'remaining_balance': 100.0,
+            'delivery_status': {
+                'status': 'revoked' if record['revoked'] else 'delivered',
+                'updated_at': now
+            },
+        }
+        if verification_status:
+            result['verification_status'] = {'status': verification_status, 'updated_at': now}
+        return result
+
+    def dispatch(self, path, params):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return 401, {'ok': False, 'error': 'ACCESS_TOKEN_REQUIRED'}
+        if path not in TELEGRAM_METHODS:
+            return 404, {'ok': False, 'error': 'METHOD_NOT_FOUND'}
+
+        if path in ('checkSendAbility', 'sendVerificationMessage'):
+            phone_number = params.get('phone_number')
+            if not phone_number:
+                return 400, {'ok': False, 'error': 'PHONE_NUMBER_INVALID'}
+
+            if path == 'checkSendAbility' and random.random() < self.unavailable_rate:
+                return 400, {'ok': False, 'error': 'PHONE_NUMBER_NOT_AVAILABLE'}
+
+            with self.lock:
+                # sendVerificationMessage с request_id из checkSendAbility - бесплатная отправка
+                request_id = params.get('request_id')
+                if request_id not in self.requests:
+                    request_id = secrets.token_hex(8)
+                record = self.requests[request_id] = {
+                    'phone_number': phone_number,
+                    'code': params.get('code') or ''.join(
+                        secrets.choice('0123456789') for _ in range(int(params.get('code_length') or 6))
+                    ),
+                    'revoked': False,
+                }
+            return 200, {'ok': True, 'result': self.request_status(request_id, record)}
+
+        request_id = params.get('request_id')
+        with self.lock:
+            record = self.requests.get(request_id)
+        if record is None:
+            return 400, {'ok': False, 'error': 'REQUEST_ID_INVALID'}
+
+        if path == 'revokeVerificationMessage':
+            record['revoked'] = True
+            return 200, {'ok': True, 'result': True}
+
+        # checkVerificationStatus
+        if record['revoked']:
+            verification_status = 'expired'
+        elif 'code' not in params:
+            verification_status = None
+        else:
+            verification_status = 'code_valid' if str(params['code']) == record['code'] else 'code_invalid'
+        return 200, {'ok': True, 'result': self.request_status(request_id, record, verification_status)}
+
+
+class GreenSMSStubHandler(StubHandler):
+    """GreenSMS REST API: sms/send, sms/status, account/balance; ошибки {'error', 'code'}"""
+
+    provider = 'greensms'
+    sent = None
+    lock = None
+
+    def rate_limited(self):
+        return 429, {'error': 'Too many requests', 'code': 429}
+
+    def server_error(self):
+        return 500, {'error': 'Internal server error', 'code': 500}
+
+    def dispatch(self, path, params):
+        if not params.get('user') or not params.get('pass'):
+            return 401, {'error': 'Authorization declined', 'code': 1}
+
+        if path == 'sms/send':
+            if not params.get('to') or not params.get('txt'):
+                return 400, {'error': 'Validation error: to and txt are required', 'code': 2}
+            request_id = str(uuid.uuid4())
+            with self.lock:
+                self.sent[request_id] = params['to']
+            return 200, {'request_id': request_id}
+
+        if path == 'sms/status':
+            with self.lock:
+                found = params.get('id') in self.sent
+            if not found:
+                return 404, {'error': 'Message not found', 'code': 4}
+            return 200, {'request_id': params['id'], 'status': 'delivered', 'price': '2.50'}
+
+        if path == 'account/balance':
+            return 200, {'balance': '1000.00'}
+
+        return 404, {'error': 'Method not found', 'code': 404}
+
+
+class Command(BaseCommand):
+    help = 'Запускает локальные заглушки Telegram Gateway и GreenSMS с настраиваемыми задержками и сбоями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--telegram-port', type=int, default=8081,
+                            help='Порт Telegram Gateway (0 - не запускать)')
+        parser.add_argument('--greensms-port', type=int, default=8082,
+                            help='Порт GreenSMS (0 - не запускать)')
+        parser.add_argument('--latency', default='fixed:100',
+                            help='Распределение задержки ответа, мс (см. описание команды)')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Доля ответов 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                            help='Доля ответов 429 с Retry-After')
+        parser.add_argument('--timeout-rate', type=float, default=0.0,
+                            help='Доля запросов без ответа дольше таймаута клиента')
+        parser.add_argument('--hang-seconds', type=float, default=30,
+                            help='Сколько держать соединение при зависании, секунды')
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help='Значение Retry-After в ответах 429, секунды')
+        parser.add_argument('--unavailable-rate', type=float, default=0.0,
+                            help='Доля номеров без Telegram в checkSendAbility')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument('--stats-interval', type=float, default=0,
+                            help='Печатать счетчики каждые N секунд (0 - только при остановке)')
+        for provider in ('telegram', 'sms'):
+            for option in ('latency', 'error-rate', 'rate-limit-rate', 'timeout-rate'):
+                parser.add_argument(f'--{provider}-{option}', default=None,
+                                    type=str if option == 'latency' else float,
+                                    help=f'{option} только для {provider}')
+
+    def profile(self, options, provider):
+        def option(name):
+            value = options[f'{provider}_{name}']
+            return options[name] if value is None else value
+
+        rates = [option(name) for name in ('error_rate', 'rate_limit_rate', 'timeout_rate')]
+        if any(rate < 0 for rate in rates) or sum(rates) > 1:
+            raise CommandError(f"Доли сбоев {provider} должны быть неотрицательными и в сумме не больше 1")
+
+        return StubProfile(
+            latency=parse_latency(option('latency')),
+            error_rate=rates[0],
+            rate_limit_rate=rates[1],
+            timeout_rate=rates[2],
+            hang_seconds=options['hang_seconds'],
+            retry_after=options['retry_after'],
+        )
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
+        stats = StubStats()
+        servers = []
+
+        if options['telegram_port']:
+            handler = type('TelegramGatewayStub', (TelegramGatewayStubHandler,), {
+                'profile': self.profile(options, 'telegram'),
+                'stats': stats,
+                'unavailable_rate': options['unavailable_rate'],
+                'requests': {},
+                'lock': threading.Lock(),
+            })
+            servers.append(('Telegram Gateway', ThreadingHTTPServer((options['host'], options['telegram_port']), handler)))
+
+        if options['greensms_port']:
+            handler = type('GreenSMSStub', (GreenSMSStubHandler,), {
+                'profile': self.profile(options, 'sms'),
+                'stats': stats,
+                'sent': {},
+                'lock': threading.Lock(),
+            })
+            servers.append(('GreenSMS', ThreadingHTTPServer((options['host'], options['greensms_port']), handler)))
+
+        if not servers:
+            raise CommandError('Не выбран ни один провайдер')
+
+        for name, server in servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address[:2]
+            self.stdout.write(f"{name}: http://{host}:{port}")
+
+        # SIGTERM (kill, systemd) завершает так же, как Ctrl+C - с выводом итогов
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while True:
+                time.sleep(options['stats_interval'] or 3600)
+                if options['stats_interval']:
+                    self.write_stats(stats)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for _, server in servers:
+                server.shutdown()
+                server.server_close()
+            self.write_stats(stats)
+
+    def write_stats(self, stats):
+        counters = stats.snapshot()
+        if not counters:
+            self.stdout.write('Запросов не было')
+            return
+
+        for provider, method, outcome in sorted(counters):
+            self.stdout.write(f"{provider:10} {method:28} {outcome:8} {counters[(provider, method, outcome)]}")
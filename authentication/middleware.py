@@ -0,0 +1,47 @@
+"""
+Middleware аутентификации
+"""
+import math
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Добавляет заголовки X-RateLimit-* к ответам эндпоинтов с троттлингом
+
+    Троттлинг (authentication.throttling) сохраняет самый строгий из проверенных
+    лимитов в request.rate_limit. Поддерживает sync и async режимы, чтобы под
+    ASGI async views не переводились в поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        self.add_headers(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.add_headers(request, response)
+        return response
+
+    @staticmethod
+    def add_headers(request, response):
+        result = getattr(request, 'rate_limit', None)
+        if result is not None:
+            response['X-RateLimit-Limit'] = str(result.limit)
+            response['X-RateLimit-Remaining'] = str(result.remaining)
+            response['X-RateLimit-Reset'] = str(math.ceil(result.reset_at))
+            if not result.allowed and not response.has_header('Retry-After'):
+                response['Retry-After'] = str(math.ceil(result.retry_after))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_smsverification_request_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authtoken',
+            name='epoch',
+            field=models.PositiveIntegerField(default=0, verbose_name='Эпоха токенов пользователя'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:02
+
+import uuid
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def gen_refresh_tokens(apps, schema_editor):
+    """
+    Refresh токены существующих AuthToken
+
+    На PostgreSQL - одним UPDATE без чтения строк в Python, на остальных базах
+    (разработка на SQLite) - bulk_update пачками.
+    """
+    AuthToken = apps.get_model('authentication', 'AuthToken')
+
+    if schema_editor.connection.vendor == 'postgresql':
+        table = schema_editor.quote_name(AuthToken._meta.db_table)
+        schema_editor.execute(
+            f"UPDATE {table} SET refresh_token = md5(random()::text || id::text)::uuid "
+            "WHERE refresh_token IS NULL"
+        )
+        return
+
+    while True:
+        batch = list(AuthToken.objects.filter(refresh_token__isnull=True).only('pk')[:BATCH_SIZE])
+        if not batch:
+            break
+        for auth_token in batch:
+            auth_token.refresh_token = uuid.uuid4()
+        AuthToken.objects.bulk_update(batch, ['refresh_token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_authtoken_epoch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authtoken',
+            name='refresh_token',
+            field=models.UUIDField(null=True, verbose_name='Refresh токен'),
+        ),
+        migrations.RunPython(gen_refresh_tokens, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='authtoken',
+            name='refresh_token',
+            field=models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Refresh токен'),
+        ),
+        migrations.AddField(
+            model_name='authtoken',
+            name='refresh_generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Поколение refresh токена'),
+        ),
+    ]
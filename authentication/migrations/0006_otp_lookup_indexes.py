@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+from authentication.db_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY не может выполняться внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('authentication', '0005_authtoken_refresh_token'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='authtoken',
+            index=models.Index(fields=['expires_at'], name='authtoken_expires_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='smsverification',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['phone', '-created_at'], name='smsverif_phone_active_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='smsverification',
+            index=models.Index(fields=['expires_at'], name='smsverif_expires_at_idx'),
+        ),
+    ]
@@ -1,10 +1,53 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import connections, models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
 
 User = get_user_model()
 
 
+class SMSVerificationManager(models.Manager):
+    """Менеджер кодов верификации"""
+    
+    def consume(self, phone, code):
+        """
+        Атомарно использует действующий код одним запросом
+        
+        Выполняет UPDATE ... WHERE phone AND code AND NOT is_used AND expires_at > now()
+        RETURNING, поэтому из параллельных проверок одного кода успешна только одна.
+        
+        Returns:
+            dict: {'id', 'request_id'} использованного кода или None
+        """
+        connection = connections[self.db]
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        
+        if not connection.features.can_return_columns_from_insert:
+            updated = self.filter(
+                phone=phone, code=code, is_used=False, expires_at__gt=now
+            ).update(is_used=True)
+            return {'id': None, 'request_id': None} if updated else None
+        
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET is_used = %s "
+                "WHERE phone = %s AND code = %s AND NOT is_used AND expires_at > %s "
+                "RETURNING id, request_id",
+                [True, phone, code, now]
+            )
+            row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        return {'id': row[0], 'request_id': row[1]}
+    
+    async def aconsume(self, phone, code):
+        return await sync_to_async(self.consume)(phone, code)
+
+
 class SMSVerification(models.Model):
     """Модель для хранения SMS кодов верификации"""
     
@@ -15,10 +58,22 @@ class SMSVerification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     expires_at = models.DateTimeField(verbose_name='Дата истечения')
     
+    objects = SMSVerificationManager()
+    
     class Meta:
         verbose_name = 'SMS верификация'
         verbose_name_plural = 'SMS верификации'
         ordering = ['-created_at']
+        indexes = [
+            # Поиск и деактивация действующего кода по номеру
+            models.Index(
+                fields=['phone', '-created_at'],
+                condition=Q(is_used=False),
+                name='smsverif_phone_active_idx'
+            ),
+            # Очистка истекших кодов
+            models.Index(fields=['expires_at'], name='smsverif_expires_at_idx'),
+        ]
     
     def __str__(self):
         return f"SMS для {self.phone} - {self.code}"
@@ -47,7 +102,10 @@ class AuthToken(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
     token = models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Токен')
+    refresh_token = models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Refresh токен')
+    refresh_generation = models.PositiveIntegerField(default=0, verbose_name='Поколение refresh токена')
     is_active = models.BooleanField(default=True, verbose_name='Активен')
+    epoch = models.PositiveIntegerField(default=0, verbose_name='Эпоха токенов пользователя')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     expires_at = models.DateTimeField(verbose_name='Дата истечения')
     
@@ -55,6 +113,10 @@ class AuthToken(models.Model):
         verbose_name = 'Токен аутентификации'
         verbose_name_plural = 'Токены аутентификации'
         ordering = ['-created_at']
+        indexes = [
+            # Очистка просроченных токенов
+            models.Index(fields=['expires_at'], name='authtoken_expires_at_idx'),
+        ]
     
     def __str__(self):
         return f"Токен для {self.user.phone}"
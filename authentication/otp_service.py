@@ -1,13 +1,25 @@
 """
 Универсальный OTP сервис с поддержкой Telegram и SMS
 """
+import asyncio
+import os
+import threading
+import time
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor, wait
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from .models import SMSVerification
+from .otp_store import get_otp_store
 from .services import GreenSMSService
 from .telegram_service import TelegramGatewayService
-from .cache_utils import RateLimiter, SMSVerificationCache
+from .cache_utils import RateLimiter, SMSVerificationCache, TelegramSendAbilityCache
+from .circuit_breaker import CircuitBreaker
+from .dispatch import OTPDispatchQueue
+from .http_client import get_timeout
+
+# HTTP запросов в TelegramGatewayService.deliver_code: checkSendAbility и sendVerificationMessage
+TELEGRAM_DELIVERY_REQUESTS = 2
 
 
 class UniversalOTPService:
@@ -35,55 +47,226 @@ class UniversalOTPService:
                 'fallback_required': bool
             }
         """
-        # Проверяем rate limiting
-        if not RateLimiter.check_rate_limit(phone, limit=5, window=3600):
+        limit_error = self._check_limits(phone)
+        if limit_error:
             return {
                 'success': False,
                 'method': 'none',
-                'message': 'Превышен лимит запросов. Попробуйте позже.',
+                'message': limit_error,
                 'sms_verification': None,
                 'telegram_available': False,
                 'fallback_required': False
             }
         
+        route = self._route(prefer_telegram)
+        if self._should_hedge(route):
+            return self._send_hedged(phone)
+        
+        # Проверяем доступность Telegram (результат кэшируется, см. TelegramSendAbilityCache)
+        telegram_available = 'telegram' in route and self.telegram_service.is_telegram_available(phone)
+        telegram_failed = False
+        
+        for method in route:
+            if method == 'telegram':
+                if not telegram_available:
+                    continue
+                
+                result = self._send_telegram_code(phone)
+                if result['success']:
+                    return {
+                        'success': True,
+                        'method': 'telegram',
+                        'message': 'Код отправлен в Telegram',
+                        'sms_verification': result['sms_verification'],
+                        'telegram_available': True,
+                        'fallback_required': False
+                    }
+                telegram_failed = True
+            else:
+                result = self._send_sms_code(
+                    phone, telegram_available=telegram_available, telegram_failed=telegram_failed
+                )
+                if result['success']:
+                    return result
+        
+        return {
+            'success': False,
+            'method': 'none',
+            'message': 'Ошибка отправки кода' if route else 'Сервисы отправки временно недоступны. Попробуйте позже.',
+            'sms_verification': None,
+            'telegram_available': telegram_available,
+            'fallback_required': False
+        }
+    
+    def _route(self, prefer_telegram=True):
+        """
+        Порядок каналов отправки по состоянию провайдеров
+        
+        Каналы с разомкнутым выключателем исключаются (отказ без ожидания
+        таймаута). Выбранный пользователем канал идет первым, если он не
+        деградировал (доля ошибок или задержка, см. CircuitBreaker.is_degraded)
+        при здоровом втором канале.
+        
+        Returns:
+            список из 'telegram' и 'sms'
+        """
+        preferred = ['telegram', 'sms'] if prefer_telegram else ['sms', 'telegram']
+        if not self.telegram_service.enabled:
+            preferred.remove('telegram')
+        
+        health = CircuitBreaker.snapshot(preferred)
+        available = [method for method in preferred if health[method]['available']]
+        return sorted(available, key=lambda method: CircuitBreaker.is_degraded(health[method]))
+    
+    def _check_limits(self, phone):
+        """Проверяет лимиты отправки; возвращает текст ошибки или None"""
+        # Проверяем rate limiting
+        if not RateLimiter.check_rate_limit(phone, limit=5, window=3600):
+            return 'Превышен лимит запросов. Попробуйте позже.'
+        
         # Проверяем количество попыток
         if not SMSVerificationCache.increment_attempts(phone, max_attempts=5):
+            return 'Превышено максимальное количество попыток. Попробуйте через час.'
+        
+        return None
+    
+    def enqueue_verification_code(self, phone, prefer_telegram=True):
+        """
+        Выпускает код и ставит его отправку в очередь (OTP_DISPATCH_MODE = 'queue')
+        
+        Returns:
+            dict: {
+                'success': bool,
+                'message': str,
+                'dispatch_id': str | None
+            }
+        """
+        limit_error = self._check_limits(phone)
+        if limit_error:
+            return {
+                'success': False,
+                'message': limit_error,
+                'dispatch_id': None
+            }
+        
+        code = self.sms_service.generate_verification_code()
+        get_otp_store().issue(phone, code)
+        dispatch_id = OTPDispatchQueue.enqueue(phone, code, prefer_telegram=prefer_telegram)
+        
+        return {
+            'success': True,
+            'message': 'Код поставлен в очередь на отправку',
+            'dispatch_id': dispatch_id
+        }
+    
+    def deliver_code(self, phone, code, prefer_telegram=True):
+        """
+        Доставляет выпущенный код по каналам из _route: при неудаче - следующим
+        
+        Returns:
+            (метод 'telegram' | 'sms' или None, request_id)
+        """
+        route = self._route(prefer_telegram)
+        if self._should_hedge(route):
+            return self._deliver_hedged(phone, code)
+        
+        for method in route:
+            service = self.telegram_service if method == 'telegram' else self.sms_service
+            success, request_id = service.deliver_code(phone, code)
+            if success:
+                return method, request_id
+        
+        return None, None
+    
+    def _should_hedge(self, route):
+        """Хеджированная отправка: Telegram первым и SMS в запасе"""
+        return settings.OTP_HEDGE_DELAY > 0 and route == ['telegram', 'sms']
+    
+    def _send_hedged(self, phone):
+        """
+        Отправляет код хеджированно (см. _deliver_hedged) и выпускает его один раз
+        
+        Оба канала доставляют один и тот же код, а в хранилище он попадает
+        одним issue после первой успешной доставки, поэтому у номера остается
+        ровно один действующий код.
+        """
+        code = self.sms_service.generate_verification_code()
+        method, request_id = self._deliver_hedged(phone, code)
+        
+        if method is None:
             return {
                 'success': False,
                 'method': 'none',
-                'message': 'Превышено максимальное количество попыток. Попробуйте через час.',
+                'message': 'Ошибка отправки кода',
                 'sms_verification': None,
-                'telegram_available': False,
+                'telegram_available': bool(TelegramSendAbilityCache.get(phone)),
                 'fallback_required': False
             }
         
-        # Проверяем доступность Telegram
-        telegram_available = self.telegram_service.is_telegram_available(phone)
+        sms_verification = get_otp_store().issue(phone, code, request_id=request_id)
         
-        # Логика выбора метода
-        if prefer_telegram and telegram_available:
-            # Пробуем Telegram
-            result = self._send_telegram_code(phone)
-            if result['success']:
-                return {
-                    'success': True,
-                    'method': 'telegram',
-                    'message': 'Код отправлен в Telegram',
-                    'sms_verification': result['sms_verification'],
-                    'telegram_available': True,
-                    'fallback_required': False
-                }
-            else:
-                # Telegram не сработал, пробуем SMS
-                return self._send_sms_code(phone, telegram_failed=True)
+        return {
+            'success': True,
+            'method': method,
+            'message': 'Код отправлен в Telegram' if method == 'telegram' else 'Код отправлен по SMS',
+            'sms_verification': sms_verification,
+            'telegram_available': method == 'telegram' or bool(TelegramSendAbilityCache.get(phone)),
+            'fallback_required': False
+        }
+    
+    def _deliver_hedged(self, phone, code):
+        """
+        Доставляет код через Telegram, а если он не ответил за
+        OTP_HEDGE_DELAY секунд - параллельно еще и по SMS
         
-        elif not prefer_telegram or not telegram_available:
-            # Пробуем SMS
-            return self._send_sms_code(phone, telegram_available=telegram_available)
+        В пуле выполняется только Telegram, SMS отправляется в текущем потоке:
+        зависшие вызовы Telegram не задерживают SMS в очереди пула. Пул
+        ограничен OTP_HEDGE_WORKERS одновременными отправками; если все заняты,
+        Telegram сейчас не отвечает и код сразу отправляется по SMS. Время ответа
+        ограничено OTP_HEDGE_DELAY плюс время SMS, а не таймаутом медленного
+        провайдера; не успевшая отправка в Telegram завершается в фоне. Если
+        SMS не доставлена, Telegram ждем не дольше таймаутов его HTTP запросов.
         
-        else:
-            # Telegram недоступен, отправляем SMS
-            return self._send_sms_code(phone, telegram_available=False)
+        Returns:
+            (метод 'telegram' | 'sms' или None, request_id)
+        """
+        started = time.monotonic()
+        telegram = _submit_hedged(self.telegram_service.deliver_code, phone, code)
+        if telegram is None:
+            success, request_id = self.sms_service.deliver_code(phone, code)
+            return ('sms', request_id) if success else (None, None)
+        
+        done, _ = wait([telegram], timeout=settings.OTP_HEDGE_DELAY)
+        if done:
+            success, request_id = self._delivery_result(telegram)
+            if success:
+                return 'telegram', request_id
+        
+        # Telegram не успел или ответил отказом - отправляем SMS
+        success, request_id = self.sms_service.deliver_code(phone, code)
+        if success:
+            return 'sms', request_id
+        
+        if not done:
+            # Ждем Telegram не дольше его собственных таймаутов: зависший вызов
+            # не должен держать поток запроса, после дедлайна он считается неудачей
+            remaining = TELEGRAM_DELIVERY_REQUESTS * sum(get_timeout()) - (time.monotonic() - started)
+            done, _ = wait([telegram], timeout=max(remaining, 0))
+            if done:
+                success, request_id = self._delivery_result(telegram)
+                if success:
+                    return 'telegram', request_id
+        
+        return None, None
+    
+    @staticmethod
+    def _delivery_result(future):
+        """(успех, request_id) завершенной отправки"""
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Ошибка отправки OTP: {e}")
+            return False, None
     
     def _send_telegram_code(self, phone):
         """Отправляет код через Telegram"""
@@ -134,36 +317,13 @@ class UniversalOTPService:
         }
     
     def verify_code(self, phone, code):
-        """Проверяет код верификации"""
-        try:
-            sms_verification = SMSVerification.objects.get(
-                phone=phone,
-                code=code,
-                is_used=False
-            )
-            
-            if not sms_verification.is_valid():
-                return False
-            
-            # Если есть request_id, проверяем через Telegram
-            if sms_verification.request_id:
-                telegram_valid = self.telegram_service.verify_otp_code(phone, code)
-                if telegram_valid:
-                    sms_verification.is_used = True
-                    sms_verification.save()
-                    return True
-            
-            # Проверяем через SMS сервис
-            sms_valid = self.sms_service.verify_code(phone, code)
-            if sms_valid:
-                sms_verification.is_used = True
-                sms_verification.save()
-                return True
-            
-            return False
-            
-        except SMSVerification.DoesNotExist:
-            return False
+        """
+        Проверяет код верификации
+        
+        Коды Telegram и SMS хранятся в одном хранилище (OTP_STORAGE), поэтому
+        проверка для любого канала - одна атомарная операция.
+        """
+        return get_otp_store().consume(phone, code)
     
     def send_sms_fallback(self, phone):
         """Отправляет SMS как резервный вариант"""
@@ -188,6 +348,139 @@ class UniversalOTPService:
         """Проверяет доступность Telegram для номера"""
         return self.telegram_service.is_telegram_available(phone)
     
+    # Асинхронные варианты для async views (authentication/async_views.py).
+    # Вызовы провайдеров идут через httpx без потоков; короткие операции с
+    # Redis (лимиты, выключатели) - в пуле потоков, ORM - через async API Django.
+    
+    async def asend_verification_code(self, phone, prefer_telegram=True):
+        """
+        Асинхронный вариант send_verification_code
+        
+        Код выпускается один раз после доставки, каналы выбираются по _route,
+        как в deliver_code.
+        """
+        limit_error = await sync_to_async(self._check_limits, thread_sensitive=False)(phone)
+        if limit_error:
+            return {
+                'success': False,
+                'method': 'none',
+                'message': limit_error,
+                'sms_verification': None,
+                'telegram_available': False,
+                'fallback_required': False
+            }
+        
+        code = self.sms_service.generate_verification_code()
+        method, request_id = await self.adeliver_code(phone, code, prefer_telegram=prefer_telegram)
+        telegram_available = method == 'telegram' or bool(await TelegramSendAbilityCache.aget(phone))
+        
+        if method is None:
+            return {
+                'success': False,
+                'method': 'none',
+                'message': 'Ошибка отправки кода',
+                'sms_verification': None,
+                'telegram_available': telegram_available,
+                'fallback_required': False
+            }
+        
+        sms_verification = await get_otp_store().aissue(phone, code, request_id=request_id)
+        
+        if method == 'telegram':
+            message = 'Код отправлен в Telegram'
+        elif prefer_telegram and telegram_available:
+            message = 'Telegram недоступен. Код отправлен по SMS'
+        else:
+            message = 'Код отправлен по SMS'
+        
+        return {
+            'success': True,
+            'method': method,
+            'message': message,
+            'sms_verification': sms_verification,
+            'telegram_available': telegram_available,
+            'fallback_required': False
+        }
+    
+    async def adeliver_code(self, phone, code, prefer_telegram=True):
+        """Асинхронный вариант deliver_code"""
+        route = await sync_to_async(self._route, thread_sensitive=False)(prefer_telegram)
+        if self._should_hedge(route):
+            return await self._adeliver_hedged(phone, code)
+        
+        for method in route:
+            service = self.telegram_service if method == 'telegram' else self.sms_service
+            success, request_id = await service.adeliver_code(phone, code)
+            if success:
+                return method, request_id
+        
+        return None, None
+    
+    async def _adeliver_hedged(self, phone, code):
+        """Асинхронный вариант _deliver_hedged: задачи asyncio вместо потоков"""
+        started = time.monotonic()
+        telegram = asyncio.ensure_future(self.telegram_service.adeliver_code(phone, code))
+        
+        done, _ = await asyncio.wait({telegram}, timeout=settings.OTP_HEDGE_DELAY)
+        if done:
+            success, request_id = self._delivery_result(telegram)
+            if success:
+                return 'telegram', request_id
+            
+            success, request_id = await self.sms_service.adeliver_code(phone, code)
+            return ('sms', request_id) if success else (None, None)
+        
+        pending = {
+            telegram: 'telegram',
+            asyncio.ensure_future(self.sms_service.adeliver_code(phone, code)): 'sms',
+        }
+        # Как и в _deliver_hedged, ожидание ограничено таймаутами провайдеров
+        deadline = started + TELEGRAM_DELIVERY_REQUESTS * sum(get_timeout())
+        result = (None, None)
+        while pending and result[0] is None:
+            timeout = max(deadline - time.monotonic(), 0)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                method = pending.pop(task)
+                success, request_id = self._delivery_result(task)
+                if success:
+                    result = (method, request_id)
+        
+        # Отправка, которая не успела, завершается в фоне
+        for other in pending:
+            _background_tasks.add(other)
+            other.add_done_callback(_background_tasks.discard)
+        return result
+    
+    async def averify_code(self, phone, code):
+        """Асинхронный вариант verify_code"""
+        return await get_otp_store().aconsume(phone, code)
+    
+    async def asend_sms_fallback(self, phone):
+        """Асинхронный вариант send_sms_fallback"""
+        try:
+            sms_verification = await self.sms_service.asend_verification_code(phone)
+            if sms_verification:
+                return {
+                    'success': True,
+                    'message': 'Код отправлен по SMS',
+                    'sms_verification': sms_verification
+                }
+        except Exception as e:
+            print(f"Ошибка отправки SMS fallback: {e}")
+        
+        return {
+            'success': False,
+            'message': 'Ошибка отправки SMS',
+            'sms_verification': None
+        }
+    
+    async def acheck_telegram_availability(self, phone):
+        """Асинхронный вариант check_telegram_availability"""
+        return await self.telegram_service.ais_telegram_available(phone)
+    
     def get_delivery_status(self, request_id):
         """Получает статус доставки"""
         if not request_id:
@@ -208,3 +501,64 @@ class UniversalOTPService:
             'telegram_available': settings.TELEGRAM_GATEWAY_ENABLED,
             'sms_balance': self.sms_service.get_balance() if hasattr(self.sms_service, 'get_balance') else None
         }
+
+
+_otp_service = None
+
+
+def get_otp_service():
+    """
+    Возвращает общий для процесса UniversalOTPService
+    
+    Сервисы провайдеров не хранят соединений (сессии берутся из http_client
+    при каждом запросе), поэтому экземпляр безопасно делить между потоками
+    и создавать до fork.
+    """
+    global _otp_service
+    if _otp_service is None:
+        _otp_service = UniversalOTPService()
+    return _otp_service
+
+
+_background_tasks = set()
+_hedge_executor = None
+_hedge_slots = None
+_hedge_pid = None
+_hedge_lock = threading.Lock()
+
+
+def _get_hedge_executor():
+    """Пул потоков хеджированной отправки; создается заново после fork"""
+    global _hedge_executor, _hedge_slots, _hedge_pid
+    if _hedge_pid != os.getpid():
+        with _hedge_lock:
+            if _hedge_pid != os.getpid():
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=settings.OTP_HEDGE_WORKERS,
+                    thread_name_prefix='otp-hedge'
+                )
+                _hedge_slots = threading.BoundedSemaphore(settings.OTP_HEDGE_WORKERS)
+                _hedge_pid = os.getpid()
+    return _hedge_executor
+
+
+def _submit_hedged(fn, *args):
+    """
+    Запускает fn(*args) в пуле хеджированной отправки
+    
+    Очередь пула не используется: задача принимается, только если свободен
+    один из OTP_HEDGE_WORKERS потоков, иначе возвращается None.
+    """
+    executor = _get_hedge_executor()
+    slots = _hedge_slots
+    if not slots.acquire(blocking=False):
+        return None
+    
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    
+    future.add_done_callback(lambda _: slots.release())
+    return future
@@ -0,0 +1,316 @@
+"""
+Хранилища действующих OTP кодов
+
+OTP_STORAGE = 'database' - код хранится в SMSVerification, проверка - условный UPDATE.
+OTP_STORAGE = 'redis' - действующий код, его TTL и счетчик неверных попыток хранятся
+в хэше Redis, проверка - один Lua скрипт. В SMSVerification строки попадают
+асинхронно (write-behind) через очередь аудита и команду flush_otp_audit,
+только для аудита.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from .cache_utils import run_lua_script
+from .models import SMSVerification
+
+AUDIT_QUEUE_KEY = 'otp_audit_queue'
+AUDIT_LOCK_KEY = 'otp_audit_flush_lock'
+
+
+class DatabaseOTPStore:
+    """Коды в таблице SMSVerification"""
+
+    def issue(self, phone: str, code: str, request_id: Optional[str] = None) -> SMSVerification:
+        """Сохраняет новый код, деактивируя предыдущие коды номера"""
+        SMSVerification.objects.filter(phone=phone, is_used=False).update(is_used=True)
+
+        return SMSVerification.objects.create(
+            phone=phone,
+            code=code,
+            request_id=request_id,
+            expires_at=timezone.now() + timedelta(seconds=settings.OTP_CODE_TTL)
+        )
+
+    def consume(self, phone: str, code: str) -> bool:
+        """Атомарно использует код"""
+        return SMSVerification.objects.consume(phone, code) is not None
+
+    def set_request_id(self, phone: str, code: str, request_id: str) -> None:
+        """Сохраняет request_id провайдера для кода, отправленного после выпуска"""
+        SMSVerification.objects.filter(phone=phone, code=code, is_used=False).update(request_id=request_id)
+
+    async def aissue(self, phone: str, code: str, request_id: Optional[str] = None) -> SMSVerification:
+        await SMSVerification.objects.filter(phone=phone, is_used=False).aupdate(is_used=True)
+
+        return await SMSVerification.objects.acreate(
+            phone=phone,
+            code=code,
+            request_id=request_id,
+            expires_at=timezone.now() + timedelta(seconds=settings.OTP_CODE_TTL)
+        )
+
+    async def aconsume(self, phone: str, code: str) -> bool:
+        return await SMSVerification.objects.aconsume(phone, code) is not None
+
+
+class RedisOTPStore:
+    """
+    Коды в Redis с отложенной записью в SMSVerification
+
+    Ключ otp_{phone} - хэш {code, request_id, attempts} с TTL кода. Новый код
+    заменяет предыдущий. После OTP_MAX_VERIFY_ATTEMPTS неверных попыток код удаляется.
+    """
+
+    # KEYS[1] - хэш кода, KEYS[2] - очередь аудита
+    # ARGV[1] - код, ARGV[2] - лимит попыток, ARGV[3] - событие аудита
+    CONSUME_SCRIPT = """
+    local code = redis.call('HGET', KEYS[1], 'code')
+    if not code then
+        return 0
+    end
+    if code == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        redis.call('RPUSH', KEYS[2], ARGV[3])
+        return 1
+    end
+    if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[2]) then
+        redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    # KEYS[1] - хэш кода, KEYS[2] - очередь аудита
+    # ARGV[1] - код, ARGV[2] - request_id, ARGV[3] - событие аудита
+    SET_REQUEST_ID_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'code') == ARGV[1] then
+        redis.call('HSET', KEYS[1], 'request_id', ARGV[2])
+    end
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+    return 1
+    """
+
+    def __init__(self):
+        self._consume_script = None
+        self._set_request_id_script = None
+
+    @staticmethod
+    def _client():
+        return get_redis_connection('default')
+
+    @staticmethod
+    def _code_key(phone: str) -> str:
+        return cache.make_key(f"otp_{phone}")
+
+    @staticmethod
+    def _queue_key() -> str:
+        return cache.make_key(AUDIT_QUEUE_KEY)
+
+    def issue(self, phone: str, code: str, request_id: Optional[str] = None) -> SMSVerification:
+        """
+        Сохраняет новый код одной транзакцией Redis
+
+        Returns:
+            Несохраненный экземпляр SMSVerification с данными кода
+        """
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.OTP_CODE_TTL)
+        key = self._code_key(phone)
+        event = {
+            'event': 'issued',
+            'phone': phone,
+            'code': code,
+            'request_id': request_id,
+            'expires_at': expires_at.isoformat(),
+        }
+
+        pipe = self._client().pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping={'code': code, 'request_id': request_id or '', 'attempts': 0})
+        pipe.expire(key, settings.OTP_CODE_TTL)
+        pipe.rpush(self._queue_key(), json.dumps(event))
+        pipe.execute()
+
+        return SMSVerification(
+            phone=phone,
+            code=code,
+            request_id=request_id,
+            created_at=now,
+            expires_at=expires_at
+        )
+
+    def consume(self, phone: str, code: str) -> bool:
+        """Проверяет и использует код одним Lua скриптом"""
+        client = self._client()
+        if self._consume_script is None:
+            self._consume_script = client.register_script(self.CONSUME_SCRIPT)
+
+        event = json.dumps({'event': 'consumed', 'phone': phone, 'code': code})
+        result = self._consume_script(
+            keys=[self._code_key(phone), self._queue_key()],
+            args=[code, settings.OTP_MAX_VERIFY_ATTEMPTS, event],
+            client=client
+        )
+        return result == 1
+
+    def set_request_id(self, phone: str, code: str, request_id: str) -> None:
+        """Сохраняет request_id провайдера для кода, отправленного после выпуска"""
+        client = self._client()
+        if self._set_request_id_script is None:
+            self._set_request_id_script = client.register_script(self.SET_REQUEST_ID_SCRIPT)
+
+        event = json.dumps({'event': 'delivered', 'phone': phone, 'code': code, 'request_id': request_id})
+        self._set_request_id_script(
+            keys=[self._code_key(phone), self._queue_key()],
+            args=[code, request_id, event],
+            client=client
+        )
+
+    # Только Redis: выполняются в пуле потоков, не занимая поток ORM
+    async def aissue(self, phone: str, code: str, request_id: Optional[str] = None) -> SMSVerification:
+        return await sync_to_async(self.issue, thread_sensitive=False)(phone, code, request_id)
+
+    async def aconsume(self, phone: str, code: str) -> bool:
+        return await sync_to_async(self.consume, thread_sensitive=False)(phone, code)
+
+
+class OTPAuditWriter:
+    """Перенос событий из очереди аудита Redis в SMSVerification"""
+
+    # KEYS[1] - блокировка, KEYS[2] - очередь, ARGV[1] - токен владельца, ARGV[2] - число событий
+    # Пачка удаляется из очереди, только если блокировка все еще наша
+    TRIM_SCRIPT = """
+    if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('LTRIM', KEYS[2], tonumber(ARGV[2]), -1)
+    redis.call('DEL', KEYS[1])
+    return 1
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+    end
+    return 1
+    """
+
+    @staticmethod
+    def flush(batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Записывает одну пачку событий в БД
+
+        События удаляются из очереди только после успешной записи, поэтому при
+        сбое пачка будет записана повторно (at-least-once). Одновременно пачку
+        обрабатывает один процесс: остальные получают locked=True и ничего не
+        делают. Если блокировка истекла до записи (OTP_AUDIT_LOCK_TIMEOUT),
+        пачка остается в очереди и будет записана еще раз, но не потеряется.
+
+        Returns:
+            dict: {'issued': int, 'consumed': int, 'pending': int, 'locked': bool}
+        """
+        batch_size = batch_size or settings.OTP_AUDIT_BATCH_SIZE
+        client = get_redis_connection('default')
+        queue_key = cache.make_key(AUDIT_QUEUE_KEY)
+        lock_key = cache.make_key(AUDIT_LOCK_KEY)
+
+        token = uuid.uuid4().hex
+        if not client.set(lock_key, token, nx=True, px=settings.OTP_AUDIT_LOCK_TIMEOUT * 1000):
+            return {'issued': 0, 'consumed': 0, 'pending': client.llen(queue_key), 'locked': True}
+
+        try:
+            raw_events = client.lrange(queue_key, 0, batch_size - 1)
+            if not raw_events:
+                return {'issued': 0, 'consumed': 0, 'pending': 0, 'locked': False}
+
+            events = [json.loads(raw) for raw in raw_events]
+            issued, consumed, delivered = OTPAuditWriter._split_events(events)
+
+            with transaction.atomic():
+                # Новый код заменяет предыдущий, как и в DatabaseOTPStore.issue
+                phones = {row.phone for row in issued}
+                if phones:
+                    SMSVerification.objects.filter(phone__in=phones, is_used=False).update(is_used=True)
+                SMSVerification.objects.bulk_create(issued)
+
+                # Коды, выпущенные в предыдущих пачках
+                for (phone, code), request_id in delivered.items():
+                    SMSVerification.objects.filter(phone=phone, code=code).update(request_id=request_id)
+                for phone, code in consumed:
+                    SMSVerification.objects.filter(phone=phone, code=code, is_used=False).update(is_used=True)
+
+            trimmed = run_lua_script(
+                OTPAuditWriter.TRIM_SCRIPT,
+                keys=[lock_key, queue_key],
+                args=[token, len(raw_events)],
+                client=client
+            )
+            if not trimmed:
+                print("Блокировка аудита OTP истекла до записи пачки, пачка будет записана повторно")
+        finally:
+            run_lua_script(OTPAuditWriter.RELEASE_SCRIPT, keys=[lock_key], args=[token], client=client)
+
+        return {
+            'issued': len(issued),
+            'consumed': sum(1 for event in events if event['event'] == 'consumed'),
+            'pending': client.llen(queue_key),
+            'locked': False
+        }
+
+    @staticmethod
+    def _split_events(events: List[Dict]):
+        """
+        Разбирает пачку: выпущенные коды -> строки для bulk_create
+
+        Замена, отправка и использование кода из той же пачки отмечаются прямо
+        в новых строках, без отдельных UPDATE.
+        """
+        issued = []
+        latest = {}
+        consumed = []
+        delivered = {}
+
+        for event in events:
+            key = (event['phone'], event['code'])
+
+            if event['event'] == 'issued':
+                row = SMSVerification(
+                    phone=event['phone'],
+                    code=event['code'],
+                    request_id=event['request_id'],
+                    expires_at=datetime.fromisoformat(event['expires_at'])
+                )
+                previous = latest.get(event['phone'])
+                if previous is not None:
+                    previous.is_used = True
+                latest[event['phone']] = row
+                issued.append(row)
+            elif latest.get(event['phone']) is not None and latest[event['phone']].code == event['code']:
+                if event['event'] == 'delivered':
+                    latest[event['phone']].request_id = event['request_id']
+                else:
+                    latest[event['phone']].is_used = True
+            elif event['event'] == 'delivered':
+                delivered[key] = event['request_id']
+            else:
+                consumed.append(key)
+
+        return issued, consumed, delivered
+
+
+def get_otp_store():
+    """Возвращает хранилище OTP согласно OTP_STORAGE"""
+    global _otp_store
+    if _otp_store is None:
+        _otp_store = RedisOTPStore() if settings.OTP_STORAGE == 'redis' else DatabaseOTPStore()
+    return _otp_store
+
+
+_otp_store = None
@@ -0,0 +1,126 @@
+"""
+Очистка устаревших записей SMSVerification и AuthToken
+
+Строки удаляются небольшими пакетами по диапазонам первичного ключа: каждый DELETE
+держит блокировки только на строках своего диапазона и быстро фиксируется, поэтому
+очистку можно запускать непрерывно на рабочей базе.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Max, Min, Q
+from django.utils import timezone
+
+from .models import AuthToken, SMSVerification
+
+
+@dataclass
+class PurgeResult:
+    """Итог очистки одной таблицы"""
+    table: str
+    rows: int = 0
+    bytes: Optional[int] = 0
+    batches: int = 0
+
+
+def sms_verification_purge_condition(retention_days):
+    """Коды, истекшие раньше окна хранения"""
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return Q(expires_at__lt=cutoff)
+
+
+def auth_token_purge_condition(retention_days):
+    """Просроченные, деактивированные и отозванные через эпоху токены"""
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return (
+        Q(expires_at__lt=cutoff)
+        | Q(is_active=False, created_at__lt=cutoff)
+        | ~Q(epoch=F('user__token_epoch'))
+    )
+
+
+def _delete_batch(model, ids):
+    """
+    Удаляет строки по id
+
+    Returns:
+        (число строк, освобожденные байты или None, если СУБД не умеет их посчитать)
+    """
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} AS t WHERE t.id = ANY(%s) RETURNING pg_column_size(t.*)",
+                [ids]
+            )
+            sizes = [row[0] for row in cursor.fetchall()]
+        return len(sizes), sum(sizes)
+
+    deleted, _ = model.objects.filter(pk__in=ids).delete()
+    return deleted, None
+
+
+def purge_table(model, condition, batch_size=1000, sleep=0.1, max_batches=None, stdout=None):
+    """
+    Удаляет строки model, подходящие под condition, пакетами по диапазонам id
+
+    Args:
+        model: Модель Django
+        condition: Q-условие для удаляемых строк
+        batch_size: Ширина диапазона первичного ключа в одном пакете
+        sleep: Пауза между пакетами в секундах (троттлинг)
+        max_batches: Ограничение числа непустых пакетов за запуск
+        stdout: Поток для вывода прогресса
+    """
+    result = PurgeResult(table=model._meta.db_table)
+    bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return result
+
+    low = bounds['low']
+    while low <= bounds['high']:
+        ids = list(
+            model.objects.filter(condition, pk__gte=low, pk__lt=low + batch_size)
+            .values_list('pk', flat=True)
+        )
+        low += batch_size
+        if not ids:
+            continue
+
+        rows, size = _delete_batch(model, ids)
+        result.rows += rows
+        result.batches += 1
+        result.bytes = None if size is None or result.bytes is None else result.bytes + size
+
+        if stdout:
+            stdout.write(f"{result.table}: удалено {result.rows} строк (до id {low - 1})")
+
+        if max_batches and result.batches >= max_batches:
+            break
+
+        if sleep:
+            time.sleep(sleep)
+
+    return result
+
+
+def purge_expired_records(retention_days=None, batch_size=None, sleep=None, max_batches=None, stdout=None):
+    """
+    Очищает SMSVerification и AuthToken (точка входа для cron/планировщика)
+
+    Returns:
+        list[PurgeResult]
+    """
+    retention_days = settings.AUTH_PURGE_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.AUTH_PURGE_BATCH_SIZE
+    sleep = settings.AUTH_PURGE_SLEEP if sleep is None else sleep
+
+    return [
+        purge_table(SMSVerification, sms_verification_purge_condition(retention_days),
+                    batch_size=batch_size, sleep=sleep, max_batches=max_batches, stdout=stdout),
+        purge_table(AuthToken, auth_token_purge_condition(retention_days),
+                    batch_size=batch_size, sleep=sleep, max_batches=max_batches, stdout=stdout),
+    ]
@@ -157,11 +157,16 @@ class UserLoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True, help_text='Пароль')
 
 
+class RefreshTokenSerializer(serializers.Serializer):
+    """Сериализатор для обновления access токена"""
+    refresh_token = serializers.CharField(max_length=200, help_text='Refresh токен')
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения информации о пользователе"""
     role_display = serializers.CharField(source='get_role_display', read_only=True)
     should_update_password = serializers.BooleanField(read_only=True)
-    is_registration_complete = serializers.BooleanField(source='is_registration_complete', read_only=True)
+    is_registration_complete = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = User
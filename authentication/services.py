@@ -1,23 +1,103 @@
 import random
+import time
 from django.conf import settings
-from django.utils import timezone
-from datetime import timedelta
-from .models import SMSVerification
-from greensms.client import GreenSMS
+from .circuit_breaker import get_circuit_breaker
+from .http_client import get_async_client, get_session, get_timeout
+from .otp_store import get_otp_store
 from .telegram_service import TelegramGatewayService
 
 
+class GreenSMSError(Exception):
+    """Ошибка GreenSMS API (ответ с ключом 'error')"""
+
+
+class GreenSMSClient:
+    """
+    REST клиент GreenSMS API поверх общей keep-alive сессии
+    
+    Официальная библиотека greensms вызывает requests.request без сессии
+    и таймаута, то есть открывает новое TLS соединение на каждый запрос.
+    """
+    
+    def __init__(self, user, password, base_url):
+        self.user = user
+        self.password = password
+        self.base_url = base_url.rstrip('/')
+    
+    def _request(self, method, path, params=None):
+        # Разомкнутый выключатель - сразу отказ, без ожидания таймаута
+        breaker = get_circuit_breaker('sms')
+        if not breaker.allow():
+            raise GreenSMSError('GreenSMS временно недоступен')
+        
+        started = time.perf_counter()
+        try:
+            response = get_session('greensms').request(
+                method,
+                f"{self.base_url}/{path}",
+                params={'user': self.user, 'pass': self.password, **(params or {})},
+                timeout=get_timeout()
+            )
+        except Exception:
+            breaker.record(False, time.perf_counter() - started)
+            raise
+        
+        breaker.record(response.status_code < 500, time.perf_counter() - started)
+        return self._parse_response(response)
+    
+    async def _arequest(self, method, path, params=None):
+        """Асинхронный вариант _request (httpx, для ASGI)"""
+        breaker = get_circuit_breaker('sms')
+        if not await breaker.aallow():
+            raise GreenSMSError('GreenSMS временно недоступен')
+        
+        started = time.perf_counter()
+        try:
+            response = await get_async_client('greensms').request(
+                method,
+                f"{self.base_url}/{path}",
+                params={'user': self.user, 'pass': self.password, **(params or {})}
+            )
+        except Exception:
+            await breaker.arecord(False, time.perf_counter() - started)
+            raise
+        
+        await breaker.arecord(response.status_code < 500, time.perf_counter() - started)
+        return self._parse_response(response)
+    
+    @staticmethod
+    def _parse_response(response):
+        data = response.json()
+        
+        if 'error' in data:
+            raise GreenSMSError(data['error'])
+        return data
+    
+    def send_sms(self, to, txt):
+        return self._request('POST', 'sms/send', {'to': to, 'txt': txt})
+    
+    async def asend_sms(self, to, txt):
+        return await self._arequest('POST', 'sms/send', {'to': to, 'txt': txt})
+    
+    def sms_status(self, request_id):
+        return self._request('GET', 'sms/status', {'id': request_id})
+    
+    def balance(self):
+        return self._request('GET', 'account/balance')
+
+
 class GreenSMSService:
-    """Сервис для работы с Green SMS API через официальную библиотеку"""
+    """Сервис для работы с Green SMS API"""
     
     def __init__(self):
         self.user = settings.GREEN_SMS_USER
         self.password = settings.GREEN_SMS_PASSWORD
         self.debug_mode = settings.GREEN_SMS_DEBUG
         
-        # Инициализируем клиент только если не в debug режиме
+        # Клиент не держит соединений: сессия берется при каждом запросе
+        # (см. http_client), поэтому сервис можно создать до fork
         if not self.debug_mode:
-            self.client = GreenSMS(user=self.user, password=self.password)
+            self.client = GreenSMSClient(self.user, self.password, settings.GREEN_SMS_URL)
         else:
             self.client = None
     
@@ -29,11 +109,10 @@ class GreenSMSService:
             return True, "debug_request_id"
         
         try:
-            # Используем официальную библиотеку GreenSMS
-            response = self.client.sms.send(to=phone, txt=message)
+            response = self.client.send_sms(to=phone, txt=message)
             
-            if response and hasattr(response, 'request_id'):
-                return True, response.request_id
+            if response.get('request_id'):
+                return True, response['request_id']
             else:
                 return False, None
                 
@@ -41,59 +120,69 @@ class GreenSMSService:
             print(f"Ошибка отправки SMS: {e}")
             return False, None
     
+    async def asend_sms(self, phone, message):
+        """Асинхронный вариант send_sms"""
+        if self.debug_mode:
+            print(f"DEBUG SMS: {phone} - {message}")
+            return True, "debug_request_id"
+        
+        try:
+            response = await self.client.asend_sms(to=phone, txt=message)
+            
+            if response.get('request_id'):
+                return True, response['request_id']
+            return False, None
+        except Exception as e:
+            print(f"Ошибка отправки SMS: {e}")
+            return False, None
+    
     def generate_verification_code(self):
         """Генерирует 6-значный код подтверждения"""
+        if settings.OTP_FIXED_CODE:
+            return settings.OTP_FIXED_CODE
         return str(random.randint(100000, 999999))
     
+    def deliver_code(self, phone, code):
+        """
+        Отправляет уже сгенерированный код по SMS
+        
+        Returns:
+            (успех, request_id)
+        """
+        message = f"Ваш код подтверждения: {code}"
+        return self.send_sms(phone, message)
+    
+    async def adeliver_code(self, phone, code):
+        """Асинхронный вариант deliver_code"""
+        message = f"Ваш код подтверждения: {code}"
+        return await self.asend_sms(phone, message)
+    
     def send_verification_code(self, phone):
         """Отправляет код подтверждения на телефон"""
         code = self.generate_verification_code()
         
-        # Сохраняем код в базе данных
-        expires_at = timezone.now() + timedelta(minutes=5)  # Код действует 5 минут
+        success, request_id = self.deliver_code(phone, code)
         
-        # Деактивируем предыдущие коды для этого номера
-        SMSVerification.objects.filter(phone=phone, is_used=False).update(is_used=True)
+        if not success:
+            return None
+        
+        # Сохраняем код (в БД или Redis, см. OTP_STORAGE)
+        return get_otp_store().issue(phone, code, request_id=request_id)
+    
+    async def asend_verification_code(self, phone):
+        """Асинхронный вариант send_verification_code"""
+        code = self.generate_verification_code()
         
-        # Создаем новый код
-        sms_verification = SMSVerification.objects.create(
-            phone=phone,
-            code=code,
-            expires_at=expires_at
-        )
+        success, request_id = await self.adeliver_code(phone, code)
         
-        # Отправляем SMS
-        message = f"Ваш код подтверждения: {code}"
-        success, request_id = self.send_sms(phone, message)
-        
-        if success:
-            # Сохраняем request_id для отслеживания
-            if request_id:
-                sms_verification.request_id = request_id
-                sms_verification.save()
-            return sms_verification
-        else:
-            sms_verification.delete()
+        if not success:
             return None
+        
+        return await get_otp_store().aissue(phone, code, request_id=request_id)
     
     def verify_code(self, phone, code):
         """Проверяет код подтверждения"""
-        try:
-            sms_verification = SMSVerification.objects.get(
-                phone=phone,
-                code=code,
-                is_used=False
-            )
-            
-            if sms_verification.is_valid():
-                sms_verification.is_used = True
-                sms_verification.save()
-                return True
-            else:
-                return False
-                
-        except SMSVerification.DoesNotExist:
-            return False
+        return get_otp_store().consume(phone, code)
     
     def get_sms_status(self, request_id):
         """Получает статус отправки SMS"""
@@ -101,8 +190,8 @@ class GreenSMSService:
             return "delivered"  # В debug режиме всегда доставлено
         
         try:
-            response = self.client.sms.status(request_id=request_id)
-            return response.status if response else "unknown"
+            response = self.client.sms_status(request_id)
+            return response.get('status', "unknown")
         except Exception as e:
             print(f"Ошибка получения статуса SMS: {e}")
             return "error"
@@ -113,8 +202,8 @@ class GreenSMSService:
             return 100.0  # В debug режиме возвращаем тестовый баланс
         
         try:
-            response = self.client.account.balance()
-            return response.balance if response else 0.0
+            response = self.client.balance()
+            return float(response.get('balance', 0.0))
         except Exception as e:
             print(f"Ошибка получения баланса: {e}")
             return 0.0
@@ -0,0 +1,42 @@
+"""
+Сигналы для инвалидации кэша аутентификации
+
+Кэш сбрасывается после фиксации транзакции (transaction.on_commit): сброс до
+фиксации позволил бы параллельному запросу снова закэшировать старую строку
+до истечения TTL. Вне транзакции сброс выполняется сразу.
+"""
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache_utils import LoginGuard, TokenCache
+from .models import AuthToken
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Сбрасывает закэшированного пользователя при изменении или удалении"""
+    # pk и phone берутся сейчас: после delete() pk экземпляра становится None
+    user_id, phone = instance.pk, instance.phone
+
+    def invalidate():
+        TokenCache.invalidate_user(user_id)
+        LoginGuard.invalidate_account(phone)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=AuthToken)
+def invalidate_deactivated_token(sender, instance, created, **kwargs):
+    """Сбрасывает кэш токена, если его деактивировали"""
+    if not created and not instance.is_active:
+        transaction.on_commit(partial(TokenCache.invalidate_tokens, [instance.token]))
+
+
+@receiver(post_delete, sender=AuthToken)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Сбрасывает кэш удаленного токена"""
+    transaction.on_commit(partial(TokenCache.invalidate_tokens, [instance.token]))
@@ -1,15 +1,25 @@
 """
 Telegram Gateway API сервис для отправки OTP кодов
 """
-import requests
 import json
 import hashlib
 import hmac
 import time
 from django.conf import settings
-from django.utils import timezone
-from datetime import timedelta
-from .models import SMSVerification
+from .cache_utils import TelegramSendAbilityCache
+from .circuit_breaker import get_circuit_breaker
+from .http_client import get_async_client, get_session, get_timeout
+from .otp_store import get_otp_store
+
+# Отказы checkSendAbility, которые относятся к самому номеру (PHONE_NUMBER_INVALID,
+# PHONE_NUMBER_NOT_AVAILABLE и т.п.). Остальные ошибки - токен, FLOOD_WAIT,
+# баланс - общие для всех номеров и временные, их не кэшируем
+PHONE_ERROR_PREFIX = 'PHONE_NUMBER_'
+
+
+def is_phone_error(response):
+    """Ответ {'ok': false} с ошибкой, относящейся к номеру"""
+    return str(response.get('error') or '').startswith(PHONE_ERROR_PREFIX)
 
 
 class TelegramGatewayService:
@@ -31,15 +41,64 @@ class TelegramGatewayService:
             return None
         
         url = f"{self.base_url}/{method}"
-        headers = {
+        
+        # Разомкнутый выключатель - сразу отказ, без ожидания таймаута
+        breaker = get_circuit_breaker('telegram')
+        if not breaker.allow():
+            return None
+        
+        started = time.perf_counter()
+        try:
+            response = get_session('telegram').post(url, json=params, headers=self._headers(), timeout=get_timeout())
+        except Exception as e:
+            breaker.record(False, time.perf_counter() - started)
+            print(f"Ошибка Telegram Gateway API: {e}")
+            return None
+        
+        breaker.record(response.status_code < 500, time.perf_counter() - started)
+        return self._parse_response(response)
+    
+    async def _amake_request(self, method, params=None):
+        """Асинхронный вариант _make_request (httpx, для ASGI)"""
+        if self.debug_mode:
+            print(f"DEBUG Telegram Gateway: {method} - {params}")
+            return self._mock_response(method, params)
+        
+        if not self.enabled or not self.token:
+            return None
+        
+        url = f"{self.base_url}/{method}"
+        
+        breaker = get_circuit_breaker('telegram')
+        if not await breaker.aallow():
+            return None
+        
+        started = time.perf_counter()
+        try:
+            response = await get_async_client('telegram').post(url, json=params, headers=self._headers())
+        except Exception as e:
+            await breaker.arecord(False, time.perf_counter() - started)
+            print(f"Ошибка Telegram Gateway API: {e}")
+            return None
+        
+        await breaker.arecord(response.status_code < 500, time.perf_counter() - started)
+        return self._parse_response(response)
+    
+    def _headers(self):
+        return {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json'
         }
-        
+    
+    @staticmethod
+    def _parse_response(response):
+        """JSON ответа requests/httpx или None при временном сбое"""
+        # 4xx - окончательный ответ API ({'ok': false, 'error': ...}), 5xx - временный сбой
+        if response.status_code >= 500:
+            return None
         try:
-            response = requests.post(url, json=params, headers=headers, timeout=10)
-            return response.json() if response.status_code == 200 else None
-        except Exception as e:
+            return response.json()
+        except ValueError as e:
             print(f"Ошибка Telegram Gateway API: {e}")
             return None
     
@@ -88,7 +147,18 @@ class TelegramGatewayService:
         return None
     
     def check_send_ability(self, phone_number):
-        """Проверяет возможность отправки OTP в Telegram"""
+        """
+        Проверяет возможность отправки OTP в Telegram
+        
+        Результат кэшируется по номеру (TelegramSendAbilityCache): доступность -
+        на TELEGRAM_SEND_ABILITY_TTL, недоступность номера (ошибки PHONE_NUMBER_*)
+        - на TELEGRAM_SEND_ABILITY_NEGATIVE_TTL. Сетевые ошибки, 5xx и ошибки,
+        общие для всех номеров (токен, FLOOD_WAIT, баланс), не кэшируются.
+        """
+        cached = TelegramSendAbilityCache.get(phone_number)
+        if cached is not None:
+            return cached or None
+        
         params = {
             'phone_number': phone_number
         }
@@ -96,28 +166,61 @@ class TelegramGatewayService:
         response = self._make_request('checkSendAbility', params)
         
         if response and response.get('ok'):
+            TelegramSendAbilityCache.set_available(phone_number, response['result'])
             return response['result']
+        
+        if response is not None and is_phone_error(response):
+            TelegramSendAbilityCache.set_unavailable(phone_number)
         return None
     
-    def send_verification_message(self, phone_number, code=None, code_length=6, request_id=None):
-        """Отправляет OTP код через Telegram"""
+    async def acheck_send_ability(self, phone_number):
+        """Асинхронный вариант check_send_ability"""
+        cached = await TelegramSendAbilityCache.aget(phone_number)
+        if cached is not None:
+            return cached or None
+        
+        response = await self._amake_request('checkSendAbility', {'phone_number': phone_number})
+        
+        if response and response.get('ok'):
+            await TelegramSendAbilityCache.aset_available(phone_number, response['result'])
+            return response['result']
+        
+        if response is not None and is_phone_error(response):
+            await TelegramSendAbilityCache.aset_unavailable(phone_number)
+        return None
+    
+    def _send_params(self, phone_number, code=None, code_length=6, request_id=None):
+        """Параметры sendVerificationMessage"""
         params = {
             'phone_number': phone_number,
             'code_length': code_length,
-            'ttl': 300  # 5 минут
+            'ttl': settings.OTP_CODE_TTL
         }
         
         if code:
             params['code'] = code
         if request_id:
             params['request_id'] = request_id
-        
+        return params
+    
+    def send_verification_message(self, phone_number, code=None, code_length=6, request_id=None):
+        """Отправляет OTP код через Telegram"""
+        params = self._send_params(phone_number, code, code_length, request_id)
         response = self._make_request('sendVerificationMessage', params)
         
         if response and response.get('ok'):
             return response['result']
         return None
     
+    async def asend_verification_message(self, phone_number, code=None, code_length=6, request_id=None):
+        """Асинхронный вариант send_verification_message"""
+        params = self._send_params(phone_number, code, code_length, request_id)
+        response = await self._amake_request('sendVerificationMessage', params)
+        
+        if response and response.get('ok'):
+            return response['result']
+        return None
+    
     def check_verification_status(self, request_id, code=None):
         """Проверяет статус верификации и валидность кода"""
         params = {
@@ -145,74 +248,83 @@ class TelegramGatewayService:
             return response['result']
         return None
     
-    def send_otp_code(self, phone_number):
-        """Отправляет OTP код через Telegram (основной метод)"""
+    def deliver_code(self, phone_number, code):
+        """
+        Отправляет уже сгенерированный код через Telegram
+        
+        Returns:
+            (успех, request_id)
+        """
         # Сначала проверяем возможность отправки
         ability_check = self.check_send_ability(phone_number)
         
         if not ability_check:
-            return None
+            return False, None
         
-        # Генерируем код
-        code = self._generate_code()
-        
-        # Отправляем OTP
+        # Отправляем OTP; request_id из checkSendAbility делает отправку бесплатной
+        # и используется один раз
+        request_id = ability_check.get('request_id')
         result = self.send_verification_message(
             phone_number=phone_number,
             code=code,
-            request_id=ability_check.get('request_id')
+            request_id=request_id
+        )
+        
+        if request_id:
+            TelegramSendAbilityCache.consume_request_id(phone_number)
+        
+        if not result:
+            return False, None
+        
+        return True, result.get('request_id')
+    
+    async def adeliver_code(self, phone_number, code):
+        """Асинхронный вариант deliver_code"""
+        ability_check = await self.acheck_send_ability(phone_number)
+        
+        if not ability_check:
+            return False, None
+        
+        request_id = ability_check.get('request_id')
+        result = await self.asend_verification_message(
+            phone_number=phone_number,
+            code=code,
+            request_id=request_id
         )
         
-        if result:
-            # Сохраняем в базу данных
-            expires_at = timezone.now() + timedelta(minutes=5)
-            
-            # Деактивируем предыдущие коды
-            SMSVerification.objects.filter(phone=phone_number, is_used=False).update(is_used=True)
-            
-            # Создаем новую запись
-            sms_verification = SMSVerification.objects.create(
-                phone=phone_number,
-                code=code,
-                request_id=result.get('request_id'),
-                expires_at=expires_at
-            )
-            
-            return sms_verification
+        if request_id:
+            await TelegramSendAbilityCache.aconsume_request_id(phone_number)
+        
+        if not result:
+            return False, None
+        
+        return True, result.get('request_id')
+    
+    def send_otp_code(self, phone_number):
+        """Отправляет OTP код через Telegram (основной метод)"""
+        code = self._generate_code()
+        
+        success, request_id = self.deliver_code(phone_number, code)
+        
+        if success:
+            # Сохраняем код (в БД или Redis, см. OTP_STORAGE)
+            return get_otp_store().issue(phone_number, code, request_id=request_id)
         
         return None
     
     def verify_otp_code(self, phone_number, code):
-        """Проверяет OTP код через Telegram"""
-        try:
-            sms_verification = SMSVerification.objects.get(
-                phone=phone_number,
-                code=code,
-                is_used=False
-            )
-            
-            if not sms_verification.is_valid():
-                return False
-            
-            # Проверяем через Telegram API
-            if sms_verification.request_id:
-                status = self.check_verification_status(
-                    sms_verification.request_id, 
-                    code
-                )
-                
-                if status and status.get('verification_status', {}).get('status') == 'code_valid':
-                    sms_verification.is_used = True
-                    sms_verification.save()
-                    return True
-            
-            return False
-            
-        except SMSVerification.DoesNotExist:
-            return False
+        """
+        Проверяет OTP код, отправленный через Telegram
+        
+        Код генерируется на нашей стороне и передается в sendVerificationMessage,
+        поэтому для проверки достаточно атомарного использования сохраненного кода.
+        """
+        return get_otp_store().consume(phone_number, code)
     
     def _generate_code(self):
         """Генерирует 6-значный код"""
+        if settings.OTP_FIXED_CODE:
+            return settings.OTP_FIXED_CODE
         import random
         return str(random.randint(100000, 999999))
     
@@ -232,3 +344,10 @@ class TelegramGatewayService:
         
         ability = self.check_send_ability(phone_number)
         return ability is not None
+    
+    async def ais_telegram_available(self, phone_number):
+        """Асинхронный вариант is_telegram_available"""
+        if not self.enabled:
+            return False
+        
+        return await self.acheck_send_ability(phone_number) is not None
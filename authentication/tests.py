@@ -1,3 +1,246 @@
-from django.test import TestCase
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import skipUnless
+from django.core.cache import cache
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
-# Create your tests here.
+from .cache_utils import RateLimiter
+from .models import SMSVerification
+from .otp_store import AUDIT_QUEUE_KEY, DatabaseOTPStore, RedisOTPStore
+from .throttling import LoginThrottle
+
+
+def redis_available():
+    """Тесты лимитов и кэша работают с настоящим Redis из REDIS_URL"""
+    try:
+        return get_redis_connection('default').ping()
+    except Exception:
+        return False
+
+
+requires_redis = skipUnless(redis_available(), 'Redis недоступен')
+
+
+def unique_id(prefix):
+    """Уникальный идентификатор, чтобы тесты не делили ключи Redis между запусками"""
+    return f"test_{prefix}_{uuid.uuid4().hex}"
+
+
+@requires_redis
+class RateLimiterTests(SimpleTestCase):
+    """GCRA: разрешение, отказ и восстановление квоты"""
+
+    def test_allows_up_to_limit_then_denies(self):
+        identifier = unique_id('gcra')
+
+        remaining = [RateLimiter.hit(identifier, limit=3, window=60).remaining for _ in range(3)]
+        self.assertEqual(remaining, [2, 1, 0])
+
+        denied = RateLimiter.hit(identifier, limit=3, window=60)
+        self.assertFalse(denied.allowed)
+        self.assertEqual(denied.remaining, 0)
+        # Квота восстанавливается равномерно: один запрос раз в window / limit секунд
+        self.assertGreater(denied.retry_after, 0)
+        self.assertLessEqual(denied.retry_after, 20)
+
+    def test_quota_recovers_after_retry_after(self):
+        identifier = unique_id('gcra')
+
+        for _ in range(2):
+            self.assertTrue(RateLimiter.hit(identifier, limit=2, window=1).allowed)
+        denied = RateLimiter.hit(identifier, limit=2, window=1)
+        self.assertFalse(denied.allowed)
+        self.assertAlmostEqual(denied.reset_at, time.time() + 1, delta=0.5)
+
+        time.sleep(denied.retry_after + 0.05)
+        self.assertTrue(RateLimiter.hit(identifier, limit=2, window=1).allowed)
+
+    def test_zero_cost_does_not_consume(self):
+        identifier = unique_id('gcra')
+
+        RateLimiter.hit(identifier, limit=5, window=60)
+        self.assertEqual(RateLimiter.get_remaining_requests(identifier, limit=5, window=60), 4)
+        self.assertEqual(RateLimiter.get_remaining_requests(identifier, limit=5, window=60), 4)
+
+    def test_denied_by_one_limit_spends_no_quota(self):
+        tight = unique_id('gcra')
+        loose = unique_id('gcra')
+
+        RateLimiter.hit(tight, limit=1, window=60)
+        results = RateLimiter.hit_many([(tight, 1, 60), (loose, 5, 60)])
+
+        self.assertEqual([result.allowed for result in results], [False, True])
+        self.assertEqual(RateLimiter.get_remaining_requests(loose, limit=5, window=60), 5)
+
+
+class DatabaseOTPConsumeTests(TestCase):
+    """Однократное использование кода условным UPDATE"""
+
+    phone = '+79990000001'
+
+    def setUp(self):
+        self.store = DatabaseOTPStore()
+
+    def test_code_is_single_use(self):
+        self.store.issue(self.phone, '123456')
+
+        self.assertFalse(self.store.consume(self.phone, '654321'))
+        self.assertTrue(self.store.consume(self.phone, '123456'))
+        self.assertFalse(self.store.consume(self.phone, '123456'))
+
+    def test_expired_code_is_rejected(self):
+        verification = self.store.issue(self.phone, '123456')
+        SMSVerification.objects.filter(pk=verification.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertFalse(self.store.consume(self.phone, '123456'))
+
+    def test_new_code_replaces_previous(self):
+        self.store.issue(self.phone, '111111')
+        self.store.issue(self.phone, '222222')
+
+        self.assertFalse(self.store.consume(self.phone, '111111'))
+        self.assertTrue(self.store.consume(self.phone, '222222'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Параллельные транзакции проверяются на PostgreSQL')
+class DatabaseOTPConsumeRaceTests(TransactionTestCase):
+    """Из параллельных проверок одного кода успешна ровно одна"""
+
+    def test_parallel_consume(self):
+        phone = '+79990000002'
+        DatabaseOTPStore().issue(phone, '123456')
+        barrier = threading.Barrier(8)
+        results = []
+
+        def consume():
+            try:
+                barrier.wait()
+                results.append(DatabaseOTPStore().consume(phone, '123456'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=consume) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [False] * 7 + [True])
+
+
+@requires_redis
+@override_settings(OTP_MAX_VERIFY_ATTEMPTS=3)
+class RedisOTPConsumeTests(SimpleTestCase):
+    """Однократное использование кода Lua скриптом"""
+
+    def setUp(self):
+        self.store = RedisOTPStore()
+        self.phone = f"+7999{uuid.uuid4().int % 10 ** 7:07d}"
+
+    def tearDown(self):
+        # События аудита теста не должны попасть в SMSVerification через flush_otp_audit
+        client = get_redis_connection('default')
+        queue = cache.make_key(AUDIT_QUEUE_KEY)
+        for event in client.lrange(queue, 0, -1):
+            if self.phone in event.decode():
+                client.lrem(queue, 0, event)
+
+    def test_code_is_single_use(self):
+        self.store.issue(self.phone, '123456')
+
+        self.assertTrue(self.store.consume(self.phone, '123456'))
+        self.assertFalse(self.store.consume(self.phone, '123456'))
+
+    def test_parallel_consume(self):
+        self.store.issue(self.phone, '123456')
+        barrier = threading.Barrier(8)
+        results = []
+
+        def consume():
+            barrier.wait()
+            results.append(self.store.consume(self.phone, '123456'))
+
+        threads = [threading.Thread(target=consume) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [False] * 7 + [True])
+
+    def test_code_is_dropped_after_max_attempts(self):
+        self.store.issue(self.phone, '123456')
+
+        for _ in range(3):
+            self.assertFalse(self.store.consume(self.phone, '000000'))
+        self.assertFalse(self.store.consume(self.phone, '123456'))
+
+
+def throttle_rates(**rates):
+    """REST_FRAMEWORK с заданными лимитами вместо лимитов из настроек"""
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+@requires_redis
+@override_settings(REST_FRAMEWORK=throttle_rates(**{'login:ip': '3/minute', 'login:phone': '2/hour'}))
+class MultiKeyRateThrottleTests(TestCase):
+    """Лимиты по IP и телефону одной областью"""
+
+    url = '/api/auth/login/'
+
+    def setUp(self):
+        self.ip = f"10.{uuid.uuid4().int % 250}.{uuid.uuid4().int % 250}.{uuid.uuid4().int % 250}"
+
+    def login(self, phone):
+        return self.client.post(
+            self.url, {'phone': phone, 'password': 'wrong-password'},
+            content_type='application/json', REMOTE_ADDR=self.ip
+        )
+
+    def new_phone(self):
+        return f"+7999{uuid.uuid4().int % 10 ** 7:07d}"
+
+    def test_tightest_limit_in_headers(self):
+        response = self.login(self.new_phone())
+
+        self.assertNotEqual(response.status_code, 429)
+        self.assertEqual(response['X-RateLimit-Limit'], '2')
+        self.assertEqual(response['X-RateLimit-Remaining'], '1')
+        self.assertIn('X-RateLimit-Reset', response)
+
+    def test_phone_limit_denies_with_retry_after(self):
+        phone = self.new_phone()
+        for _ in range(2):
+            self.assertNotEqual(self.login(phone).status_code, 429)
+
+        response = self.login(phone)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_denied_request_spends_no_ip_quota(self):
+        phone = self.new_phone()
+        for _ in range(2):
+            self.login(phone)
+        self.assertEqual(self.login(phone).status_code, 429)
+
+        # Третий запрос с IP отклонен лимитом телефона и квоту IP не расходовал
+        self.assertNotEqual(self.login(self.new_phone()).status_code, 429)
+        self.assertEqual(self.login(self.new_phone()).status_code, 429)
+
+    def test_limit_without_identity_is_skipped(self):
+        request = Request(
+            APIRequestFactory().post(self.url, {}, format='json', REMOTE_ADDR=self.ip),
+            parsers=[JSONParser()]
+        )
+
+        self.assertEqual(LoginThrottle().get_checks(request), [(f"throttle_login_ip_{self.ip}", 3, 60)])
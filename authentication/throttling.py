@@ -0,0 +1,126 @@
+"""
+Троттлинг DRF на основе RateLimiter
+
+Каждый класс задает область (scope) и набор идентичностей, по которым считаются
+лимиты: IP, телефон из тела запроса, пользователь, код страны телефона. Лимиты
+задаются в REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] ключами вида
+'<scope>:<identity>', например 'login:phone': '10/hour'. Все лимиты запроса
+проверяются одним Lua скриптом; отказ возвращается до любой работы с БД
+и хэширования паролей.
+"""
+from django.core.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .cache_utils import RateLimiter
+from .validators import get_country_code, normalize_phone_number
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'10/hour' -> (10, 3600)"""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def get_client_ip(request):
+    """IP клиента с учетом REST_FRAMEWORK["NUM_PROXIES"], как в троттлинге DRF"""
+    return BaseThrottle().get_ident(request)
+
+
+class MultiKeyRateThrottle(BaseThrottle):
+    """Базовый класс: лимиты по нескольким идентичностям одной областью"""
+
+    scope = None
+    identities = ('ip',)
+
+    def get_phone(self, request):
+        """Нормализованный номер из тела или строки запроса или None"""
+        try:
+            phone = request.data.get('phone') or request.query_params.get('phone')
+        except AttributeError:
+            return None
+
+        if not phone:
+            return None
+
+        try:
+            return normalize_phone_number(str(phone))
+        except ValidationError:
+            return None
+
+    def get_identity_values(self, request):
+        """Значения идентичностей запроса; None - лимит не применяется"""
+        phone = self.get_phone(request) if {'phone', 'country'} & set(self.identities) else None
+        user = getattr(request, 'user', None)
+
+        values = {
+            'ip': self.get_ident(request),
+            'phone': phone,
+            'user': user.pk if user is not None and user.is_authenticated else None,
+            'country': (get_country_code(phone) or phone[1:4]) if phone else None,
+        }
+        return {identity: values[identity] for identity in self.identities}
+
+    def get_checks(self, request):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        checks = []
+
+        for identity, value in self.get_identity_values(request).items():
+            rate = rates.get(f"{self.scope}:{identity}")
+            if rate is None or value is None:
+                continue
+            limit, window = parse_rate(rate)
+            checks.append((f"throttle_{self.scope}_{identity}_{value}", limit, window))
+
+        return checks
+
+    def allow_request(self, request, view):
+        checks = self.get_checks(request)
+        if not checks:
+            return True
+
+        results = RateLimiter.hit_many(checks)
+        self.denied = [result for result in results if not result.allowed]
+
+        # Самый строгий лимит - для заголовков X-RateLimit-* (RateLimitHeadersMiddleware)
+        tightest = min(results, key=lambda result: (result.allowed, result.remaining))
+        current = getattr(request._request, 'rate_limit', None)
+        if current is None or (tightest.allowed, tightest.remaining) < (current.allowed, current.remaining):
+            request._request.rate_limit = tightest
+
+        return not self.denied
+
+    def wait(self):
+        return max(result.retry_after for result in self.denied)
+
+
+class OTPSendThrottle(MultiKeyRateThrottle):
+    """Отправка кодов: защита от перебора номеров и SMS-накрутки по странам"""
+    scope = 'otp_send'
+    identities = ('ip', 'phone', 'country')
+
+
+class OTPVerifyThrottle(MultiKeyRateThrottle):
+    """Проверка кодов: защита от перебора кода"""
+    scope = 'otp_verify'
+    identities = ('ip', 'phone')
+
+
+class LoginThrottle(MultiKeyRateThrottle):
+    """Вход: защита от перебора паролей"""
+    scope = 'login'
+    identities = ('ip', 'phone')
+
+
+class AnonAuthThrottle(MultiKeyRateThrottle):
+    """Прочие анонимные эндпоинты аутентификации"""
+    scope = 'auth'
+    identities = ('ip',)
+
+
+class AdminThrottle(MultiKeyRateThrottle):
+    """Административные эндпоинты"""
+    scope = 'admin'
+    identities = ('ip', 'user')
@@ -0,0 +1,219 @@
+"""
+Выпуск токенов аутентификации
+
+Подписанный access токен проверяется внутри процесса: HMAC-SHA256 по id пользователя,
+роли, времени истечения и эпохе токенов пользователя. Отзыв выполняется
+увеличением эпохи (TokenEpoch), поэтому денилист отдельных токенов не нужен.
+
+Refresh токен сессии AuthToken - '<AuthToken.refresh_token>.<поколение>.<подпись>'.
+Каждая ротация увеличивает поколение, поэтому любой ранее выданный refresh токен
+сессии распознается без хранения использованных токенов.
+"""
+import base64
+import json
+import time
+import uuid
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .cache_utils import TokenEpoch
+from .models import AuthToken
+
+
+class SignedAccessToken:
+    """Выпуск и проверка подписанных access токенов"""
+
+    salt = 'authentication.tokens.SignedAccessToken'
+
+    @staticmethod
+    def _b64encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+    @staticmethod
+    def _b64decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+    @classmethod
+    def _sign(cls, payload: str) -> str:
+        digest = salted_hmac(cls.salt, payload, algorithm='sha256').digest()
+        return cls._b64encode(digest)
+
+    @classmethod
+    def issue(cls, user) -> str:
+        """Выпускает access токен для пользователя"""
+        payload = {
+            'uid': user.pk,
+            'role': user.role,
+            'exp': int(time.time()) + settings.SIGNED_ACCESS_TOKEN_LIFETIME,
+            'ep': TokenEpoch.get_epoch(user.pk),
+        }
+        encoded = cls._b64encode(json.dumps(payload, separators=(',', ':')).encode())
+        return f"{encoded}.{cls._sign(encoded)}"
+
+    @classmethod
+    def verify(cls, token: str) -> Optional[Dict]:
+        """
+        Проверяет подпись, срок действия и эпоху токена
+
+        Returns:
+            Полезная нагрузка токена или None, если токен недействителен
+        """
+        try:
+            encoded, signature = token.split('.')
+        except ValueError:
+            return None
+
+        if not constant_time_compare(signature, cls._sign(encoded)):
+            return None
+
+        try:
+            payload = json.loads(cls._b64decode(encoded))
+        except ValueError:
+            return None
+
+        if payload['exp'] <= time.time():
+            return None
+
+        if payload['ep'] != TokenEpoch.get_epoch(payload['uid']):
+            return None
+
+        return payload
+
+    @staticmethod
+    def is_signed_token(token: str) -> bool:
+        """Отличает подписанный токен от UUID токена AuthToken"""
+        return '.' in token
+
+
+def issue_auth_token(user) -> AuthToken:
+    """
+    Создает долгоживущий токен AuthToken с текущей эпохой пользователя
+
+    Заодно удаляет отозванные и просроченные токены пользователя и вытесняет
+    самые старые активные сверх AUTH_TOKEN_MAX_ACTIVE_PER_USER, чтобы таблица
+    росла пропорционально числу устройств, а не числу входов.
+    """
+    epoch = TokenEpoch.get_epoch(user.pk)
+    now = timezone.now()
+
+    AuthToken.objects.filter(user=user).filter(
+        Q(is_active=False) | Q(expires_at__lte=now) | ~Q(epoch=epoch)
+    ).delete()
+
+    auth_token = AuthToken.objects.create(
+        user=user,
+        epoch=epoch,
+        expires_at=now + timedelta(days=settings.AUTH_TOKEN_LIFETIME_DAYS)
+    )
+
+    evicted = list(
+        AuthToken.objects.filter(user=user)
+        .order_by('-created_at', '-id')
+        .values_list('id', flat=True)[settings.AUTH_TOKEN_MAX_ACTIVE_PER_USER:]
+    )
+    if evicted:
+        # Кэш вытесненных токенов сбрасывается сигналом post_delete
+        AuthToken.objects.filter(id__in=evicted).delete()
+
+    return auth_token
+
+
+class RefreshToken:
+    """Выпуск и разбор refresh токенов сессии"""
+
+    salt = 'authentication.tokens.RefreshToken'
+
+    @classmethod
+    def _sign(cls, payload: str) -> str:
+        digest = salted_hmac(cls.salt, payload, algorithm='sha256').digest()
+        return SignedAccessToken._b64encode(digest)
+
+    @classmethod
+    def issue(cls, auth_token) -> str:
+        """Refresh токен текущего поколения сессии"""
+        payload = f"{auth_token.refresh_token.hex}.{auth_token.refresh_generation}"
+        return f"{payload}.{cls._sign(payload)}"
+
+    @classmethod
+    def parse(cls, token: str) -> Optional[Tuple[uuid.UUID, int]]:
+        """(AuthToken.refresh_token, поколение) или None, если токен поддельный"""
+        try:
+            family, generation, signature = token.split('.')
+        except ValueError:
+            return None
+
+        if not constant_time_compare(signature, cls._sign(f"{family}.{generation}")):
+            return None
+
+        try:
+            return uuid.UUID(family), int(generation)
+        except ValueError:
+            return None
+
+
+def rotate_refresh_token(refresh_token: str) -> Optional[AuthToken]:
+    """
+    Обменивает refresh токен на новый (ротация)
+
+    Предъявление любого уже использованного refresh токена сессии означает его
+    утечку, поэтому вся сессия (AuthToken) удаляется. Ротация не продлевает
+    сессию: AuthToken и его refresh токены действуют AUTH_TOKEN_LIFETIME_DAYS
+    с момента входа.
+
+    Returns:
+        AuthToken с новым поколением refresh токена или None, если токен недействителен
+    """
+    parsed = RefreshToken.parse(refresh_token)
+    if parsed is None:
+        return None
+    family, generation = parsed
+
+    try:
+        auth_token = AuthToken.objects.select_related('user').get(refresh_token=family)
+    except AuthToken.DoesNotExist:
+        return None
+
+    if generation < auth_token.refresh_generation:
+        # Кэш токена сбрасывается сигналом post_delete
+        auth_token.delete()
+        return None
+
+    user = auth_token.user
+    if (generation != auth_token.refresh_generation or not auth_token.is_valid()
+            or not user.is_active or auth_token.epoch != TokenEpoch.get_epoch(user.pk)):
+        return None
+
+    # Условный UPDATE: из двух параллельных ротаций одного токена проходит одна
+    rotated = AuthToken.objects.filter(pk=auth_token.pk, refresh_generation=generation).update(
+        refresh_generation=F('refresh_generation') + 1
+    )
+    if not rotated:
+        return None
+
+    auth_token.refresh_generation = generation + 1
+    return auth_token
+
+
+def get_token_response_data(user, auth_token) -> Dict:
+    """Формирует токены для ответа login/register/set-password"""
+    data = {
+        'token': str(auth_token.token)
+    }
+
+    if settings.SIGNED_ACCESS_TOKENS_ENABLED:
+        data.update(get_access_token_pair(user, auth_token))
+
+    return data
+
+
+def get_access_token_pair(user, auth_token) -> Dict:
+    """Формирует пару access/refresh токенов"""
+    return {
+        'access_token': SignedAccessToken.issue(user),
+        'access_token_expires_in': settings.SIGNED_ACCESS_TOKEN_LIFETIME,
+        'refresh_token': RefreshToken.issue(auth_token)
+    }
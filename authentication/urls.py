@@ -1,14 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Под ASGI (OTP_ASYNC_VIEWS=True) OTP эндпоинты обслуживают нативные async views
+otp_views = async_views if settings.OTP_ASYNC_VIEWS else views
 
 urlpatterns = [
     # Основные OTP endpoints
-    path('send-code/', views.send_verification_code, name='send_verification_code'),
-    path('verify-code/', views.verify_code, name='verify_code'),
+    path('send-code/', otp_views.send_verification_code, name='send_verification_code'),
+    path('send-code/<str:dispatch_id>/status/', views.send_code_status, name='send_code_status'),
+    path('verify-code/', otp_views.verify_code, name='verify_code'),
     
     # Telegram и SMS fallback
-    path('send-sms-fallback/', views.send_sms_fallback, name='send_sms_fallback'),
-    path('check-telegram/', views.check_telegram_availability, name='check_telegram_availability'),
+    path('send-sms-fallback/', otp_views.send_sms_fallback, name='send_sms_fallback'),
+    path('check-telegram/', otp_views.check_telegram_availability, name='check_telegram_availability'),
     path('balance-info/', views.get_balance_info, name='get_balance_info'),
     
     # Многоэтапная регистрация
@@ -23,6 +28,7 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
+    path('token/refresh/', views.refresh_token, name='refresh_token'),
     
     # Профиль пользователя
     path('profile/', views.profile, name='profile'),
@@ -1,15 +1,14 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from django.contrib.auth import authenticate, login
-from django.utils import timezone
-from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import authenticate, login, get_user_model
+import math
 import uuid
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-from .models import AuthToken
 from .serializers import (
     PhoneVerificationSerializer, 
     CodeVerificationSerializer,
@@ -19,12 +18,26 @@ from .serializers import (
     TokenSerializer,
     CompleteRegistrationSerializer,
     SetPasswordSerializer,
-    ResetPasswordSerializer
+    ResetPasswordSerializer,
+    RefreshTokenSerializer
 )
 from .services import GreenSMSService
 from .decorators import require_roles
-from .cache_utils import CacheManager, RateLimiter, SMSVerificationCache
-from .otp_service import UniversalOTPService
+from .throttling import (
+    get_client_ip,
+    OTPSendThrottle,
+    OTPVerifyThrottle,
+    LoginThrottle,
+    AnonAuthThrottle,
+    AdminThrottle
+)
+from .cache_utils import CacheManager, LoginGuard, RateLimiter, TokenEpoch
+from .otp_service import get_otp_service
+from .dispatch import OTPDispatchQueue, STATUS_QUEUED
+from .tokens import issue_auth_token, rotate_refresh_token, get_token_response_data, get_access_token_pair
+from users.models import UserCounter
+
+User = get_user_model()
 
 
 @swagger_auto_schema(
@@ -42,6 +55,18 @@ from .otp_service import UniversalOTPService
                 }
             }
         ),
+        202: openapi.Response(
+            description='Отправка поставлена в очередь (OTP_DISPATCH_MODE=queue)',
+            examples={
+                'application/json': {
+                    'message': 'Код поставлен в очередь на отправку',
+                    'phone': '+1234567890',
+                    'dispatch_id': '3f2a9c1e5b7d4e8f9a0b1c2d3e4f5a6b',
+                    'status': 'queued',
+                    'is_reset': False
+                }
+            }
+        ),
         400: openapi.Response(
             description='Ошибка валидации данных',
             examples={
@@ -62,6 +87,7 @@ from .otp_service import UniversalOTPService
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPSendThrottle])
 def send_verification_code(request):
     """Отправка кода подтверждения через Telegram или SMS"""
     serializer = PhoneVerificationSerializer(data=request.data)
@@ -85,14 +111,26 @@ def send_verification_code(request):
             }, status=status.HTTP_404_NOT_FOUND)
         
         # Используем универсальный OTP сервис
-        otp_service = UniversalOTPService()
+        otp_service = get_otp_service()
+        
+        if settings.OTP_DISPATCH_MODE == 'queue':
+            result = otp_service.enqueue_verification_code(phone, prefer_telegram=prefer_telegram)
+            if not result['success']:
+                return Response({
+                    'error': result['message']
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            
+            return Response({
+                'message': result['message'],
+                'phone': phone,
+                'dispatch_id': result['dispatch_id'],
+                'status': STATUS_QUEUED,
+                'is_reset': is_reset
+            }, status=status.HTTP_202_ACCEPTED)
+        
         result = otp_service.send_verification_code(phone, prefer_telegram=prefer_telegram)
         
         if result['success']:
-            # Сохраняем код в Redis
-            if result['sms_verification']:
-                SMSVerificationCache.store_verification_code(phone, result['sms_verification'].code)
-            
             return Response({
                 'message': result['message'],
                 'phone': phone,
@@ -109,6 +147,52 @@ def send_verification_code(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@swagger_auto_schema(
+    method='get',
+    operation_summary='Статус отправки кода',
+    operation_description='Возвращает статус отправки, поставленной в очередь (OTP_DISPATCH_MODE=queue)',
+    responses={
+        200: openapi.Response(
+            description='Статус отправки',
+            examples={
+                'application/json': {
+                    'dispatch_id': '3f2a9c1e5b7d4e8f9a0b1c2d3e4f5a6b',
+                    'status': 'sent',
+                    'method': 'telegram',
+                    'attempts': 1
+                }
+            }
+        ),
+        404: openapi.Response(
+            description='Отправка не найдена',
+            examples={
+                'application/json': {
+                    'error': 'Отправка не найдена'
+                }
+            }
+        )
+    }
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
+def send_code_status(request, dispatch_id):
+    """Статус асинхронной отправки кода"""
+    dispatch_status = OTPDispatchQueue.get_status(dispatch_id)
+    
+    if dispatch_status is None:
+        return Response({
+            'error': 'Отправка не найдена'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'dispatch_id': dispatch_id,
+        'status': dispatch_status['status'],
+        'method': dispatch_status['method'] or None,
+        'attempts': dispatch_status['attempts']
+    }, status=status.HTTP_200_OK)
+
+
 @swagger_auto_schema(
     method='post',
     operation_summary='Проверка SMS кода подтверждения',
@@ -137,6 +221,7 @@ def send_verification_code(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPVerifyThrottle])
 def verify_code(request):
     """Проверка кода подтверждения"""
     serializer = CodeVerificationSerializer(data=request.data)
@@ -146,13 +231,10 @@ def verify_code(request):
         code = serializer.validated_data['code']
         
         # Используем универсальный OTP сервис
-        otp_service = UniversalOTPService()
+        otp_service = get_otp_service()
         is_valid = otp_service.verify_code(phone, code)
         
         if is_valid:
-            # Удаляем код из Redis
-            SMSVerificationCache.delete_verification_code(phone)
-            
             return Response({
                 'message': 'Код подтвержден успешно',
                 'phone': phone,
@@ -201,6 +283,7 @@ def verify_code(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPSendThrottle])
 def send_sms_fallback(request):
     """Отправка SMS кода как резервный вариант"""
     serializer = PhoneVerificationSerializer(data=request.data)
@@ -209,7 +292,7 @@ def send_sms_fallback(request):
         phone = serializer.validated_data['phone']
         
         # Используем универсальный OTP сервис для SMS fallback
-        otp_service = UniversalOTPService()
+        otp_service = get_otp_service()
         result = otp_service.send_sms_fallback(phone)
         
         if result['success']:
@@ -260,6 +343,7 @@ def send_sms_fallback(request):
 )
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
 def check_telegram_availability(request):
     """Проверка доступности Telegram для номера"""
     phone = request.GET.get('phone')
@@ -272,7 +356,7 @@ def check_telegram_availability(request):
     # Валидация номера телефона уже выполняется в сериализаторе
     
     # Используем универсальный OTP сервис
-    otp_service = UniversalOTPService()
+    otp_service = get_otp_service()
     telegram_available = otp_service.check_telegram_availability(phone)
     
     return Response({
@@ -299,9 +383,10 @@ def check_telegram_availability(request):
 )
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
 def get_balance_info(request):
     """Получение информации о балансах"""
-    otp_service = UniversalOTPService()
+    otp_service = get_otp_service()
     balance_info = otp_service.get_balance_info()
     
     return Response(balance_info, status=status.HTTP_200_OK)
@@ -347,6 +432,7 @@ def get_balance_info(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
 def register(request):
     """Регистрация нового пользователя"""
     serializer = UserRegistrationSerializer(data=request.data)
@@ -364,16 +450,12 @@ def register(request):
         user.save()
         
         # Создаем токен аутентификации
-        expires_at = timezone.now() + timedelta(days=30)
-        auth_token = AuthToken.objects.create(
-            user=user,
-            expires_at=expires_at
-        )
+        auth_token = issue_auth_token(user)
         
         return Response({
             'message': 'Пользователь успешно зарегистрирован',
             'user': UserSerializer(user).data,
-            'token': str(auth_token.token)
+            **get_token_response_data(user, auth_token)
         }, status=status.HTTP_201_CREATED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -413,11 +495,21 @@ def register(request):
                     'error': 'Неверные учетные данные'
                 }
             }
+        ),
+        429: openapi.Response(
+            description='Слишком много неудачных попыток',
+            examples={
+                'application/json': {
+                    'error': 'Слишком много неудачных попыток входа. Попробуйте позже',
+                    'retry_after': 4
+                }
+            }
         )
     }
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([LoginThrottle])
 def login_view(request):
     """Вход пользователя"""
     serializer = UserLoginSerializer(data=request.data)
@@ -425,29 +517,44 @@ def login_view(request):
     if serializer.is_valid():
         phone = serializer.validated_data['phone']
         password = serializer.validated_data['password']
+        ip = get_client_ip(request)
+        
+        # Отклоняем перебор до хэширования пароля
+        retry_after = LoginGuard.get_lockout(phone, ip)
+        if retry_after:
+            return Response({
+                'error': 'Слишком много неудачных попыток входа. Попробуйте позже',
+                'retry_after': math.ceil(retry_after)
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(math.ceil(retry_after))})
         
-        # Аутентификация пользователя
+        # Несуществующий, неактивный (в том числе посреди восстановления пароля)
+        # аккаунт и неверный пароль получают один и тот же ответ: отдельное
+        # сообщение для неактивных раскрыло бы, какие номера зарегистрированы.
+        # Так было и раньше: ModelBackend не аутентифицирует неактивных
+        # пользователей. Неудача учитывается, чтобы перебор номеров упирался
+        # в те же блокировки, что и перебор паролей
+        if LoginGuard.get_account_state(phone) != LoginGuard.ACCOUNT_ACTIVE:
+            LoginGuard.record_failure(phone, ip)
+            return Response({
+                'error': 'Неверные учетные данные'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Аутентификация пользователя (ModelBackend возвращает только активных)
         user = authenticate(request, username=phone, password=password)
         
         if user:
-            if user.is_active:
-                # Создаем новый токен
-                expires_at = timezone.now() + timedelta(days=30)
-                auth_token = AuthToken.objects.create(
-                    user=user,
-                    expires_at=expires_at
-                )
-                
-                return Response({
-                    'message': 'Вход выполнен успешно',
-                    'user': UserSerializer(user).data,
-                    'token': str(auth_token.token)
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({
-                    'error': 'Аккаунт деактивирован'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            LoginGuard.reset(phone)
+            
+            # Создаем токен аутентификации
+            auth_token = issue_auth_token(user)
+            
+            return Response({
+                'message': 'Вход выполнен успешно',
+                'user': UserSerializer(user).data,
+                **get_token_response_data(user, auth_token)
+            }, status=status.HTTP_200_OK)
         else:
+            LoginGuard.record_failure(phone, ip)
             return Response({
                 'error': 'Неверные учетные данные'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -458,7 +565,7 @@ def login_view(request):
 @swagger_auto_schema(
     method='post',
     operation_summary='Выход пользователя из системы',
-    operation_description='Деактивирует все токены аутентификации пользователя',
+    operation_description='Отзывает все токены аутентификации пользователя',
     responses={
         200: openapi.Response(
             description='Выход выполнен успешно',
@@ -482,14 +589,79 @@ def login_view(request):
 @permission_classes([IsAuthenticated])
 def logout_view(request):
     """Выход пользователя"""
-    # Деактивируем все токены пользователя
-    AuthToken.objects.filter(user=request.user, is_active=True).update(is_active=False)
+    # Отзываем все токены пользователя одним увеличением эпохи
+    TokenEpoch.bump_epoch(request.user.pk)
     
     return Response({
         'message': 'Выход выполнен успешно'
     }, status=status.HTTP_200_OK)
 
 
+@swagger_auto_schema(
+    method='post',
+    operation_summary='Обновление access токена',
+    operation_description='Выдает новый access токен по refresh токену без проверки пароля. '
+                          'Refresh токен одноразовый: в ответе возвращается новый. Ротация не продлевает '
+                          'сессию, а повторное использование любого прежнего refresh токена завершает ее. '
+                          'Доступно только при SIGNED_ACCESS_TOKENS_ENABLED',
+    request_body=RefreshTokenSerializer,
+    responses={
+        200: openapi.Response(
+            description='Токены обновлены',
+            examples={
+                'application/json': {
+                    'access_token': 'eyJ1aWQiOjEsInJvbGUiOiJ1c2VyIiwiZXhwIjoxNzM2MDY0MDAwLCJlcCI6MH0.signature',
+                    'access_token_expires_in': 900,
+                    'refresh_token': '87654321432143214321cba987654321.1.signature'
+                }
+            }
+        ),
+        401: openapi.Response(
+            description='Недействительный refresh токен',
+            examples={
+                'application/json': {
+                    'error': 'Недействительный или просроченный refresh токен'
+                }
+            }
+        ),
+        404: openapi.Response(
+            description='Подписанные access токены отключены',
+            examples={
+                'application/json': {
+                    'error': 'Обновление токенов отключено'
+                }
+            }
+        )
+    }
+)
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
+def refresh_token(request):
+    """Обновление access токена с ротацией refresh токена"""
+    if not settings.SIGNED_ACCESS_TOKENS_ENABLED:
+        return Response({
+            'error': 'Обновление токенов отключено'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = RefreshTokenSerializer(data=request.data)
+    
+    if serializer.is_valid():
+        auth_token = rotate_refresh_token(serializer.validated_data['refresh_token'])
+        
+        if auth_token is None:
+            return Response({
+                'error': 'Недействительный или просроченный refresh токен'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        return Response(
+            get_access_token_pair(auth_token.user, auth_token),
+            status=status.HTTP_200_OK
+        )
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 @swagger_auto_schema(
     method='get',
     operation_summary='Получение профиля пользователя',
@@ -669,6 +841,12 @@ def user_dashboard(request):
                         'role_display': 'Администратор',
                         'is_phone_verified': True,
                         'created_at': '2025-01-05T08:00:00Z'
+                    },
+                    'stats': {
+                        'total_users': 100,
+                        'verified_users': 95,
+                        'admin_users': 5,
+                        'role_stats': {'user': 95, 'admin': 4, 'superadmin': 1}
                     }
                 }
             }
@@ -693,11 +871,13 @@ def user_dashboard(request):
 )
 @api_view(['GET'])
 @require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
 def admin_panel(request):
     """Панель администратора"""
     return Response({
         'message': 'Добро пожаловать в панель администратора!',
-        'user': UserSerializer(request.user).data
+        'user': UserSerializer(request.user).data,
+        'stats': UserCounter.objects.get_stats()
     }, status=status.HTTP_200_OK)
 
 
@@ -722,6 +902,12 @@ def admin_panel(request):
                         'role_display': 'Супер администратор',
                         'is_phone_verified': True,
                         'created_at': '2025-01-05T08:00:00Z'
+                    },
+                    'stats': {
+                        'total_users': 100,
+                        'verified_users': 95,
+                        'admin_users': 5,
+                        'role_stats': {'user': 95, 'admin': 4, 'superadmin': 1}
                     }
                 }
             }
@@ -746,11 +932,13 @@ def admin_panel(request):
 )
 @api_view(['GET'])
 @require_roles('superadmin')
+@throttle_classes([AdminThrottle])
 def superadmin_panel(request):
     """Панель супер администратора"""
     return Response({
         'message': 'Добро пожаловать в панель супер администратора!',
-        'user': UserSerializer(request.user).data
+        'user': UserSerializer(request.user).data,
+        'stats': UserCounter.objects.get_stats()
     }, status=status.HTTP_200_OK)
 
 
@@ -792,6 +980,7 @@ def superadmin_panel(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPVerifyThrottle])
 def complete_registration(request):
     """Завершение регистрации пользователя (создание без пароля)"""
     serializer = CompleteRegistrationSerializer(data=request.data)
@@ -801,15 +990,12 @@ def complete_registration(request):
         code = serializer.validated_data['code']
         
         # Проверяем код
-        otp_service = UniversalOTPService()
+        otp_service = get_otp_service()
         if not otp_service.verify_code(phone, code):
             return Response({
                 'error': 'Неверный или истекший код'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Удаляем код из Redis
-        SMSVerificationCache.delete_verification_code(phone)
-        
         # Создаем пользователя
         user_serializer = UserRegistrationSerializer(data=serializer.validated_data)
         if user_serializer.is_valid():
@@ -868,6 +1054,7 @@ def complete_registration(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AnonAuthThrottle])
 def set_password(request):
     """Установка пароля и завершение регистрации"""
     serializer = SetPasswordSerializer(data=request.data)
@@ -884,16 +1071,12 @@ def set_password(request):
             user.complete_registration()  # Завершаем регистрацию
             
             # Создаем токен аутентификации
-            expires_at = timezone.now() + timedelta(days=30)
-            auth_token = AuthToken.objects.create(
-                user=user,
-                expires_at=expires_at
-            )
+            auth_token = issue_auth_token(user)
             
             return Response({
                 'message': 'Регистрация завершена успешно',
                 'user': UserSerializer(user).data,
-                'token': str(auth_token.token)
+                **get_token_response_data(user, auth_token)
             }, status=status.HTTP_200_OK)
             
         except User.DoesNotExist:
@@ -931,6 +1114,7 @@ def set_password(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPSendThrottle])
 def reset_password(request):
     """Восстановление пароля"""
     serializer = ResetPasswordSerializer(data=request.data)
@@ -947,14 +1131,25 @@ def reset_password(request):
             user.save()
             
             # Отправляем код для восстановления
-            otp_service = UniversalOTPService()
+            otp_service = get_otp_service()
+            
+            if settings.OTP_DISPATCH_MODE == 'queue':
+                result = otp_service.enqueue_verification_code(phone, prefer_telegram=True)
+                if not result['success']:
+                    return Response({
+                        'error': result['message']
+                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                
+                return Response({
+                    'message': 'Код для восстановления пароля поставлен в очередь на отправку',
+                    'phone': phone,
+                    'dispatch_id': result['dispatch_id'],
+                    'status': STATUS_QUEUED
+                }, status=status.HTTP_202_ACCEPTED)
+            
             result = otp_service.send_verification_code(phone, prefer_telegram=True)
             
             if result['success']:
-                # Сохраняем код в Redis
-                if result['sms_verification']:
-                    SMSVerificationCache.store_verification_code(phone, result['sms_verification'].code)
-                
                 return Response({
                     'message': 'Код отправлен для восстановления пароля',
                     'phone': phone,
@@ -1014,6 +1209,7 @@ def reset_password(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([OTPVerifyThrottle])
 def set_new_password(request):
     """Установка нового пароля после восстановления"""
     serializer = SetPasswordSerializer(data=request.data)
@@ -1029,15 +1225,12 @@ def set_new_password(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Проверяем код
-        otp_service = UniversalOTPService()
+        otp_service = get_otp_service()
         if not otp_service.verify_code(phone, code):
             return Response({
                 'error': 'Неверный или истекший код'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Удаляем код из Redis
-        SMSVerificationCache.delete_verification_code(phone)
-        
         try:
             user = User.objects.get(phone=phone, should_update_password=True)
             
@@ -1045,17 +1238,20 @@ def set_new_password(request):
             user.set_password(password)
             user.complete_registration()  # Завершаем восстановление
             
+            # Владелец номера подтвержден кодом: неудачные входы во время
+            # восстановления не должны блокировать вход с новым паролем
+            LoginGuard.reset(phone)
+            
+            # Отзываем токены, выданные до смены пароля
+            TokenEpoch.bump_epoch(user.pk)
+            
             # Создаем токен аутентификации
-            expires_at = timezone.now() + timedelta(days=30)
-            auth_token = AuthToken.objects.create(
-                user=user,
-                expires_at=expires_at
-            )
+            auth_token = issue_auth_token(user)
             
             return Response({
                 'message': 'Пароль успешно изменен',
                 'user': UserSerializer(user).data,
-                'token': str(auth_token.token)
+                **get_token_response_data(user, auth_token)
             }, status=status.HTTP_200_OK)
             
         except User.DoesNotExist:
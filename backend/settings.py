@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from urllib.parse import urlparse
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -55,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'authentication.middleware.RateLimitHeadersMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -134,16 +137,61 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'authentication.authentication.AuthTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Число доверенных прокси перед Django: IP клиента для лимитов берется из
+    # X-Forwarded-For на этой позиции с конца (nginx дописывает $remote_addr),
+    # поэтому подставленный клиентом X-Forwarded-For не меняет ключ лимита.
+    # 0 - без прокси, IP из REMOTE_ADDR
+    'NUM_PROXIES': config('NUM_PROXIES', default=1, cast=int),
+    # Лимиты authentication.throttling: '<scope>:<ip|phone|user|country>'
+    'DEFAULT_THROTTLE_RATES': {
+        'otp_send:ip': '20/hour',
+        'otp_send:phone': '5/hour',
+        # Общий лимит на код страны - тормоз при накрутке SMS, по умолчанию выключен:
+        # почти весь трафик одной страны, и лимит без замеров отказал бы всем
+        # пользователям. Задается по замеренному пиковому трафику, например '5000/hour'
+        'otp_send:country': config('OTP_SEND_COUNTRY_RATE', default=None),
+        'otp_verify:ip': '60/hour',
+        'otp_verify:phone': '10/hour',
+        'login:ip': '30/minute',
+        'login:phone': '10/hour',
+        'auth:ip': '60/minute',
+        'admin:ip': '600/minute',
+        'admin:user': '300/minute',
+    },
 }
 
+# Отключение лимитов на стенде нагрузочного тестирования (test_new_registration.py)
+if not config('THROTTLING_ENABLED', default=True, cast=bool):
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] = {}
+
+# Keyset пагинация списка пользователей (users/pagination.py), по умолчанию PAGE_SIZE на страницу
+USERS_MAX_PAGE_SIZE = config('USERS_MAX_PAGE_SIZE', default=100, cast=int)
+
+# Подсчет пользователей (users/counting.py)
+USERS_COUNT_ESTIMATE_THRESHOLD = config('USERS_COUNT_ESTIMATE_THRESHOLD', default=100000, cast=int)  # Строк для оценки pg_class
+USERS_COUNT_CACHE_REFRESH = config('USERS_COUNT_CACHE_REFRESH', default=60, cast=int)  # Фоновый пересчет, секунды
+USERS_COUNT_CACHE_MAX_AGE = config('USERS_COUNT_CACHE_MAX_AGE', default=3600, cast=int)  # Хранение в Redis, секунды
+
+# Выгрузка пользователей (users/export.py): строк на одно чтение серверного курсора
+USERS_EXPORT_CHUNK_SIZE = config('USERS_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Импорт пользователей (users/importing.py)
+USERS_IMPORT_BATCH_SIZE = config('USERS_IMPORT_BATCH_SIZE', default=1000, cast=int)  # Строк на bulk_create
+USERS_IMPORT_HASHING_WORKERS = config('USERS_IMPORT_HASHING_WORKERS', default=4, cast=int)  # Процессов хэширования паролей
+USERS_IMPORT_REJECT_SAMPLES = config('USERS_IMPORT_REJECT_SAMPLES', default=100, cast=int)  # Отказов в отчете
+# Пределы эндпоинта POST /api/users/import/: импорт должен уложиться в таймаут
+# воркера gunicorn (~0.5 с CPU на пароль), большие файлы - командой import_users
+USERS_IMPORT_MAX_UPLOAD_SIZE = config('USERS_IMPORT_MAX_UPLOAD_SIZE', default=2 * 1024 * 1024, cast=int)  # Байты
+USERS_IMPORT_MAX_ROWS = config('USERS_IMPORT_MAX_ROWS', default=200, cast=int)  # Строк в файле
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -171,16 +219,101 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
 SESSION_COOKIE_AGE = 86400  # 24 часа
 
+# Токены аутентификации
+AUTH_TOKEN_LIFETIME_DAYS = config('AUTH_TOKEN_LIFETIME_DAYS', default=30, cast=int)
+AUTH_TOKEN_MAX_ACTIVE_PER_USER = config('AUTH_TOKEN_MAX_ACTIVE_PER_USER', default=10, cast=int)  # Устройств на пользователя
+
+# Хэширование паролей (authentication.hashing): 'inline', 'thread' или 'process'
+PASSWORD_HASHING_MODE = config('PASSWORD_HASHING_MODE', default='inline')
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=2, cast=int)
+PASSWORD_HASHING_QUEUE_SIZE = config('PASSWORD_HASHING_QUEUE_SIZE', default=16, cast=int)  # Ожидающих сверх воркеров, дальше 503
+PASSWORD_HASHING_TIMEOUT = config('PASSWORD_HASHING_TIMEOUT', default=10, cast=int)  # Секунды
+
+# Защита входа от перебора паролей (до хэширования)
+LOGIN_FAILURES_BEFORE_LOCKOUT = config('LOGIN_FAILURES_BEFORE_LOCKOUT', default=5, cast=int)  # На номер
+LOGIN_IP_FAILURES_BEFORE_LOCKOUT = config('LOGIN_IP_FAILURES_BEFORE_LOCKOUT', default=20, cast=int)  # На IP
+LOGIN_LOCKOUT_BASE = config('LOGIN_LOCKOUT_BASE', default=1, cast=int)  # Секунды, удваивается с каждой неудачей
+LOGIN_LOCKOUT_MAX = config('LOGIN_LOCKOUT_MAX', default=900, cast=int)  # 15 минут
+LOGIN_FAILURE_WINDOW = config('LOGIN_FAILURE_WINDOW', default=3600, cast=int)  # Время жизни счетчика неудач
+LOGIN_ACCOUNT_CACHE_TIMEOUT = config('LOGIN_ACCOUNT_CACHE_TIMEOUT', default=300, cast=int)
+
+# Очистка устаревших SMSVerification и AuthToken (manage.py purge_auth_data)
+AUTH_PURGE_RETENTION_DAYS = config('AUTH_PURGE_RETENTION_DAYS', default=7, cast=int)
+AUTH_PURGE_BATCH_SIZE = config('AUTH_PURGE_BATCH_SIZE', default=1000, cast=int)
+AUTH_PURGE_SLEEP = config('AUTH_PURGE_SLEEP', default=0.1, cast=float)
+
+# Кэш токенов аутентификации
+AUTH_TOKEN_CACHE_TIMEOUT = config('AUTH_TOKEN_CACHE_TIMEOUT', default=300, cast=int)  # Redis, секунды
+AUTH_TOKEN_LOCAL_CACHE_SIZE = config('AUTH_TOKEN_LOCAL_CACHE_SIZE', default=1024, cast=int)  # Записей на процесс
+AUTH_TOKEN_LOCAL_CACHE_TTL = config('AUTH_TOKEN_LOCAL_CACHE_TTL', default=5, cast=int)  # LRU в памяти, секунды
+
+# Подписанные access токены (проверяются без обращения к БД и Redis)
+SIGNED_ACCESS_TOKENS_ENABLED = config('SIGNED_ACCESS_TOKENS_ENABLED', default=False, cast=bool)
+SIGNED_ACCESS_TOKEN_LIFETIME = config('SIGNED_ACCESS_TOKEN_LIFETIME', default=900, cast=int)  # 15 минут
+
+# Хранилище OTP кодов: 'database' (SMSVerification) или 'redis' (запись в БД через flush_otp_audit)
+OTP_STORAGE = config('OTP_STORAGE', default='database')
+OTP_CODE_TTL = config('OTP_CODE_TTL', default=300, cast=int)  # 5 минут
+OTP_MAX_VERIFY_ATTEMPTS = config('OTP_MAX_VERIFY_ATTEMPTS', default=5, cast=int)  # Неверных попыток на код (redis)
+OTP_AUDIT_BATCH_SIZE = config('OTP_AUDIT_BATCH_SIZE', default=500, cast=int)
+OTP_AUDIT_LOCK_TIMEOUT = config('OTP_AUDIT_LOCK_TIMEOUT', default=60, cast=int)  # Блокировка одной пачки flush_otp_audit, секунды
+# Одинаковый код для всех номеров - только для нагрузочного тестирования, в продакшене пустой
+# (проверяется ниже, после настроек провайдеров)
+OTP_FIXED_CODE = config('OTP_FIXED_CODE', default='')
+
+# Отправка OTP: 'sync' - в запросе, 'queue' - через Redis Stream (manage.py run_otp_dispatcher)
+OTP_DISPATCH_MODE = config('OTP_DISPATCH_MODE', default='sync')
+OTP_DISPATCH_MAX_ATTEMPTS = config('OTP_DISPATCH_MAX_ATTEMPTS', default=3, cast=int)
+OTP_DISPATCH_RETRY_DELAY = config('OTP_DISPATCH_RETRY_DELAY', default=10, cast=int)  # Секунды до повтора
+OTP_DISPATCH_STATUS_TTL = config('OTP_DISPATCH_STATUS_TTL', default=3600, cast=int)
+OTP_DISPATCH_STREAM_MAXLEN = config('OTP_DISPATCH_STREAM_MAXLEN', default=100000, cast=int)
+# Хеджированная отправка: SMS параллельно, если Telegram не ответил за OTP_HEDGE_DELAY секунд (0 - выключено)
+OTP_HEDGE_DELAY = config('OTP_HEDGE_DELAY', default=0, cast=float)
+OTP_HEDGE_WORKERS = config('OTP_HEDGE_WORKERS', default=16, cast=int)  # Одновременных отправок в Telegram на процесс
+
 # Green SMS API settings
 GREEN_SMS_USER = config('GREEN_SMS_USER', default='test')
 GREEN_SMS_PASSWORD = config('GREEN_SMS_PASSWORD', default='test')
 GREEN_SMS_DEBUG = config('GREEN_SMS_DEBUG', default=True, cast=bool)
+GREEN_SMS_URL = config('GREEN_SMS_URL', default='https://api3.greensms.ru')
 
 # Telegram Gateway API settings
 TELEGRAM_GATEWAY_ENABLED = config('TELEGRAM_GATEWAY_ENABLED', default=True, cast=bool)
 TELEGRAM_GATEWAY_TOKEN = config('TELEGRAM_GATEWAY_TOKEN', default='')
-TELEGRAM_GATEWAY_URL = 'https://gatewayapi.telegram.org'
+TELEGRAM_GATEWAY_URL = config('TELEGRAM_GATEWAY_URL', default='https://gatewayapi.telegram.org')
 TELEGRAM_GATEWAY_DEBUG = config('TELEGRAM_GATEWAY_DEBUG', default=True, cast=bool)
+TELEGRAM_SEND_ABILITY_TTL = config('TELEGRAM_SEND_ABILITY_TTL', default=300, cast=int)  # Кэш checkSendAbility: доступен
+TELEGRAM_SEND_ABILITY_NEGATIVE_TTL = config('TELEGRAM_SEND_ABILITY_NEGATIVE_TTL', default=3600, cast=int)  # Недоступен
+
+# Известный код для всех номеров дает вход в любой аккаунт через восстановление
+# пароля, поэтому OTP_FIXED_CODE допускается только с DEBUG=True или когда все
+# провайдеры - локальные заглушки (manage.py run_provider_stubs)
+if OTP_FIXED_CODE and not DEBUG:
+    _provider_urls = [GREEN_SMS_URL] + ([TELEGRAM_GATEWAY_URL] if TELEGRAM_GATEWAY_ENABLED else [])
+    if any(urlparse(url).hostname not in ('localhost', '127.0.0.1', '::1') for url in _provider_urls):
+        raise ImproperlyConfigured(
+            'OTP_FIXED_CODE задан при DEBUG=False и реальных провайдерах. '
+            'Он допустим только для нагрузочного тестирования на заглушках'
+        )
+
+# HTTP клиенты провайдеров (authentication/http_client.py): keep-alive сессия на процесс
+PROVIDER_HTTP_POOL_SIZE = config('PROVIDER_HTTP_POOL_SIZE', default=10, cast=int)  # Соединений на провайдера
+PROVIDER_HTTP_CONNECT_TIMEOUT = config('PROVIDER_HTTP_CONNECT_TIMEOUT', default=3.05, cast=float)  # Секунды
+PROVIDER_HTTP_READ_TIMEOUT = config('PROVIDER_HTTP_READ_TIMEOUT', default=10, cast=float)
+PROVIDER_ASYNC_POOL_SIZE = config('PROVIDER_ASYNC_POOL_SIZE', default=500, cast=int)  # httpx, на провайдера и процесс ASGI
+
+# OTP эндпоинты на async views (ASGI профиль, uvicorn backend.asgi:application)
+OTP_ASYNC_VIEWS = config('OTP_ASYNC_VIEWS', default=False, cast=bool)
+
+# Circuit breaker провайдеров (authentication/circuit_breaker.py), состояние общее через Redis
+CIRCUIT_BREAKER_WINDOW = config('CIRCUIT_BREAKER_WINDOW', default=60, cast=int)  # Окно статистики, секунды
+CIRCUIT_BREAKER_BUCKET = config('CIRCUIT_BREAKER_BUCKET', default=10, cast=int)  # Размер корзины окна, секунды
+CIRCUIT_BREAKER_MIN_CALLS = config('CIRCUIT_BREAKER_MIN_CALLS', default=10, cast=int)  # Вызовов в окне для решения
+CIRCUIT_BREAKER_ERROR_RATE = config('CIRCUIT_BREAKER_ERROR_RATE', default=0.5, cast=float)  # Доля ошибок для размыкания
+CIRCUIT_BREAKER_SLOW_CALL = config('CIRCUIT_BREAKER_SLOW_CALL', default=5.0, cast=float)  # Вызов дольше - ошибка, секунды
+CIRCUIT_BREAKER_OPEN_SECONDS = config('CIRCUIT_BREAKER_OPEN_SECONDS', default=30, cast=int)
+CIRCUIT_BREAKER_DEGRADED_ERROR_RATE = config('CIRCUIT_BREAKER_DEGRADED_ERROR_RATE', default=0.2, cast=float)  # Канал уходит на второе место
+CIRCUIT_BREAKER_DEGRADED_LATENCY = config('CIRCUIT_BREAKER_DEGRADED_LATENCY', default=2.0, cast=float)  # Средняя задержка, секунды
 
 # Swagger settings
 SWAGGER_SETTINGS = {
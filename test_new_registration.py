@@ -1,178 +1,394 @@
 #!/usr/bin/env python3
 """
-Тестовый скрипт для новой системы многоэтапной регистрации
+Нагрузочный тест многоэтапной регистрации и восстановления пароля
+
+Каждый виртуальный пользователь проходит весь сценарий на запущенном сервере:
+send-code → complete-registration → set-password → login → повторный send-code
+(защита от спама, ожидается 400) → reset-password → set-new-password → login
+с новым паролем. Пользователи выполняются параллельно (asyncio + httpx).
+
+Выводятся пропускная способность, p50/p95/p99 по шагам, разбивка ошибок и, с
+--server-stats, изменение счетчиков Redis (INFO commandstats) и PostgreSQL
+(pg_stat_database) за время прогона.
+
+Сервер должен быть запущен с одинаковым кодом для всех номеров и без лимитов:
+    OTP_FIXED_CODE=123456 THROTTLING_ENABLED=False
+(с DEBUG=False - только на заглушках, manage.py run_provider_stubs)
+
+Примеры:
+    python test_new_registration.py --users 1
+    python test_new_registration.py --users 500 --concurrency 50 --server-stats --json result.json
 """
-import requests
+import argparse
+import asyncio
 import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
 
-BASE_URL = "http://localhost:8000"
-
-def test_new_registration_flow():
-    """Тестирует новый процесс регистрации"""
-    print("🧪 Тестирование новой системы многоэтапной регистрации")
-    print("=" * 60)
-    
-    # Тестовые данные
-    phone = "+79999999999"
-    username = "test_user"
-    email = "test@example.com"
-    first_name = "Test"
-    last_name = "User"
-    password = "testpassword123"
-    
-    # Шаг 1: Отправка кода для регистрации
-    print("\n📱 Шаг 1: Отправка кода для регистрации")
-    response = requests.post(f"{BASE_URL}/api/auth/send-code/", json={
-        "phone": phone,
-        "is_reset": False
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code != 200:
-        print("❌ Ошибка на шаге 1")
-        return
-    
-    # Шаг 2: Завершение регистрации (создание пользователя без пароля)
-    print("\n👤 Шаг 2: Завершение регистрации")
-    response = requests.post(f"{BASE_URL}/api/auth/complete-registration/", json={
-        "phone": phone,
-        "code": "123456",  # В debug режиме всегда 123456
-        "username": username,
-        "email": email,
-        "first_name": first_name,
-        "last_name": last_name
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code != 201:
-        print("❌ Ошибка на шаге 2")
-        return
-    
-    user_data = response.json()["user"]
-    print(f"✅ Пользователь создан с should_update_password: {user_data['should_update_password']}")
-    
-    # Шаг 3: Установка пароля
-    print("\n🔐 Шаг 3: Установка пароля")
-    response = requests.post(f"{BASE_URL}/api/auth/set-password/", json={
-        "phone": phone,
-        "password": password,
-        "password_confirm": password
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code != 200:
-        print("❌ Ошибка на шаге 3")
-        return
-    
-    token = response.json()["token"]
-    user_data = response.json()["user"]
-    print(f"✅ Регистрация завершена! should_update_password: {user_data['should_update_password']}")
-    print(f"🔑 Токен: {token}")
-    
-    # Шаг 4: Тестирование входа
-    print("\n🚪 Шаг 4: Тестирование входа")
-    response = requests.post(f"{BASE_URL}/api/auth/login/", json={
-        "phone": phone,
-        "password": password
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code == 200:
-        print("✅ Вход выполнен успешно!")
-    else:
-        print("❌ Ошибка входа")
-    
-    return token
-
-
-def test_password_reset_flow():
-    """Тестирует процесс восстановления пароля"""
-    print("\n\n🔄 Тестирование восстановления пароля")
-    print("=" * 60)
-    
-    phone = "+79999999999"
-    new_password = "newpassword123"
-    
-    # Шаг 1: Запрос на восстановление пароля
-    print("\n📱 Шаг 1: Запрос на восстановление пароля")
-    response = requests.post(f"{BASE_URL}/api/auth/reset-password/", json={
-        "phone": phone
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code != 200:
-        print("❌ Ошибка на шаге 1 восстановления")
+import httpx
+
+STEPS = [
+    'send_code',
+    'complete_registration',
+    'set_password',
+    'login',
+    'spam_check',
+    'reset_password',
+    'set_new_password',
+    'login_new_password',
+]
+
+PG_STAT_FIELDS = [
+    'xact_commit', 'xact_rollback', 'tup_returned', 'tup_fetched',
+    'tup_inserted', 'tup_updated', 'tup_deleted', 'blks_hit', 'blks_read',
+]
+
+
+class FlowError(Exception):
+    """Шаг сценария завершился ошибкой, пользователь дальше не идет"""
+
+
+class Recorder:
+    """Задержки успешных шагов и ошибки по шагам"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.completed = 0
+
+    def ok(self, step, latency):
+        self.latencies[step].append(latency)
+
+    def error(self, step, reason):
+        self.errors[(step, reason)] += 1
+
+    def errors_by_step(self):
+        result = Counter()
+        for (step, _), count in self.errors.items():
+            result[step] += count
+        return result
+
+
+def percentile(values, q):
+    """Процентиль q (0-100) по отсортированным значениям"""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def error_reason(response):
+    """Код ответа и текст ошибки для разбивки"""
+    try:
+        data = response.json()
+    except ValueError:
+        return str(response.status_code)
+
+    if isinstance(data, dict):
+        if 'error' in data:
+            return f"{response.status_code} {data['error']}"
+        if 'detail' in data:
+            return f"{response.status_code} {data['detail']}"
+        if data:
+            return f"{response.status_code} {next(iter(data))}"
+    return str(response.status_code)
+
+
+class VirtualUser:
+    """Сценарий одного пользователя"""
+
+    def __init__(self, client, recorder, args, index):
+        self.client = client
+        self.recorder = recorder
+        self.args = args
+        self.phone = f"{args.phone_prefix}{args.run_id:03d}{index:06d}"
+        self.username = f"loadtest_{args.run_id}_{index}"
+
+    async def call(self, step, method, path, expected, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.error(step, type(e).__name__)
+            raise FlowError(step)
+
+        if response.status_code not in expected:
+            self.recorder.error(step, error_reason(response))
+            raise FlowError(step)
+
+        data = response.json()
+        if response.status_code == 202 and 'dispatch_id' in data:
+            # OTP_DISPATCH_MODE=queue: ждем доставки кода диспетчером
+            data = await self.wait_dispatch(step, data['dispatch_id'])
+
+        self.recorder.ok(step, time.perf_counter() - started)
+        return data
+
+    async def wait_dispatch(self, step, dispatch_id):
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline:
+            try:
+                response = await self.client.get(f"/api/auth/send-code/{dispatch_id}/status/")
+            except httpx.HTTPError as e:
+                self.recorder.error(step, type(e).__name__)
+                raise FlowError(step)
+
+            data = response.json()
+            if data.get('status') == 'sent':
+                return data
+            if data.get('status') == 'failed' or response.status_code != 200:
+                self.recorder.error(step, f"dispatch {data.get('status') or response.status_code}")
+                raise FlowError(step)
+            await asyncio.sleep(0.1)
+
+        self.recorder.error(step, 'dispatch timeout')
+        raise FlowError(step)
+
+    async def run(self):
+        code = self.args.code
+        password = 'LoadTest-1-password'
+        new_password = 'LoadTest-2-password'
+
+        await self.call('send_code', 'POST', '/api/auth/send-code/', (200, 202), json={
+            'phone': self.phone,
+            'is_reset': False
+        })
+        await self.call('complete_registration', 'POST', '/api/auth/complete-registration/', (201,), json={
+            'phone': self.phone,
+            'code': code,
+            'username': self.username,
+            'email': f"{self.username}@loadtest.local",
+            'first_name': 'Load',
+            'last_name': 'Test'
+        })
+        await self.call('set_password', 'POST', '/api/auth/set-password/', (200,), json={
+            'phone': self.phone,
+            'password': password,
+            'password_confirm': password
+        })
+        await self.call('login', 'POST', '/api/auth/login/', (200,), json={
+            'phone': self.phone,
+            'password': password
+        })
+        await self.call('spam_check', 'POST', '/api/auth/send-code/', (400,), json={
+            'phone': self.phone,
+            'is_reset': False
+        })
+
+        if not self.args.no_reset:
+            await self.call('reset_password', 'POST', '/api/auth/reset-password/', (200, 202), json={
+                'phone': self.phone
+            })
+            await self.call('set_new_password', 'POST', '/api/auth/set-new-password/', (200,), json={
+                'phone': self.phone,
+                'password': new_password,
+                'password_confirm': new_password,
+                'code': code
+            })
+            await self.call('login_new_password', 'POST', '/api/auth/login/', (200,), json={
+                'phone': self.phone,
+                'password': new_password
+            })
+
+        self.recorder.completed += 1
+
+
+class ServerStats:
+    """Счетчики Redis и PostgreSQL сервера (через настройки Django проекта)"""
+
+    def __init__(self):
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        import django
+        django.setup()
+
+    def redis(self):
+        from django_redis import get_redis_connection
+        try:
+            stats = get_redis_connection('default').info('commandstats')
+        except Exception as e:
+            print(f"Redis INFO commandstats недоступен: {e}")
+            return None
+        return {
+            name.replace('cmdstat_', ''): {'calls': int(value['calls']), 'usec': int(value['usec'])}
+            for name, value in stats.items()
+        }
+
+    def postgres(self):
+        from django.db import connection
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            # Иначе в пределах транзакции возвращается закэшированный снимок
+            cursor.execute('SELECT pg_stat_clear_snapshot()')
+            cursor.execute(
+                f"SELECT {', '.join(PG_STAT_FIELDS)} FROM pg_stat_database WHERE datname = current_database()"
+            )
+            return dict(zip(PG_STAT_FIELDS, cursor.fetchone()))
+
+    def collect(self):
+        return {'redis': self.redis(), 'postgres': self.postgres()}
+
+    @staticmethod
+    def delta(before, after):
+        result = {'redis': None, 'postgres': None}
+        if before['redis'] is not None and after['redis'] is not None:
+            result['redis'] = {}
+            for name, value in after['redis'].items():
+                previous = before['redis'].get(name, {'calls': 0, 'usec': 0})
+                calls = value['calls'] - previous['calls']
+                if calls:
+                    result['redis'][name] = {'calls': calls, 'usec': value['usec'] - previous['usec']}
+        if before['postgres'] is not None and after['postgres'] is not None:
+            result['postgres'] = {
+                field: after['postgres'][field] - before['postgres'][field] for field in PG_STAT_FIELDS
+            }
+        return result
+
+
+async def run_load(args, recorder):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        async def run_user(index):
+            async with semaphore:
+                try:
+                    await VirtualUser(client, recorder, args, index).run()
+                except FlowError:
+                    pass
+
+        await asyncio.gather(*(run_user(index) for index in range(args.users)))
+
+
+def build_report(args, recorder, elapsed, server_delta):
+    errors_by_step = recorder.errors_by_step()
+    steps = {}
+    for step in STEPS:
+        latencies = sorted(recorder.latencies[step])
+        if not latencies and not errors_by_step[step]:
+            continue
+        steps[step] = {
+            'ok': len(latencies),
+            'errors': errors_by_step[step],
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+            'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+        }
+
+    requests_total = sum(step['ok'] + step['errors'] for step in steps.values())
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'elapsed_s': elapsed,
+        'completed': recorder.completed,
+        'flows_per_s': recorder.completed / elapsed,
+        'requests': requests_total,
+        'requests_per_s': requests_total / elapsed,
+        'steps': steps,
+        'errors': [
+            {'step': step, 'reason': reason, 'count': count}
+            for (step, reason), count in recorder.errors.most_common()
+        ],
+        'server': server_delta,
+    }
+
+
+def print_report(report):
+    def ms(value):
+        return f"{value:.0f}" if value is not None else '-'
+
+    print(f"Пользователей {report['users']}, одновременно {report['concurrency']}, "
+          f"время {report['elapsed_s']:.1f} с")
+    print(f"Сценариев завершено {report['completed']} ({report['flows_per_s']:.1f}/с), "
+          f"запросов {report['requests']} ({report['requests_per_s']:.1f}/с)")
+
+    print(f"\n{'Шаг':24} {'OK':>7} {'Ошибок':>7} {'Запр/с':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8}")
+    for step, stats in report['steps'].items():
+        print(f"{step:24} {stats['ok']:>7} {stats['errors']:>7} {stats['rps']:>8.1f} "
+              f"{ms(stats['p50_ms']):>8} {ms(stats['p95_ms']):>8} {ms(stats['p99_ms']):>8}")
+
+    if report['errors']:
+        print('\nОшибки:')
+        for error in report['errors']:
+            print(f"  {error['step']:24} {error['count']:>6}  {error['reason']}")
+
+    server = report['server']
+    if server is None:
         return
-    
-    # Шаг 2: Установка нового пароля
-    print("\n🔐 Шаг 2: Установка нового пароля")
-    response = requests.post(f"{BASE_URL}/api/auth/set-new-password/", json={
-        "phone": phone,
-        "password": new_password,
-        "password_confirm": new_password,
-        "code": "123456"  # В debug режиме всегда 123456
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code == 200:
-        print("✅ Пароль успешно изменен!")
-        token = response.json()["token"]
-        return token
-    else:
-        print("❌ Ошибка установки нового пароля")
-        return None
-
-
-def test_protection_against_spam():
-    """Тестирует защиту от спама при регистрации"""
-    print("\n\n🛡️ Тестирование защиты от спама")
-    print("=" * 60)
-    
-    phone = "+79999999999"
-    
-    # Попытка зарегистрировать уже существующий номер без is_reset
-    print("\n🚫 Попытка повторной регистрации без is_reset")
-    response = requests.post(f"{BASE_URL}/api/auth/send-code/", json={
-        "phone": phone,
-        "is_reset": False
-    })
-    
-    print(f"Статус: {response.status_code}")
-    print(f"Ответ: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
-    
-    if response.status_code == 400:
-        print("✅ Защита от спама работает!")
+
+    if server['redis'] is not None:
+        total = sum(value['calls'] for value in server['redis'].values())
+        print(f"\nRedis, команд {total} ({total / max(report['completed'], 1):.1f} на сценарий):")
+        for name, value in sorted(server['redis'].items(), key=lambda item: -item[1]['calls']):
+            print(f"  {name:24} {value['calls']:>8}  {value['usec'] / value['calls']:.1f} мкс/вызов")
+
+    if server['postgres'] is not None:
+        print('\nPostgreSQL (pg_stat_database):')
+        for field, value in server['postgres'].items():
+            print(f"  {field:24} {value:>8}")
     else:
-        print("❌ Защита от спама не работает")
+        print('\nPostgreSQL: статистика доступна только для PostgreSQL')
 
 
-if __name__ == "__main__":
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест регистрации и восстановления пароля')
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--users', type=int, default=1, help='Число виртуальных пользователей')
+    parser.add_argument('--concurrency', type=int, default=10, help='Пользователей одновременно')
+    parser.add_argument('--code', default=os.environ.get('OTP_FIXED_CODE', '123456'),
+                        help='Код подтверждения (OTP_FIXED_CODE сервера)')
+    parser.add_argument('--phone-prefix', default='+79',
+                        help='Начало номеров; далее 3 цифры прогона и 6 цифр пользователя')
+    parser.add_argument('--run-id', type=int, default=None,
+                        help='Номер прогона 0-999 (по умолчанию случайный)')
+    parser.add_argument('--no-reset', action='store_true', help='Без восстановления пароля')
+    parser.add_argument('--timeout', type=float, default=30, help='Таймаут запроса, секунды')
+    parser.add_argument('--server-stats', action='store_true',
+                        help='Счетчики Redis и PostgreSQL сервера (нужен доступ по настройкам проекта)')
+    parser.add_argument('--stats-delay', type=float, default=1.0,
+                        help='Пауза перед итоговыми счетчиками: PostgreSQL обновляет статистику с задержкой')
+    parser.add_argument('--json', dest='json_path', default=None, help='Сохранить отчет в JSON')
+    args = parser.parse_args()
+
+    if args.run_id is None:
+        args.run_id = random.randint(0, 999)
+    if not 0 <= args.run_id <= 999 or not 0 < args.users <= 1000000:
+        parser.error('--run-id от 0 до 999, --users от 1 до 1000000')
+    return args
+
+
+def main():
+    args = parse_args()
+    recorder = Recorder()
+
+    server_stats = ServerStats() if args.server_stats else None
+    before = server_stats.collect() if server_stats else None
+
+    started = time.perf_counter()
     try:
-        # Тестируем новую регистрацию
-        token = test_new_registration_flow()
-        
-        if token:
-            # Тестируем восстановление пароля
-            test_password_reset_flow()
-            
-            # Тестируем защиту от спама
-            test_protection_against_spam()
-        
-        print("\n🎉 Все тесты завершены!")
-        
-    except requests.exceptions.ConnectionError:
-        print("❌ Ошибка подключения. Убедитесь, что сервер запущен на localhost:8000")
-    except Exception as e:
-        print(f"❌ Ошибка: {e}")
+        asyncio.run(run_load(args, recorder))
+    except KeyboardInterrupt:
+        print('Прервано, отчет по выполненным запросам')
+    elapsed = time.perf_counter() - started
+
+    server_delta = None
+    if server_stats:
+        time.sleep(args.stats_delay)
+        server_delta = ServerStats.delta(before, server_stats.collect())
+
+    report = build_report(args, recorder, elapsed, server_delta)
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return 0 if not recorder.errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Подсчет пользователей без полного сканирования таблицы при каждом запросе
+
+- Без фильтров на большой таблице (от USERS_COUNT_ESTIMATE_THRESHOLD строк)
+  возвращается оценка планировщика PostgreSQL (pg_class.reltuples). Ее
+  обновляют ANALYZE и autovacuum, погрешность обычно в пределах процентов.
+- Остальные подсчеты - точный count(), закэшированный в Redis. Через
+  USERS_COUNT_CACHE_REFRESH секунд значение пересчитывается в фоновом потоке
+  (один пересчет на ключ для всех воркеров), а до окончания пересчета
+  отдается прежнее значение.
+- exact=True всегда выполняет count() и обновляет кэш.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+
+
+def estimate_count(model) -> Optional[int]:
+    """Оценка числа строк таблицы модели по статистике планировщика (только PostgreSQL)"""
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+            [connection.ops.quote_name(model._meta.db_table)]
+        )
+        row = cursor.fetchone()
+
+    # -1 - таблица еще не анализировалась
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CountCache:
+    """Точные count() в Redis: {'value', 'computed_at'}"""
+
+    @staticmethod
+    def _key(name):
+        return f"users_count_{name}"
+
+    @staticmethod
+    def _refresh_lock_key(name):
+        return f"users_count_refresh_{name}"
+
+    @staticmethod
+    def get(name, queryset) -> int:
+        """Значение из кэша; устаревшее пересчитывается в фоне, отсутствующее - сразу"""
+        entry = cache.get(CountCache._key(name))
+        if entry is None:
+            return CountCache.refresh(name, queryset)
+
+        if time.time() - entry['computed_at'] >= settings.USERS_COUNT_CACHE_REFRESH:
+            CountCache.schedule_refresh(name, queryset)
+        return entry['value']
+
+    @staticmethod
+    def refresh(name, queryset) -> int:
+        """Выполняет count() и сохраняет результат"""
+        value = queryset.count()
+        cache.set(
+            CountCache._key(name),
+            {'value': value, 'computed_at': time.time()},
+            timeout=settings.USERS_COUNT_CACHE_MAX_AGE
+        )
+        return value
+
+    @staticmethod
+    def schedule_refresh(name, queryset) -> None:
+        # Пересчет уже запущен этим или другим воркером
+        if not cache.add(CountCache._refresh_lock_key(name), 1, timeout=settings.USERS_COUNT_CACHE_REFRESH):
+            return
+        _get_refresh_executor().submit(_refresh_in_background, name, queryset)
+
+
+def _refresh_in_background(name, queryset):
+    try:
+        CountCache.refresh(name, queryset)
+    except Exception as e:
+        print(f"Ошибка пересчета количества {name}: {e}")
+    finally:
+        cache.delete(CountCache._refresh_lock_key(name))
+        # Поток пула не проходит через обработчики запроса, соединение закрываем сами
+        connections.close_all()
+
+
+def count_users(name, queryset, exact=False) -> Tuple[int, bool]:
+    """
+    Количество строк queryset
+
+    Args:
+        name: ключ кэша подсчета (например 'total', 'verified')
+        queryset: queryset, для которого нужно количество
+        exact: выполнить count() сейчас
+
+    Returns:
+        (количество, True для exact - иначе значение может быть оценкой или
+        отставать на USERS_COUNT_CACHE_REFRESH секунд)
+    """
+    if exact:
+        return CountCache.refresh(name, queryset), True
+
+    if not queryset.query.where:
+        estimate = estimate_count(queryset.model)
+        if estimate is not None and estimate >= settings.USERS_COUNT_ESTIMATE_THRESHOLD:
+            return estimate, False
+
+    return CountCache.get(name, queryset), False
+
+
+def is_exact_requested(request) -> bool:
+    """Параметр ?exact=true"""
+    return request.query_params.get('exact', '').lower() in ('1', 'true', 'yes')
+
+
+_refresh_executor = None
+_refresh_pid = None
+_refresh_lock = threading.Lock()
+
+
+def _get_refresh_executor():
+    """Поток фонового пересчета; создается заново после fork"""
+    global _refresh_executor, _refresh_pid
+    if _refresh_pid != os.getpid():
+        with _refresh_lock:
+            if _refresh_pid != os.getpid():
+                _refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='users-count')
+                _refresh_pid = os.getpid()
+    return _refresh_executor
@@ -0,0 +1,361 @@
+"""
+Массовый импорт пользователей из CSV или NDJSON
+
+Файл читается потоком и обрабатывается пачками по USERS_IMPORT_BATCH_SIZE строк:
+- номера нормализуются normalize_phone_number, поля проверяются валидаторами модели;
+- повторы внутри пачки отсекаются множеством, уже существующие phone и
+  username - двумя запросами phone__in / username__in на пачку (повторы из
+  предыдущих пачек к этому моменту уже в таблице);
+- пароли хэшируются параллельно в пуле из USERS_IMPORT_HASHING_WORKERS процессов
+  (в эндпоинте - потоков, чтобы не форкать воркер gunicorn);
+- пачка вставляется одним bulk_create, в той же транзакции меняются счетчики
+  UserCounter; bulk_create не вызывает сигналы, поэтому кэш состояния аккаунтов
+  LoginGuard сбрасывается явно.
+
+Поля: phone (обязательно), username (по умолчанию - номер), email,
+first_name, last_name, password. Пользователь с паролем активен и может
+входить сразу; без пароля - неактивен и задает пароль через
+/api/auth/reset-password/, как после сброса.
+
+Используется эндпоинтом POST /api/users/import/ и командой import_users.
+"""
+import csv
+import gzip
+import io
+import json
+import time
+from collections import Counter
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from authentication.cache_utils import LoginGuard
+from authentication.hashing import create_process_pool, create_thread_pool
+from authentication.validators import normalize_phone_number
+from .export import FORMULA_PREFIXES
+from .models import UserCounter
+
+IMPORT_FIELDS = ['phone', 'username', 'email', 'first_name', 'last_name', 'password']
+PROFILE_FIELDS = ['username', 'email', 'first_name', 'last_name']
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+IMPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+# Минимальная длина пароля, как в SetPasswordSerializer
+MIN_PASSWORD_LENGTH = 8
+
+REJECT_MESSAGES = {
+    'invalid_row': 'Строка не разобрана',
+    'invalid_phone': 'Неверный номер телефона',
+    'invalid_username': 'Неверное имя пользователя',
+    'invalid_email': 'Неверный email',
+    'invalid_first_name': 'Неверное имя',
+    'invalid_last_name': 'Неверная фамилия',
+    'short_password': f'Пароль короче {MIN_PASSWORD_LENGTH} символов',
+    'duplicate_phone': 'Номер повторяется в файле',
+    'duplicate_username': 'Имя пользователя повторяется в файле',
+    'phone_exists': 'Пользователь с таким номером уже существует',
+    'username_exists': 'Имя пользователя уже занято',
+    'conflict': 'Номер или имя заняты параллельной регистрацией, повторите строку',
+}
+
+
+class ImportFormatError(ValueError):
+    """Файл не может быть импортирован целиком (нет столбца phone и т.п.)"""
+
+
+def detect_format(filename):
+    """Формат по расширению файла: .csv / .csv.gz - CSV, остальные - NDJSON"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return FORMAT_CSV if name.endswith('.csv') else FORMAT_NDJSON
+
+
+def open_import_stream(fileobj, compressed=False):
+    """Текстовый поток из бинарного файла; BOM от Excel отбрасывается"""
+    if compressed:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+def _csv_value(value):
+    """Снимает экранирование формул, которое добавляет выгрузка CSV"""
+    if isinstance(value, str) and value.startswith("'") and value[1:2] and value[1] in FORMULA_PREFIXES:
+        return value[1:]
+    return value
+
+
+def read_records(stream, import_format=FORMAT_NDJSON):
+    """
+    Генератор (номер строки, dict полей или None для неразобранной строки)
+
+    Raises:
+        ImportFormatError: в CSV нет столбца phone
+    """
+    if import_format == FORMAT_CSV:
+        reader = csv.DictReader(stream)
+        if reader.fieldnames is None or 'phone' not in reader.fieldnames:
+            raise ImportFormatError('В CSV нет столбца phone')
+        for record in reader:
+            yield reader.line_num, {name: _csv_value(value) for name, value in record.items()}
+        return
+
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+class ImportReport:
+    """Итоги импорта: количества, причины отказов и скорость"""
+
+    def __init__(self, max_samples=None):
+        self.max_samples = settings.USERS_IMPORT_REJECT_SAMPLES if max_samples is None else max_samples
+        self.processed = 0
+        self.created = 0
+        self.rejected = Counter()
+        self.samples = []
+        self.batches = 0
+        self.hashing_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def reject(self, line, phone, reason):
+        self.rejected[reason] += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append({'line': line, 'phone': phone, 'reason': reason, 'error': REJECT_MESSAGES[reason]})
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'rejected': sum(self.rejected.values()),
+            'rejected_by_reason': dict(self.rejected),
+            'reject_samples': self.samples,
+            'elapsed_seconds': round(elapsed, 3),
+            'hashing_seconds': round(self.hashing_seconds, 3),
+            'insert_seconds': round(self.insert_seconds, 3),
+            'rows_per_second': round(self.processed / elapsed, 1) if elapsed else None,
+            'created_per_second': round(self.created / elapsed, 1) if elapsed else None,
+        }
+
+
+class UserImporter:
+    """
+    Импорт записей read_records пачками
+
+    Пример:
+        with open('users.csv', 'rb') as f:
+            report = UserImporter().run(read_records(open_import_stream(f), 'csv'))
+        report.as_dict()
+    """
+
+    def __init__(self, batch_size=None, hashing_workers=None, verified=False, dry_run=False,
+                 on_reject=None, on_batch=None, hashing_processes=True):
+        """
+        Args:
+            batch_size: строк на пачку (USERS_IMPORT_BATCH_SIZE)
+            hashing_workers: процессов хэширования (USERS_IMPORT_HASHING_WORKERS)
+            hashing_processes: хэшировать в пуле процессов; False - в пуле потоков
+            verified: номера подтверждены партнером (is_phone_verified)
+            dry_run: только проверить строки, ничего не создавая
+            on_reject: вызывается с (строка, номер, причина) для каждого отказа
+            on_batch: вызывается с ImportReport после каждой пачки
+        """
+        self.batch_size = batch_size or settings.USERS_IMPORT_BATCH_SIZE
+        self.hashing_workers = hashing_workers or settings.USERS_IMPORT_HASHING_WORKERS
+        self.verified = verified
+        self.dry_run = dry_run
+        self.on_reject = on_reject
+        self.on_batch = on_batch
+        self.hashing_processes = hashing_processes
+        self.report = None
+        self._pool = None
+        self._fields = {name: get_user_model()._meta.get_field(name) for name in PROFILE_FIELDS}
+
+    def run(self, records):
+        """Импортирует все записи и возвращает ImportReport"""
+        self.report = ImportReport()
+        records = iter(records)
+        try:
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch)
+                self.report.batches += 1
+                if self.on_batch:
+                    self.on_batch(self.report)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        return self.report
+
+    def reject(self, line, phone, reason):
+        self.report.reject(line, phone, reason)
+        if self.on_reject:
+            self.on_reject(line, phone, reason)
+
+    def import_batch(self, batch):
+        self.report.processed += len(batch)
+
+        rows = self.exclude_existing(self.clean_batch(batch))
+        if not rows:
+            return
+        if self.dry_run:
+            self.report.created += len(rows)
+            return
+
+        self.hash_passwords(rows)
+
+        # Номер мог зарегистрироваться между проверкой и вставкой: проверяем
+        # пачку заново и повторяем вставку один раз, после второго конфликта
+        # оставшиеся строки пачки отклоняются
+        for attempt in range(2):
+            try:
+                self.insert(rows)
+                return
+            except IntegrityError:
+                if attempt:
+                    for line, user, _ in rows:
+                        self.reject(line, user.phone, 'conflict')
+                    return
+                rows = self.exclude_existing(rows)
+                if not rows:
+                    return
+
+    def clean_batch(self, batch):
+        """Нормализует и проверяет строки пачки, отсекает повторы внутри пачки"""
+        User = get_user_model()
+        now = timezone.now()
+        rows = []
+        phones = set()
+        usernames = set()
+
+        for line, record in batch:
+            if record is None:
+                self.reject(line, None, 'invalid_row')
+                continue
+
+            raw_phone = record.get('phone')
+            try:
+                phone = normalize_phone_number(str(raw_phone or '').strip())
+            except ValidationError:
+                self.reject(line, raw_phone, 'invalid_phone')
+                continue
+
+            values = {name: str(record.get(name) or '').strip() for name in PROFILE_FIELDS}
+            values['username'] = values['username'] or phone
+            reason = self.validate_values(values)
+            if reason is None:
+                password = record.get('password') or None
+                if password is not None and len(str(password)) < MIN_PASSWORD_LENGTH:
+                    reason = 'short_password'
+            if reason is None:
+                if phone in phones:
+                    reason = 'duplicate_phone'
+                elif values['username'] in usernames:
+                    reason = 'duplicate_username'
+            if reason is not None:
+                self.reject(line, phone, reason)
+                continue
+
+            phones.add(phone)
+            usernames.add(values['username'])
+            user = User(
+                phone=phone,
+                role='user',
+                is_phone_verified=self.verified,
+                # Без пароля - как после сброса: пароль задается через OTP
+                is_active=password is not None,
+                should_update_password=password is None,
+                registration_completed_at=now if password is not None else None,
+                **values
+            )
+            rows.append((line, user, None if password is None else str(password)))
+
+        return rows
+
+    def validate_values(self, values):
+        """Причина отказа по валидаторам полей модели или None"""
+        for name, field in self._fields.items():
+            if not values[name]:
+                continue
+            try:
+                field.run_validators(values[name])
+            except ValidationError:
+                return f'invalid_{name}'
+        return None
+
+    def exclude_existing(self, rows):
+        """Отсекает номера и имена пользователей, которые уже есть в таблице"""
+        if not rows:
+            return rows
+
+        User = get_user_model()
+        existing_phones = set(User.objects.filter(
+            phone__in=[user.phone for _, user, _ in rows]
+        ).values_list('phone', flat=True))
+        existing_usernames = set(User.objects.filter(
+            username__in=[user.username for _, user, _ in rows]
+        ).values_list('username', flat=True))
+
+        kept = []
+        for line, user, password in rows:
+            if user.phone in existing_phones:
+                self.reject(line, user.phone, 'phone_exists')
+            elif user.username in existing_usernames:
+                self.reject(line, user.phone, 'username_exists')
+            else:
+                kept.append((line, user, password))
+        return kept
+
+    def hash_passwords(self, rows):
+        """Хэширует пароли пачки в пуле процессов или потоков"""
+        started = time.monotonic()
+        with_password = [user for _, user, password in rows if password is not None]
+        passwords = [password for _, _, password in rows if password is not None]
+
+        if passwords:
+            if self._pool is None:
+                create_pool = create_process_pool if self.hashing_processes else create_thread_pool
+                self._pool = create_pool(self.hashing_workers)
+            chunksize = max(1, len(passwords) // (self.hashing_workers * 4))
+            for user, encoded in zip(with_password, self._pool.map(hashers.make_password, passwords, chunksize=chunksize)):
+                user.password = encoded
+
+        for _, user, password in rows:
+            if password is None:
+                user.set_unusable_password()
+        self.report.hashing_seconds += time.monotonic() - started
+
+    def insert(self, rows):
+        started = time.monotonic()
+        users = [user for _, user, _ in rows]
+        deltas = {
+            name: delta * len(users)
+            for name, delta in UserCounter.objects.state_deltas(('user', self.verified), 1).items()
+        }
+
+        with transaction.atomic():
+            get_user_model().objects.bulk_create(users, batch_size=self.batch_size)
+            UserCounter.objects.adjust(deltas)
+
+        LoginGuard.invalidate_accounts(user.phone for user in users)
+        self.report.created += len(users)
+        self.report.insert_seconds += time.monotonic() - started
@@ -0,0 +1,43 @@
+"""
+Потоковая выгрузка пользователей в NDJSON или CSV
+
+Примеры:
+    python manage.py export_users > users.ndjson
+    python manage.py export_users --format csv --gzip --output users.csv.gz
+"""
+import sys
+from django.core.management.base import BaseCommand
+
+from users.export import EXPORT_FORMATS, FORMAT_NDJSON, export_users
+
+
+class Command(BaseCommand):
+    help = 'Выгружает всех пользователей в NDJSON или CSV серверным курсором, не загружая таблицу в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default=FORMAT_NDJSON,
+                            help='Формат выгрузки')
+        parser.add_argument('--output', default='-',
+                            help='Файл выгрузки (по умолчанию stdout)')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Сжать gzip')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Строк на одно чтение курсора (USERS_EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        chunks = export_users(options['format'], compress=options['gzip'], chunk_size=options['chunk_size'])
+
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+
+        self.stderr.write(self.style.SUCCESS(f"Записано {written} байт в {options['output']}"))
@@ -0,0 +1,92 @@
+"""
+Массовый импорт пользователей из CSV или NDJSON
+
+Примеры:
+    python manage.py import_users partners.csv --verified
+    python manage.py import_users partners.ndjson.gz --rejects rejects.ndjson
+    cat partners.ndjson | python manage.py import_users - --dry-run
+"""
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importing import (
+    IMPORT_FORMATS, REJECT_MESSAGES, ImportFormatError, UserImporter, detect_format, open_import_stream, read_records
+)
+
+
+class Command(BaseCommand):
+    help = 'Создает пользователей из CSV или NDJSON пачками через bulk_create, хэшируя пароли в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='Файл импорта или - для stdin')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, default=None,
+                            help='Формат файла (по умолчанию по расширению, для stdin - ndjson)')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Файл сжат gzip (для .gz определяется автоматически)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Строк на пачку (USERS_IMPORT_BATCH_SIZE)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Процессов хэширования паролей (USERS_IMPORT_HASHING_WORKERS)')
+        parser.add_argument('--verified', action='store_true',
+                            help='Номера подтверждены партнером')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить файл, ничего не создавая')
+        parser.add_argument('--rejects', default=None,
+                            help='Записать все отказы в NDJSON файл')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or detect_format(path)
+        compressed = options['gzip'] or path.lower().endswith('.gz')
+
+        rejects_file = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else None
+
+        def on_reject(line, phone, reason):
+            if rejects_file:
+                rejects_file.write(json.dumps(
+                    {'line': line, 'phone': phone, 'reason': reason, 'error': REJECT_MESSAGES[reason]},
+                    ensure_ascii=False
+                ) + '\n')
+
+        def on_batch(report):
+            self.stderr.write(
+                f"Пачка {report.batches}: обработано {report.processed}, создано {report.created}, "
+                f"отклонено {sum(report.rejected.values())} ({report.processed / report.elapsed:.0f} строк/с)"
+            )
+
+        importer = UserImporter(
+            batch_size=options['batch_size'],
+            hashing_workers=options['workers'],
+            verified=options['verified'],
+            dry_run=options['dry_run'],
+            on_reject=on_reject,
+            on_batch=on_batch
+        )
+
+        try:
+            source = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f"Не удалось открыть {path}: {e}")
+
+        try:
+            report = importer.run(read_records(open_import_stream(source, compressed), import_format))
+        except (ImportFormatError, UnicodeDecodeError, OSError, EOFError) as e:
+            raise CommandError(str(e))
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+            if rejects_file:
+                rejects_file.close()
+
+        stats = report.as_dict()
+        action = 'можно создать' if options['dry_run'] else 'создано'
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано {stats['processed']}, {action} {stats['created']}, отклонено {stats['rejected']} "
+            f"за {stats['elapsed_seconds']:.1f} с ({stats['rows_per_second']} строк/с, "
+            f"{stats['created_per_second']} пользователей/с; хэширование {stats['hashing_seconds']:.1f} с, "
+            f"вставка {stats['insert_seconds']:.1f} с)"
+        ))
+        for reason, count in sorted(stats['rejected_by_reason'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {reason}: {count} - {REJECT_MESSAGES[reason]}")
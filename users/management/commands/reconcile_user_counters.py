@@ -0,0 +1,40 @@
+"""
+Пересчет счетчиков статистики пользователей (UserCounter)
+
+Счетчики меняются сигналами; массовые операции (QuerySet.update, bulk_create)
+и ручные правки БД их не затрагивают. Команда пересчитывает все счетчики одним
+сгруппированным запросом и исправляет расхождения.
+
+Примеры:
+    python manage.py reconcile_user_counters
+    python manage.py reconcile_user_counters --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from users.models import UserCounter
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики статистики пользователей одним сгруппированным запросом'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            current = dict(UserCounter.objects.values_list('name', 'value'))
+            changes = {
+                name: (current.get(name), value)
+                for name, value in UserCounter.objects.compute().items() if current.get(name) != value
+            }
+        else:
+            changes = UserCounter.objects.reconcile()
+
+        for name, (old, new) in sorted(changes.items()):
+            self.stdout.write(f"{name}: {old} -> {new}")
+
+        if not changes:
+            self.stdout.write(self.style.SUCCESS('Счетчики совпадают с таблицей пользователей'))
+        elif not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено счетчиков: {len(changes)}"))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:21
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    """Начальные значения счетчиков одним сгруппированным запросом"""
+    User = apps.get_model('users', 'User')
+    UserCounter = apps.get_model('users', 'UserCounter')
+
+    counters = {'total': 0, 'verified': 0, 'role_user': 0, 'role_admin': 0, 'role_superadmin': 0}
+    rows = User.objects.order_by().values('role').annotate(
+        total=Count('id'),
+        verified=Count('id', filter=Q(is_phone_verified=True))
+    )
+    for row in rows:
+        counters['total'] += row['total']
+        counters['verified'] += row['verified']
+        counters[f"role_{row['role']}"] = row['total']
+
+    UserCounter.objects.bulk_create([UserCounter(name=name, value=value) for name, value in counters.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Счетчик')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счетчик пользователей',
+                'verbose_name_plural': 'Счетчики пользователей',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
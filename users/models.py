@@ -1,5 +1,9 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+# Поля пользователя, от которых зависят счетчики UserCounter
+COUNTED_FIELDS = ('role', 'is_phone_verified')
 
 
 class User(AbstractUser):
@@ -16,6 +20,7 @@ class User(AbstractUser):
     is_phone_verified = models.BooleanField(default=False, verbose_name='Телефон подтвержден')
     should_update_password = models.BooleanField(default=True, verbose_name='Требуется обновление пароля')
     registration_completed_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения регистрации')
+    token_epoch = models.PositiveIntegerField(default=0, verbose_name='Эпоха токенов')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     
@@ -25,10 +30,65 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Keyset пагинация списка пользователей (users.pagination)
+            models.Index(fields=['created_at', 'id'], name='user_created_at_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.phone} ({self.get_role_display()})"
     
+    def get_counted_state(self):
+        """(роль, телефон подтвержден) - состояние для счетчиков UserCounter"""
+        return self.role, self.is_phone_verified
+    
+    def _lock_counted_state(self):
+        """
+        Состояние строки в БД под блокировкой (None, если строки нет)
+        
+        Сигналы счетчиков вычитают его, а не снимок экземпляра: параллельные
+        смены роли одного пользователя применяются к счетчикам по очереди.
+        """
+        return User.objects.select_for_update().filter(pk=self.pk).values_list(*COUNTED_FIELDS).first()
+    
+    def save(self, *args, **kwargs):
+        # token_epoch меняется только атомарным TokenEpoch.bump_epoch, поэтому
+        # сохранение устаревшего экземпляра не должно откатывать отзыв токенов
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'token_epoch'
+            ]
+        
+        # Строка пользователя и счетчики UserCounter (сигнал post_save) меняются одной транзакцией
+        with transaction.atomic():
+            if not self._state.adding and set(COUNTED_FIELDS) & set(kwargs['update_fields']):
+                self._counted_state = self._lock_counted_state()
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self._counted_state = self._lock_counted_state()
+            return super().delete(*args, **kwargs)
+    
+    def set_password(self, raw_password):
+        # Хэширование выполняется в пуле authentication.hashing
+        from authentication.hashing import make_password
+        self.password = make_password(raw_password)
+        self._password = raw_password
+    
+    def check_password(self, raw_password):
+        """Проверяет пароль в пуле хэширования, при необходимости перехэширует"""
+        from authentication.hashing import check_password
+        
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Пароль не менялся, валидаторы password_changed вызывать не нужно
+            self._password = None
+            self.save(update_fields=['password'])
+        
+        return check_password(raw_password, self.password, setter)
+    
     def has_role(self, role):
         """Проверяет, есть ли у пользователя указанная роль"""
         return self.role == role
@@ -60,4 +120,102 @@ class User(AbstractUser):
         self.is_active = True
         self.is_phone_verified = True
         self.registration_completed_at = timezone.now()
-        self.save()
\ No newline at end of file
+        self.save()
+
+
+class UserCounterManager(models.Manager):
+    """Счетчики статистики пользователей"""
+    
+    @staticmethod
+    def state_deltas(state, sign):
+        """Изменения счетчиков при появлении (sign=1) или исчезновении (sign=-1) пользователя"""
+        role, is_phone_verified = state
+        deltas = {'total': sign, f'role_{role}': sign}
+        if is_phone_verified:
+            deltas['verified'] = sign
+        return deltas
+    
+    def adjust(self, deltas):
+        """Применяет {имя: изменение} одним UPDATE"""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        self.filter(name__in=deltas).update(value=F('value') + Case(
+            *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+            default=Value(0),
+            output_field=models.BigIntegerField()
+        ))
+    
+    def compute(self):
+        """Точные значения счетчиков одним сгруппированным запросом по таблице пользователей"""
+        counters = {'total': 0, 'verified': 0}
+        counters.update({f'role_{role}': 0 for role, _ in User.ROLE_CHOICES})
+        
+        rows = User.objects.order_by().values('role').annotate(
+            total=Count('id'),
+            verified=Count('id', filter=Q(is_phone_verified=True))
+        )
+        for row in rows:
+            counters['total'] += row['total']
+            counters['verified'] += row['verified']
+            counters[f"role_{row['role']}"] = row['total']
+        return counters
+    
+    def reconcile(self):
+        """
+        Пересчитывает счетчики по таблице пользователей
+        
+        Returns:
+            dict: {имя: (было, стало)} для расходившихся счетчиков
+        """
+        with transaction.atomic():
+            # Изменения пользователей ждут окончания пересчета
+            current = dict(self.select_for_update().values_list('name', 'value'))
+            counters = self.compute()
+            
+            for name, value in counters.items():
+                if current.get(name) != value:
+                    self.update_or_create(name=name, defaults={'value': value})
+        
+        return {
+            name: (current.get(name), value)
+            for name, value in counters.items() if current.get(name) != value
+        }
+    
+    def get_stats(self):
+        """Статистика пользователей из счетчиков одним запросом"""
+        counters = dict(self.values_list('name', 'value'))
+        return self.format_stats(counters)
+    
+    @staticmethod
+    def format_stats(counters):
+        role_stats = {role: counters.get(f'role_{role}', 0) for role, _ in User.ROLE_CHOICES}
+        return {
+            'total_users': counters.get('total', 0),
+            'verified_users': counters.get('verified', 0),
+            'admin_users': role_stats.get('admin', 0) + role_stats.get('superadmin', 0),
+            'role_stats': role_stats
+        }
+
+
+class UserCounter(models.Model):
+    """
+    Счетчик статистики пользователей: total, verified, role_<роль>
+    
+    Меняется сигналами при создании и удалении пользователя, смене роли и
+    подтверждении телефона (users/signals.py). Массовые операции
+    (QuerySet.update, bulk_create) сигналов не вызывают: после них нужен
+    UserCounter.objects.adjust(...) или manage.py reconcile_user_counters.
+    """
+    
+    name = models.CharField(max_length=50, primary_key=True, verbose_name='Счетчик')
+    value = models.BigIntegerField(default=0, verbose_name='Значение')
+    
+    objects = UserCounterManager()
+    
+    class Meta:
+        verbose_name = 'Счетчик пользователей'
+        verbose_name_plural = 'Счетчики пользователей'
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
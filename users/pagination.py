@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) пагинация списка пользователей
+
+Страницы упорядочены по (created_at, id) по убыванию; id различает пользователей
+с одинаковым created_at, поэтому порядок стабилен. Следующая страница
+выбирается условием "строго после последней строки", а не OFFSET: по индексу
+(created_at, id) читается только page_size + 1 строк, и стоимость страницы не
+зависит от глубины.
+
+Курсор непрозрачен для клиента: base64 от направления, created_at и id
+граничной строки. Ссылки next/previous строятся на текущий URL с параметром cursor.
+"""
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.utils.urls import replace_query_param
+
+CURSOR_PARAM = 'cursor'
+PAGE_SIZE_PARAM = 'page_size'
+
+DIRECTION_NEXT = 'n'
+DIRECTION_PREVIOUS = 'p'
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или создан не этим API"""
+
+
+def encode_cursor(direction, created_at, pk) -> str:
+    data = f"{direction}|{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (direction, created_at, pk) или InvalidCursor"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, created_at, pk = data.split('|')
+        created_at = datetime.fromisoformat(created_at)
+        pk = int(pk)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+    if direction not in (DIRECTION_NEXT, DIRECTION_PREVIOUS):
+        raise InvalidCursor(cursor)
+    if settings.USE_TZ != (created_at.tzinfo is not None):
+        raise InvalidCursor(cursor)
+    return direction, created_at, pk
+
+
+class KeysetPaginator:
+    """
+    Пагинация queryset по (created_at, id) по убыванию
+
+    Пример:
+        page = KeysetPaginator(request).paginate(User.objects.all())
+        page['results'], page['next'], page['previous']
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+    @staticmethod
+    def get_page_size(request) -> int:
+        default = settings.REST_FRAMEWORK['PAGE_SIZE']
+        try:
+            page_size = int(request.query_params.get(PAGE_SIZE_PARAM, default))
+        except ValueError:
+            return default
+        return min(max(page_size, 1), settings.USERS_MAX_PAGE_SIZE)
+
+    def paginate(self, queryset):
+        """
+        Возвращает {'results': [...], 'next': url | None, 'previous': url | None}
+
+        Raises:
+            InvalidCursor: при неверном параметре cursor
+        """
+        cursor = self.request.query_params.get(CURSOR_PARAM)
+        direction = DIRECTION_NEXT
+
+        if cursor is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            direction, created_at, pk = decode_cursor(cursor)
+            if direction == DIRECTION_NEXT:
+                # created_at__lte задает начало диапазона индекса, Q отсекает уже показанные строки
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at
+                ).order_by('-created_at', '-id')
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(id__gt=pk), created_at__gte=created_at
+                ).order_by('created_at', 'id')
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if direction == DIRECTION_PREVIOUS:
+            rows.reverse()
+
+        if not rows:
+            return {'results': [], 'next': None, 'previous': None}
+
+        # Переход назад всегда возвращает к уже показанной странице, поэтому
+        # вперед от нее есть строки; для первой страницы ссылки назад нет
+        has_next = has_more if direction == DIRECTION_NEXT else True
+        has_previous = has_more if direction == DIRECTION_PREVIOUS else cursor is not None
+
+        return {
+            'results': rows,
+            'next': self.link(encode_cursor(DIRECTION_NEXT, rows[-1].created_at, rows[-1].pk)) if has_next else None,
+            'previous': (
+                self.link(encode_cursor(DIRECTION_PREVIOUS, rows[0].created_at, rows[0].pk)) if has_previous else None
+            ),
+        }
+
+    def link(self, cursor):
+        return replace_query_param(self.request.build_absolute_uri(), CURSOR_PARAM, cursor)
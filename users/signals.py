@@ -0,0 +1,43 @@
+"""
+Сигналы для счетчиков статистики пользователей (UserCounter)
+
+User.save и User.delete выполняются в транзакции и перед записью читают
+прежнее состояние строки под блокировкой (User._counted_state), поэтому
+счетчики меняются вместе со строкой пользователя или не меняются вовсе.
+QuerySet.delete тоже выполняется в транзакции, состояние берется из
+выбранных им строк.
+"""
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import COUNTED_FIELDS, UserCounter
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_user_counters(sender, instance, created, update_fields=None, **kwargs):
+    """Учитывает нового пользователя, смену роли и подтверждение телефона"""
+    state = instance.get_counted_state()
+    
+    if created:
+        UserCounter.objects.adjust(UserCounter.objects.state_deltas(state, 1))
+    else:
+        if update_fields is not None and not set(COUNTED_FIELDS) & set(update_fields):
+            return
+        
+        # Строки не было в БД до сохранения - поправит reconcile_user_counters
+        previous = getattr(instance, '_counted_state', None)
+        if previous is not None and previous != state:
+            deltas = UserCounter.objects.state_deltas(state, 1)
+            for name, delta in UserCounter.objects.state_deltas(previous, -1).items():
+                deltas[name] = deltas.get(name, 0) + delta
+            UserCounter.objects.adjust(deltas)
+    
+    instance._counted_state = state
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def remove_user_from_counters(sender, instance, **kwargs):
+    """Вычитает удаленного пользователя"""
+    state = getattr(instance, '_counted_state', None) or instance.get_counted_state()
+    UserCounter.objects.adjust(UserCounter.objects.state_deltas(state, -1))
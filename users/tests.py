@@ -1,3 +1,180 @@
+import base64
+import csv
+import io
+from datetime import timedelta
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+from .export import FORMAT_CSV, export_users
+from .models import UserCounter
+from .pagination import DIRECTION_NEXT, InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+
+User = get_user_model()
+
+
+def redis_available():
+    """Сигналы пользователей и троттлинг работают с настоящим Redis из REDIS_URL"""
+    try:
+        return get_redis_connection('default').ping()
+    except Exception:
+        return False
+
+
+requires_redis = skipUnless(redis_available(), 'Redis недоступен')
+
+
+@requires_redis
+class KeysetPaginatorTests(TestCase):
+    """Переходы next/previous при одинаковом created_at и неверные курсоры"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            User.objects.create_user(username=f'keyset_{i}', phone=f'+7999000{i:04d}')
+
+        # Три группы пользователей с одинаковым created_at: порядок задает id
+        now = timezone.now()
+        pks = list(User.objects.order_by('id').values_list('id', flat=True))
+        for offset, group in enumerate((pks[:3], pks[3:5], pks[5:])):
+            User.objects.filter(pk__in=group).update(created_at=now - timedelta(minutes=offset))
+
+        cls.expected = list(User.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def paginate(self, url='/api/users/?page_size=3'):
+        return KeysetPaginator(Request(APIRequestFactory().get(url))).paginate(User.objects.all())
+
+    @staticmethod
+    def ids(page):
+        return [user.pk for user in page['results']]
+
+    def test_next_pages_cover_all_rows_once(self):
+        pages = [self.paginate()]
+        while pages[-1]['next']:
+            pages.append(self.paginate(pages[-1]['next']))
+
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], self.expected)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_previous_returns_to_shown_pages(self):
+        first = self.paginate()
+        second = self.paginate(first['next'])
+        third = self.paginate(second['next'])
+
+        back_to_second = self.paginate(third['previous'])
+        self.assertEqual(self.ids(back_to_second), self.ids(second))
+        self.assertIsNotNone(back_to_second['next'])
+
+        back_to_first = self.paginate(back_to_second['previous'])
+        self.assertEqual(self.ids(back_to_first), self.ids(first))
+        self.assertIsNone(back_to_first['previous'])
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(DIRECTION_NEXT, created_at, 42)), (DIRECTION_NEXT, created_at, 42))
+
+    def test_invalid_cursors(self):
+        naive = timezone.now().replace(tzinfo=None).isoformat()
+        cursors = [
+            'not-a-cursor',
+            base64.urlsafe_b64encode(b'x|2025-01-01T00:00:00+00:00|1').decode(),
+            base64.urlsafe_b64encode(b'n|yesterday|1').decode(),
+            base64.urlsafe_b64encode(b'n|2025-01-01T00:00:00+00:00|abc').decode(),
+            base64.urlsafe_b64encode(f'n|{naive}|1'.encode()).decode(),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    self.paginate(f'/api/users/?cursor={cursor}')
+
+    def test_invalid_cursor_response(self):
+        admin = User.objects.create_user(username='keyset_admin', phone='+79991000000', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get('/api/users/', {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Неверный курсор'})
+
+
+@requires_redis
+class UserCounterTests(TestCase):
+    """Счетчики меняются вместе со строкой пользователя и сходятся с пересчетом"""
+
+    def counters(self):
+        return dict(UserCounter.objects.values_list('name', 'value'))
+
+    def assertDeltas(self, before, expected):
+        after = self.counters()
+        deltas = {name: after[name] - before.get(name, 0) for name in after if after[name] != before.get(name, 0)}
+        self.assertEqual(deltas, expected)
+        self.assertEqual(UserCounter.objects.reconcile(), {})
+
+    def test_create_verify_role_change_delete(self):
+        before = self.counters()
+        user = User.objects.create_user(username='counted', phone='+79992000001')
+        self.assertDeltas(before, {'total': 1, 'role_user': 1})
+
+        before = self.counters()
+        user.is_phone_verified = True
+        user.save(update_fields=['is_phone_verified'])
+        self.assertDeltas(before, {'verified': 1})
+
+        before = self.counters()
+        user.role = 'admin'
+        user.save()
+        self.assertDeltas(before, {'role_user': -1, 'role_admin': 1})
+
+        before = self.counters()
+        user.delete()
+        self.assertDeltas(before, {'total': -1, 'verified': -1, 'role_admin': -1})
+
+    def test_unrelated_update_keeps_counters(self):
+        user = User.objects.create_user(username='counted', phone='+79992000002')
+
+        before = self.counters()
+        user.first_name = 'Иван'
+        user.save(update_fields=['first_name'])
+        self.assertDeltas(before, {})
+
+    def test_stale_instance_save(self):
+        User.objects.create_user(username='counted', phone='+79992000003')
+        first = User.objects.get(phone='+79992000003')
+        stale = User.objects.get(phone='+79992000003')
+
+        first.role = 'admin'
+        first.save()
+
+        # Устаревший экземпляр записывает прежнюю роль: изменение считается от строки в БД
+        before = self.counters()
+        stale.first_name = 'Иван'
+        stale.save()
+        self.assertDeltas(before, {'role_admin': -1, 'role_user': 1})
+
+
+@requires_redis
+class CSVExportTests(TestCase):
+    """Экранирование формул в выгрузке CSV"""
+
+    def export_rows(self):
+        data = b''.join(export_users(FORMAT_CSV)).decode()
+        return list(csv.DictReader(io.StringIO(data)))
+
+    def test_phone_is_exported_unchanged(self):
+        User.objects.create_user(username='exported', phone='+79993000001')
+
+        row, = self.export_rows()
+        self.assertEqual(row['phone'], '+79993000001')
+
+    def test_formula_is_escaped(self):
+        User.objects.create_user(username='exported', phone='+79993000002', first_name='=HYPERLINK("x")', last_name='+1+1')
+
+        row, = self.export_rows()
+        self.assertEqual(row['first_name'], '\'=HYPERLINK("x")')
+        self.assertEqual(row['last_name'], "'+1+1")
@@ -8,4 +8,6 @@ urlpatterns = [
     path('<int:user_id>/role/', views.update_user_role, name='update_user_role'),
     path('<int:user_id>/delete/', views.delete_user, name='delete_user'),
     path('stats/', views.user_stats, name='user_stats'),
+    path('export/', views.export_users_view, name='export_users'),
+    path('import/', views.import_users_view, name='import_users'),
 ]
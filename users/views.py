@@ -1,12 +1,25 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
+from itertools import islice
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from authentication.cache_utils import TokenEpoch
 from authentication.decorators import require_roles
+from authentication.throttling import AdminThrottle
 from authentication.serializers import UserSerializer
+from .counting import count_users, is_exact_requested
+from .export import CONTENT_TYPES, EXPORT_FORMATS, FORMAT_NDJSON, export_filename, export_users
+from .importing import (
+    IMPORT_FIELDS, IMPORT_FORMATS, ImportFormatError, UserImporter, detect_format, open_import_stream, read_records
+)
+from .models import UserCounter
+from .pagination import InvalidCursor, KeysetPaginator
 
 User = get_user_model()
 
@@ -14,7 +27,24 @@ User = get_user_model()
 @swagger_auto_schema(
     method='get',
     operation_summary='Список всех пользователей',
-    operation_description='Возвращает список всех пользователей в системе (только для администраторов)',
+    operation_description=(
+        'Возвращает страницу пользователей, новые первыми (только для администраторов). '
+        'Следующая и предыдущая страницы - по ссылкам next и previous'
+    ),
+    manual_parameters=[
+        openapi.Parameter(
+            'cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+            description='Курсор страницы из ссылок next/previous'
+        ),
+        openapi.Parameter(
+            'page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+            description='Пользователей на странице (по умолчанию 20, не больше USERS_MAX_PAGE_SIZE)'
+        ),
+        openapi.Parameter(
+            'exact', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+            description='Точный count вместо оценки или кэшированного значения'
+        ),
+    ],
     responses={
         200: openapi.Response(
             description='Список пользователей',
@@ -34,7 +64,18 @@ User = get_user_model()
                             'created_at': '2025-01-05T08:00:00Z'
                         }
                     ],
-                    'count': 1
+                    'count': 1,
+                    'count_exact': False,
+                    'next': 'http://localhost:8000/api/users/?cursor=bnwyMDI1LTAxLTA1VDA4OjAwOjAwKzAwOjAwfDE',
+                    'previous': None
+                }
+            }
+        ),
+        400: openapi.Response(
+            description='Неверный курсор',
+            examples={
+                'application/json': {
+                    'error': 'Неверный курсор'
                 }
             }
         ),
@@ -58,14 +99,26 @@ User = get_user_model()
 )
 @api_view(['GET'])
 @require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
 def user_list(request):
     """Список всех пользователей (только для админов)"""
-    users = User.objects.all().order_by('-created_at')
-    serializer = UserSerializer(users, many=True)
+    users = User.objects.all()
+    
+    try:
+        page = KeysetPaginator(request).paginate(users)
+    except InvalidCursor:
+        return Response({
+            'error': 'Неверный курсор'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    count, count_exact = count_users('total', users, exact=is_exact_requested(request))
     
     return Response({
-        'users': serializer.data,
-        'count': users.count()
+        'users': UserSerializer(page['results'], many=True).data,
+        'count': count,
+        'count_exact': count_exact,
+        'next': page['next'],
+        'previous': page['previous']
     }, status=status.HTTP_200_OK)
 
 
@@ -121,6 +174,7 @@ def user_list(request):
 )
 @api_view(['GET'])
 @require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
 def user_detail(request, user_id):
     """Детальная информация о пользователе (только для админов)"""
     try:
@@ -209,6 +263,7 @@ def user_detail(request, user_id):
 )
 @api_view(['PUT'])
 @require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
 def update_user_role(request, user_id):
     """Изменение роли пользователя (только для админов)"""
     try:
@@ -229,6 +284,9 @@ def update_user_role(request, user_id):
         user.role = new_role
         user.save()
         
+        # Токены со старой ролью больше не действуют
+        TokenEpoch.bump_epoch(user.pk)
+        
         return Response({
             'message': 'Роль пользователя обновлена',
             'user': UserSerializer(user).data
@@ -289,6 +347,7 @@ def update_user_role(request, user_id):
 )
 @api_view(['DELETE'])
 @require_roles('superadmin')
+@throttle_classes([AdminThrottle])
 def delete_user(request, user_id):
     """Удаление пользователя (только для суперадмина)"""
     try:
@@ -315,7 +374,17 @@ def delete_user(request, user_id):
 @swagger_auto_schema(
     method='get',
     operation_summary='Статистика пользователей',
-    operation_description='Возвращает статистику по пользователям системы (только для администраторов)',
+    operation_description=(
+        'Возвращает статистику по пользователям системы (только для администраторов). '
+        'Числа берутся из счетчиков, которые обновляются при изменении пользователей; '
+        'exact=true - подсчет по таблице пользователей'
+    ),
+    manual_parameters=[
+        openapi.Parameter(
+            'exact', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+            description='Подсчет по таблице вместо счетчиков'
+        ),
+    ],
     responses={
         200: openapi.Response(
             description='Статистика пользователей',
@@ -328,7 +397,8 @@ def delete_user(request, user_id):
                         'user': 90,
                         'admin': 4,
                         'superadmin': 1
-                    }
+                    },
+                    'exact': False
                 }
             }
         ),
@@ -352,19 +422,247 @@ def delete_user(request, user_id):
 )
 @api_view(['GET'])
 @require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
 def user_stats(request):
     """Статистика пользователей (только для админов)"""
-    total_users = User.objects.count()
-    verified_users = User.objects.filter(is_phone_verified=True).count()
-    admin_users = User.objects.filter(role__in=['admin', 'superadmin']).count()
+    exact = is_exact_requested(request)
     
-    role_stats = {}
-    for role, display_name in User.ROLE_CHOICES:
-        role_stats[role] = User.objects.filter(role=role).count()
+    # Счетчики UserCounter - один запрос; exact - один сгруппированный запрос по таблице
+    if exact:
+        stats = UserCounter.objects.format_stats(UserCounter.objects.compute())
+    else:
+        stats = UserCounter.objects.get_stats()
     
     return Response({
-        'total_users': total_users,
-        'verified_users': verified_users,
-        'admin_users': admin_users,
-        'role_stats': role_stats
-    }, status=status.HTTP_200_OK)
\ No newline at end of file
+        **stats,
+        'exact': exact
+    }, status=status.HTTP_200_OK)
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_summary='Выгрузка пользователей',
+    operation_description=(
+        'Потоковая выгрузка всех пользователей в NDJSON или CSV (только для администраторов). '
+        'Память сервера не зависит от числа пользователей. Выгрузка должна уложиться в таймаут '
+        'воркера gunicorn (120 с), для больших баз используйте команду export_users'
+    ),
+    manual_parameters=[
+        openapi.Parameter(
+            'export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+            enum=list(EXPORT_FORMATS), default=FORMAT_NDJSON,
+            description='Формат выгрузки'
+        ),
+        openapi.Parameter(
+            'gzip', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+            description='Сжать gzip (файл .gz)'
+        ),
+    ],
+    responses={
+        200: openapi.Response(
+            description='Файл выгрузки',
+            examples={
+                'application/x-ndjson': (
+                    '{"id": 1, "phone": "+1234567890", "username": "john_doe", "email": "john@example.com", '
+                    '"first_name": "John", "last_name": "Doe", "role": "user", "is_active": true, '
+                    '"is_phone_verified": true, "should_update_password": false, '
+                    '"created_at": "2025-01-05T08:00:00+00:00", "registration_completed_at": "2025-01-05T08:01:00+00:00"}'
+                )
+            }
+        ),
+        400: openapi.Response(
+            description='Неверный формат',
+            examples={
+                'application/json': {
+                    'error': 'Неверный формат. Доступны: ndjson, csv'
+                }
+            }
+        ),
+        401: openapi.Response(
+            description='Требуется аутентификация',
+            examples={
+                'application/json': {
+                    'error': 'Требуется аутентификация'
+                }
+            }
+        ),
+        403: openapi.Response(
+            description='Недостаточно прав доступа',
+            examples={
+                'application/json': {
+                    'error': 'Недостаточно прав доступа'
+                }
+            }
+        )
+    }
+)
+@api_view(['GET'])
+@require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
+def export_users_view(request):
+    """Потоковая выгрузка пользователей (только для админов)"""
+    export_format = request.query_params.get('export_format', FORMAT_NDJSON)
+    compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    if export_format not in EXPORT_FORMATS:
+        return Response({
+            'error': f"Неверный формат. Доступны: {', '.join(EXPORT_FORMATS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(
+        export_users(export_format, compress=compress),
+        content_type='application/gzip' if compress else CONTENT_TYPES[export_format]
+    )
+    # Буферизацию nginx не отключаем: он забирает выгрузку во временный файл и
+    # освобождает sync воркер gunicorn, не дожидаясь медленного клиента
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(export_format, compress)}"'
+    return response
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_summary='Импорт пользователей',
+    operation_description=(
+        'Массовое создание пользователей из CSV или NDJSON (только для администраторов). '
+        f"Поля: {', '.join(IMPORT_FIELDS)}; обязателен только phone. "
+        'Существующие номера и повторы пропускаются и попадают в отчет. '
+        'Файл не больше USERS_IMPORT_MAX_UPLOAD_SIZE байт (2 МБ) и USERS_IMPORT_MAX_ROWS строк (200) '
+        'обрабатывается целиком до ответа; для больших файлов используйте команду import_users'
+    ),
+    manual_parameters=[
+        openapi.Parameter(
+            'file', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True,
+            description='Файл .csv, .ndjson или сжатый .gz'
+        ),
+        openapi.Parameter(
+            'import_format', openapi.IN_FORM, type=openapi.TYPE_STRING,
+            enum=list(IMPORT_FORMATS),
+            description='Формат файла (по умолчанию по расширению)'
+        ),
+        openapi.Parameter(
+            'verified', openapi.IN_FORM, type=openapi.TYPE_BOOLEAN,
+            description='Номера подтверждены партнером'
+        ),
+        openapi.Parameter(
+            'dry_run', openapi.IN_FORM, type=openapi.TYPE_BOOLEAN,
+            description='Только проверить файл, ничего не создавая'
+        ),
+    ],
+    responses={
+        200: openapi.Response(
+            description='Импорт выполнен',
+            examples={
+                'application/json': {
+                    'message': 'Импорт завершен',
+                    'report': {
+                        'processed': 3,
+                        'created': 2,
+                        'rejected': 1,
+                        'rejected_by_reason': {'phone_exists': 1},
+                        'reject_samples': [
+                            {
+                                'line': 3,
+                                'phone': '+1234567890',
+                                'reason': 'phone_exists',
+                                'error': 'Пользователь с таким номером уже существует'
+                            }
+                        ],
+                        'elapsed_seconds': 0.412,
+                        'hashing_seconds': 0.38,
+                        'insert_seconds': 0.011,
+                        'rows_per_second': 7.3,
+                        'created_per_second': 4.9,
+                        'dry_run': False
+                    }
+                }
+            }
+        ),
+        400: openapi.Response(
+            description='Файл не передан или не может быть импортирован',
+            examples={
+                'application/json': {
+                    'error': 'В CSV нет столбца phone'
+                }
+            }
+        ),
+        401: openapi.Response(
+            description='Требуется аутентификация',
+            examples={
+                'application/json': {
+                    'error': 'Требуется аутентификация'
+                }
+            }
+        ),
+        403: openapi.Response(
+            description='Недостаточно прав доступа',
+            examples={
+                'application/json': {
+                    'error': 'Недостаточно прав доступа'
+                }
+            }
+        ),
+        413: openapi.Response(
+            description='Файл больше пределов эндпоинта',
+            examples={
+                'application/json': {
+                    'error': 'В файле больше 200 строк. Импортируйте его командой import_users'
+                }
+            }
+        )
+    }
+)
+@api_view(['POST'])
+@require_roles('admin', 'superadmin')
+@throttle_classes([AdminThrottle])
+@parser_classes([MultiPartParser])
+def import_users_view(request):
+    """Массовый импорт пользователей (только для админов)"""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({
+            'error': 'Файл не передан'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    import_format = request.data.get('import_format') or detect_format(upload.name)
+    if import_format not in IMPORT_FORMATS:
+        return Response({
+            'error': f"Неверный формат. Доступны: {', '.join(IMPORT_FORMATS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if upload.size > settings.USERS_IMPORT_MAX_UPLOAD_SIZE:
+        return Response({
+            'error': f"Файл больше {settings.USERS_IMPORT_MAX_UPLOAD_SIZE} байт. Импортируйте его командой import_users"
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    # Файл читается целиком до импорта: лишние строки, битый gzip или кодировка
+    # отклоняют его, ничего не создав
+    stream = open_import_stream(upload, compressed=upload.name.lower().endswith('.gz'))
+    max_rows = settings.USERS_IMPORT_MAX_ROWS
+    try:
+        records = list(islice(read_records(stream, import_format), max_rows + 1))
+    except (ImportFormatError, UnicodeDecodeError, OSError, EOFError) as e:
+        # OSError и EOFError - поврежденный gzip
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(records) > max_rows:
+        return Response({
+            'error': f"В файле больше {max_rows} строк. Импортируйте его командой import_users"
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    # Пул потоков вместо пула процессов: fork многопоточного воркера gunicorn небезопасен
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    importer = UserImporter(
+        verified=str(request.data.get('verified', '')).lower() in ('1', 'true', 'yes'),
+        dry_run=dry_run,
+        # Одной пачкой: файл импортируется в одной транзакции или не импортируется вовсе
+        batch_size=max_rows,
+        hashing_processes=False
+    )
+    report = importer.run(records)
+    
+    return Response({
+        'message': 'Проверка завершена' if dry_run else 'Импорт завершен',
+        'report': {**report.as_dict(), 'dry_run': dry_run}
+    }, status=status.HTTP_200_OK)